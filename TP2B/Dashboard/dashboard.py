@@ -6,10 +6,7 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-import grpc
-import xmlrpc.client
-import sales_pb2
-import sales_pb2_grpc
+from dashboard_data import load_panels
 
 # Configuração da página
 st.set_page_config(
@@ -22,36 +19,15 @@ st.set_page_config(
 st.title("Análise de Vendas")
 st.markdown("---")
 
-class DashboardData:
-    def __init__(self):
-        self.grpc_channel = grpc.insecure_channel('localhost:50051')
-        self.grpc_stub = sales_pb2_grpc.SalesServiceStub(self.grpc_channel)
-        self.xmlrpc_proxy = xmlrpc.client.ServerProxy('http://localhost:8000/RPC2')
-    
-    def get_sales_stats(self):
-        """Obtém estatísticas via gRPC"""
-        try:
-            response = self.grpc_stub.GetSalesStats(sales_pb2.StatsRequest(field='region'))
-            return response
-        except:
-            return None
-    
-    def get_top_products(self, limit=10):
-        """Obtém produtos mais vendidos via XML-RPC"""
-        try:
-            return self.xmlrpc_proxy.get_top_products(limit)
-        except:
-            return []
-    
-    def get_sales_by_state(self):
-        """Obtém vendas por estado via XML-RPC"""
-        try:
-            return self.xmlrpc_proxy.get_sales_by_state()
-        except:
-            return []
-
 def main():
-    data_client = DashboardData()
+    # Todos os painéis em uma chamada (GetDashboardSummary), em cache pelo etag
+    # loss_states: "Áreas de Atenção" lista todos os estados com prejuízo
+    panels = load_panels(top_n=10, states_n=10, loss_states=True)
+    for name, error in panels['errors'].items():
+        st.error(f"Erro ao carregar {name}: {error}")
+    loaded = not panels['errors']
+    kpis = panels['kpis']
+    regions_data = panels['regions']
     
     # Métricas Principais (KPI Cards)
     st.subheader("Métricas Principais")
@@ -59,31 +35,29 @@ def main():
     col1, col2, col3, col4 = st.columns(4)
     
     try:
-        stats = data_client.get_sales_stats()
-        
         with col1:
-            total_sales = sum(stats.total_sales.values()) if stats else 0
+            total_sales = kpis.get('total_sales', 0)
             st.metric(
                 label="Total de Vendas",
                 value=f"${total_sales:,.2f}"
             )
         
         with col2:
-            total_profit = sum(stats.total_profit.values()) if stats else 0
+            total_profit = kpis.get('total_profit', 0)
             st.metric(
                 label="Lucro Total",
                 value=f"${total_profit:,.2f}"
             )
         
         with col3:
-            total_records = sum(stats.record_count.values()) if stats else 0
+            total_records = kpis.get('total_records', 0)
             st.metric(
                 label="Total de Pedidos",
                 value=f"{total_records:,}"
             )
         
         with col4:
-            avg_sale = total_sales / total_records if total_records > 0 else 0
+            avg_sale = kpis.get('average_sale', 0)
             st.metric(
                 label="Ticket Médio",
                 value=f"${avg_sale:.2f}"
@@ -101,11 +75,10 @@ def main():
         st.subheader("Vendas por Região")
         
         try:
-            stats = data_client.get_sales_stats()
-            if stats:
-                regions = list(stats.total_sales.keys())
-                sales = list(stats.total_sales.values())
-                profits = list(stats.total_profit.values())
+            if regions_data:
+                regions = [r['name'] for r in regions_data]
+                sales = [r['sales'] for r in regions_data]
+                profits = [r['profit'] for r in regions_data]
                 
                 # Gráfico de barras com vendas e lucro
                 fig = go.Figure()
@@ -134,10 +107,10 @@ def main():
         st.subheader("Top 10 Produtos")
         
         try:
-            top_products = data_client.get_top_products(10)
+            top_products = panels['top_products']
             if top_products:
-                products = [p['product'][:30] + "..." if len(p['product']) > 30 else p['product'] for p in top_products]
-                sales = [p['total_sales'] for p in top_products]
+                products = [p['name'][:30] + "..." if len(p['name']) > 30 else p['name'] for p in top_products]
+                sales = [p['sales'] for p in top_products]
                 
                 fig = px.bar(
                     x=sales,
@@ -157,13 +130,10 @@ def main():
         st.subheader("Estados com Maior Lucro")
         
         try:
-            states_data = data_client.get_sales_by_state()
-            if states_data:
-                # Filtrar estados com lucro positivo
-                estados_lucro = [s for s in states_data if s['profit'] > 0]
-                estados_lucro = sorted(estados_lucro, key=lambda x: x['profit'], reverse=True)[:10]
-                
-                estados = [s['state'] for s in estados_lucro]
+            # Estados com lucro positivo, já ordenados pelo servidor
+            estados_lucro = panels['top_states']
+            if estados_lucro:
+                estados = [s['name'] for s in estados_lucro]
                 lucros = [s['profit'] for s in estados_lucro]
                 
                 fig = px.bar(
@@ -182,14 +152,12 @@ def main():
         st.subheader("Estados com Prejuízo")
         
         try:
-            states_data = data_client.get_sales_by_state()
-            if states_data:
-                # Filtrar estados com prejuízo
-                estados_prejuizo = [s for s in states_data if s['profit'] < 0]
-                estados_prejuizo = sorted(estados_prejuizo, key=lambda x: x['profit'])[:10]  # Ordena do menor (mais negativo)
+            if loaded:
+                # Estados com prejuízo, do maior para o menor (ordenados pelo servidor)
+                estados_prejuizo = panels['bottom_states']
                 
                 if estados_prejuizo:
-                    estados = [s['state'] for s in estados_prejuizo]
+                    estados = [s['name'] for s in estados_prejuizo]
                     prejuizos = [s['profit'] for s in estados_prejuizo]
                     
                     fig = px.bar(
@@ -210,9 +178,8 @@ def main():
     st.subheader("Áreas de Atenção")
     
     try:
-        states_data = data_client.get_sales_by_state()
-        if states_data:
-            problemas = [s for s in states_data if s['profit'] < 0]
+        if loaded:
+            problemas = panels['loss_states']
             
             if problemas:
                 df_problemas = pd.DataFrame(problemas)
@@ -220,9 +187,9 @@ def main():
                 df_problemas['sales'] = df_problemas['sales'].apply(lambda x: f"${x:,.2f}")
                 
                 st.dataframe(
-                    df_problemas[['state', 'sales', 'profit', 'count']],
+                    df_problemas[['name', 'sales', 'profit', 'count']],
                     column_config={
-                        "state": "Estado",
+                        "name": "Estado",
                         "sales": "Vendas", 
                         "profit": "Prejuízo",
                         "count": "Pedidos"
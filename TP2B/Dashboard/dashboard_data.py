@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Camada de dados do dashboard
+
+- Canal gRPC criado uma vez por processo (st.cache_resource), e não a
+  cada rerun do Streamlit.
+- Todos os painéis vêm de uma única chamada, GetDashboardSummary, montada
+  pelo servidor a partir dos agregados pré-calculados.
+- A resposta anterior é reaproveitada pelo etag: se o dataset não mudou,
+  o servidor responde só `not_modified`. Entre reruns próximos a página
+  usa o cache (st.cache_data) sem chamada nenhuma.
+"""
+import os
+import threading
+
+import grpc
+import streamlit as st
+
+import sales_pb2
+import sales_pb2_grpc
+
+
+GRPC_TARGET = os.environ.get('GRPC_TARGET', 'localhost:50051')
+
+# Tempo limite de cada RPC (segundos)
+RPC_TIMEOUT = 10
+
+# Intervalo entre verificações de mudança no dataset (segundos)
+SUMMARY_TTL = 5
+
+PANELS = ('regions', 'top_products', 'top_states', 'bottom_states', 'loss_states')
+
+
+class DashboardData:
+    """Cliente do servidor gRPC, compartilhado entre as sessões do dashboard"""
+
+    def __init__(self, grpc_target=GRPC_TARGET):
+        self.grpc_channel = grpc.insecure_channel(grpc_target)
+        self.grpc_stub = sales_pb2_grpc.SalesServiceStub(self.grpc_channel)
+        self._summaries = {}  # (top_n, states_n, loss_states) -> (etag, painéis)
+        self._lock = threading.Lock()
+
+    def get_summary(self, top_n=10, states_n=10, loss_states=False):
+        """Painéis do dashboard: {'kpis', 'regions', 'top_products',
+        'top_states', 'bottom_states', 'loss_states', 'etag'}; 'loss_states'
+        (todos os estados com prejuízo) só vem preenchido se pedido"""
+        key = (top_n, states_n, loss_states)
+        with self._lock:
+            etag, panels = self._summaries.get(key, ('', None))
+
+        response = self.grpc_stub.GetDashboardSummary(
+            sales_pb2.DashboardSummaryRequest(top_n=top_n, states_n=states_n,
+                                              loss_states=loss_states, if_none_match=etag),
+            timeout=RPC_TIMEOUT)
+        if response.not_modified and panels is not None:
+            return panels
+
+        panels = {
+            'etag': response.etag,
+            'kpis': {
+                'total_sales': response.total_sales,
+                'total_profit': response.total_profit,
+                'total_records': response.total_records,
+                'total_orders': response.total_orders,
+                'average_sale': response.average_sale
+            }
+        }
+        for panel in PANELS:
+            panels[panel] = [
+                {'name': group.name, 'sales': group.sales,
+                 'profit': group.profit, 'count': group.count}
+                for group in getattr(response, panel)
+            ]
+        with self._lock:
+            self._summaries[key] = (response.etag, panels)
+        return panels
+
+
+@st.cache_resource
+def get_client():
+    """Cliente único por processo (reaproveitado entre reruns e sessões)"""
+    return DashboardData()
+
+
+@st.cache_data(ttl=SUMMARY_TTL, show_spinner=False)
+def _cached_summary(top_n, states_n, loss_states):
+    return get_client().get_summary(top_n, states_n, loss_states)
+
+
+def load_panels(top_n=10, states_n=10, loss_states=False):
+    """Painéis do dashboard; em caso de falha, painéis vazios e o erro em 'errors'"""
+    try:
+        panels = dict(_cached_summary(top_n, states_n, loss_states))
+        panels['errors'] = {}
+    except grpc.RpcError as e:
+        # Exceções não ficam em cache: a próxima renderização tenta de novo
+        panels = {panel: [] for panel in PANELS}
+        panels['kpis'] = {}
+        panels['errors'] = {'resumo': e.details() or str(e.code())}
+    return panels
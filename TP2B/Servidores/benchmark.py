@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga dos servidores gRPC e XML-RPC
+
+Para cada escala do dataset (1x = CSV original, 10x, 100x...) o XML é
+gerado com o conversor, os dois servidores são iniciados em portas
+livres e cada método é chamado por N clientes simultâneos durante um
+tempo fixo. O resultado (latência p50/p95/p99, requisições por segundo,
+memória RSS do servidor) é impresso em tabela e gravado em JSON;
+`--compare` mostra a variação em relação a uma execução anterior.
+Com `--synthetic`, as escalas acima de 1x vêm do gerador de dados
+sintéticos (data_generator.py) em vez de cópias do CSV original.
+
+    python benchmark.py ../Data/retail_orders_full_dataset.csv --scales 1 10 100 \\
+        --concurrency 1 8 --duration 10 --output bench.json
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import shlex
+import socket
+import subprocess
+import sys
+import threading
+import time
+import xmlrpc.client
+
+import grpc
+import numpy as np
+from tabulate import tabulate
+
+import sales_pb2
+import sales_pb2_grpc
+from csv_to_xml_converter import CSVtoXMLConverter
+from data_generator import DEFAULT_SEED, generate_csv
+
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Tempo máximo para um servidor ficar pronto (a primeira carga grava o snapshot)
+STARTUP_TIMEOUT = 600
+
+# Chamadas de aquecimento por método, fora da medição
+WARMUP_CALLS = 5
+
+
+def _grpc_methods():
+    """Nome -> função(stub) de cada chamada gRPC medida"""
+    return {
+        'GetRecordsByRegion': lambda stub: stub.GetRecordsByRegion(
+            sales_pb2.RegionRequest(region='West', page_size=100)),
+        'GetSalesStats': lambda stub: stub.GetSalesStats(
+            sales_pb2.StatsRequest(field='region')),
+        'GetSalesStats[region,category,year]': lambda stub: stub.GetSalesStats(
+            sales_pb2.StatsRequest(group_by=['region', 'category', 'year'])),
+        'Query': lambda stub: stub.Query(sales_pb2.QueryRequest(
+            where=[sales_pb2.Predicate(field='region', op='eq', values=['West']),
+                   sales_pb2.Predicate(field='sales', op='range', lower='100')],
+            group_by=['product_name'],
+            aggregates=[sales_pb2.Aggregate(func='sum', field='sales')],
+            limit=10)),
+        'GetTimeSeries': lambda stub: stub.GetTimeSeries(
+            sales_pb2.TimeSeriesRequest(granularity='month', split_by='region')),
+        'GetDashboardSummary': lambda stub: stub.GetDashboardSummary(
+            sales_pb2.DashboardSummaryRequest()),
+        'ExecuteXPath': lambda stub: stub.ExecuteXPath(
+            sales_pb2.XPathRequest(xpath_query="count(//ns:Record[ns:Region='West'])")),
+    }
+
+
+def _xmlrpc_methods():
+    """Nome -> função(proxy) de cada chamada XML-RPC medida"""
+    return {
+        'get_records_by_region': lambda proxy: proxy.get_records_by_region('West', 0, 100),
+        'get_top_products': lambda proxy: proxy.get_top_products(10),
+        'get_sales_by_state': lambda proxy: proxy.get_sales_by_state(),
+        'get_sales_stats[region,category,year]': lambda proxy: proxy.get_sales_stats(
+            ['region', 'category', 'year']),
+        'query': lambda proxy: proxy.query({
+            'where': [{'field': 'region', 'op': 'eq', 'values': ['West']},
+                      {'field': 'sales', 'op': 'range', 'lower': '100'}],
+            'group_by': ['product_name'], 'aggregates': ['sum:sales'], 'limit': 10}),
+        'get_time_series': lambda proxy: proxy.get_time_series('month', '', '', 'region'),
+        'get_dashboard_summary': lambda proxy: proxy.get_dashboard_summary(10, 10),
+        'execute_xpath': lambda proxy: proxy.execute_xpath("count(//ns:Record[ns:Region='West'])"),
+    }
+
+
+def scale_csv(csv_file, factor, out_file):
+    """Grava `factor` cópias das linhas do CSV, lidas em streaming.
+
+    O Row ID é renumerado e cada cópia recebe um sufixo no Order ID, então
+    o número de pedidos cresce com a escala; clientes, produtos, estados e
+    datas mantêm a cardinalidade original.
+    """
+    row_id = 0
+    with open(out_file, 'w', encoding='utf-8', newline='') as f_out:
+        writer = csv.writer(f_out)
+        for copy in range(factor):
+            with open(csv_file, encoding='utf-8', newline='') as f_in:
+                reader = csv.reader(f_in)
+                header = next(reader)
+                if copy == 0:
+                    writer.writerow(header)
+                row_col, order_col = header.index('Row ID'), header.index('Order ID')
+                for row in reader:
+                    row_id += 1
+                    row[row_col] = str(row_id)
+                    if copy:
+                        row[order_col] = f"{row[order_col]}-{copy}"
+                    writer.writerow(row)
+    return row_id
+
+
+def prepare_dataset(csv_file, factor, workdir, synthetic=False):
+    """XML (e snapshot) da escala `factor`, reaproveitado entre execuções"""
+    name = f"sales_syn_x{factor}" if synthetic and factor > 1 else f"sales_x{factor}"
+    xml_file = os.path.join(workdir, f"{name}.xml")
+    if os.path.exists(xml_file):
+        return xml_file
+
+    source = csv_file
+    if factor > 1:
+        source = os.path.join(workdir, f"{name}.csv")
+        if synthetic:
+            with open(csv_file, encoding='utf-8', newline='') as f:
+                rows = sum(1 for _ in f) - 1
+            print(f"🎲 Gerando {factor}x sintético de {csv_file}...")
+            generate_csv(source, rows * factor, DEFAULT_SEED, csv_file)
+        else:
+            print(f"📦 Gerando {factor}x de {csv_file}...")
+            scale_csv(csv_file, factor, source)
+
+    converter = CSVtoXMLConverter(source, xml_file + '.tmp', indent=0)
+    if not converter.convert_stream():
+        raise RuntimeError(f"Conversão de {source} falhou")
+    os.replace(xml_file + '.tmp', xml_file)
+    converter.xml_file = xml_file
+    converter.write_snapshot()
+    return xml_file
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid):
+    """(RSS atual, pico de RSS) do processo em MB, via /proc (None fora do Linux)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        return (int(status['VmRSS'].split()[0]) / 1024,
+                int(status['VmHWM'].split()[0]) / 1024)
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+class ServerProcess:
+    """Servidor iniciado em subprocesso, com a saída em um arquivo de log"""
+
+    def __init__(self, kind, xml_file, extra_args, log_file):
+        self.kind = kind
+        self.port = _free_port()
+        script = os.path.join(HERE, f"{kind}_server.py")
+        command = [sys.executable, script, xml_file, 'localhost', str(self.port)] + extra_args
+        self.log = open(log_file, 'w')
+        started = time.perf_counter()
+        self.process = subprocess.Popen(command, stdout=self.log, stderr=subprocess.STDOUT)
+        self._wait_ready()
+        self.startup = time.perf_counter() - started
+
+    def _wait_ready(self):
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Servidor {self.kind} encerrou (veja {self.log.name})")
+            try:
+                if self.kind == 'grpc':
+                    with grpc.insecure_channel(f"localhost:{self.port}") as channel:
+                        sales_pb2_grpc.SalesServiceStub(channel).GetDatasetInfo(
+                            sales_pb2.DatasetInfoRequest(), timeout=1)
+                else:
+                    xmlrpc.client.ServerProxy(f"http://localhost:{self.port}/RPC2").dataset_info()
+                return
+            except (grpc.RpcError, OSError):
+                time.sleep(0.2)
+        raise RuntimeError(f"Servidor {self.kind} não respondeu em {STARTUP_TIMEOUT}s")
+
+    def client_factory(self):
+        """Função que cria um cliente por thread de carga"""
+        if self.kind == 'grpc':
+            channel = grpc.insecure_channel(f"localhost:{self.port}")
+            stub = sales_pb2_grpc.SalesServiceStub(channel)
+            return lambda: stub
+        url = f"http://localhost:{self.port}/RPC2"
+        return lambda: xmlrpc.client.ServerProxy(url, allow_none=True)
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
+
+
+def run_load(call, make_client, concurrency, duration, max_requests=None):
+    """Chama `call` em `concurrency` threads por `duration` segundos (ou até
+    `max_requests` requisições no total).
+
+    Retorna (latências em segundos, erros, tempo total).
+    """
+    latencies = [[] for _ in range(concurrency)]
+    errors = [0] * concurrency
+    remaining = [max_requests or 0]
+    lock = threading.Lock()
+    stop_at = [0.0]
+
+    def open_window():
+        # Depois do aquecimento: roda uma vez, antes de liberar as threads
+        stop_at[0] = time.perf_counter() + duration
+
+    start = threading.Barrier(concurrency + 1, action=open_window)
+
+    def next_request():
+        if not max_requests:
+            return time.perf_counter() < stop_at[0]
+        with lock:
+            remaining[0] -= 1
+            return remaining[0] >= 0
+
+    def worker(i):
+        client = make_client()
+        for _ in range(WARMUP_CALLS):
+            try:
+                call(client)
+            except Exception:
+                pass
+        start.wait()
+        own = latencies[i]
+        while next_request():
+            t0 = time.perf_counter()
+            try:
+                call(client)
+            except Exception:
+                errors[i] += 1
+                continue
+            own.append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    start.wait()
+    began = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - began
+    return [lat for own in latencies for lat in own], sum(errors), elapsed
+
+
+def summarize(latencies, errors, elapsed):
+    if not latencies:
+        return {'requests': 0, 'errors': errors, 'duration_s': elapsed, 'rps': 0.0, 'latency_ms': None}
+    values = np.array(latencies) * 1000
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]).tolist()
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'duration_s': elapsed,
+        'rps': len(latencies) / elapsed,
+        'latency_ms': {'p50': p50, 'p95': p95, 'p99': p99,
+                       'mean': float(values.mean()), 'max': float(values.max())}
+    }
+
+
+def run_benchmark(args):
+    os.makedirs(args.workdir, exist_ok=True)
+    catalog = {'grpc': _grpc_methods(), 'xmlrpc': _xmlrpc_methods()}
+    extra = {'grpc': shlex.split(args.grpc_args), 'xmlrpc': shlex.split(args.xmlrpc_args)}
+    runs = []
+
+    for factor in args.scales:
+        xml_file = prepare_dataset(args.csv_file, factor, args.workdir, args.synthetic)
+        for kind in args.servers:
+            methods = {name: call for name, call in catalog[kind].items()
+                       if not args.methods or name in args.methods}
+            if not methods:
+                continue
+            print(f"🚀 {kind} em {os.path.basename(xml_file)}...")
+            server = ServerProcess(kind, xml_file, extra[kind],
+                                   os.path.join(args.workdir, f"{kind}_x{factor}.log"))
+            try:
+                make_client = server.client_factory()
+                idle_rss, _ = rss_mb(server.process.pid)
+                for name, call in methods.items():
+                    for concurrency in args.concurrency:
+                        result = summarize(*run_load(call, make_client, concurrency,
+                                                     args.duration, args.requests))
+                        rss, peak = rss_mb(server.process.pid)
+                        result.update(scale=factor, server=kind, method=name,
+                                      concurrency=concurrency, startup_s=server.startup,
+                                      idle_rss_mb=idle_rss, rss_mb=rss, peak_rss_mb=peak)
+                        runs.append(result)
+                        _print_run(result)
+            finally:
+                server.stop()
+    return runs
+
+
+def _print_run(run):
+    latency = run['latency_ms'] or {}
+    print(f"   {run['method']:40s} c={run['concurrency']:<3d} "
+          f"p50={latency.get('p50', 0):8.2f}ms p99={latency.get('p99', 0):8.2f}ms "
+          f"{run['rps']:9.1f} req/s  erros={run['errors']}")
+
+
+def _key(run):
+    return (run['scale'], run['server'], run['method'], run['concurrency'])
+
+
+def print_report(runs, baseline=None):
+    """Tabela final; com `baseline`, variação percentual de p50, p99 e req/s"""
+    previous = {_key(run): run for run in baseline or []}
+    rows = []
+    for run in runs:
+        latency = run['latency_ms'] or {}
+        row = [f"{run['scale']}x", run['server'], run['method'], run['concurrency'],
+               f"{latency.get('p50', 0):.2f}", f"{latency.get('p95', 0):.2f}",
+               f"{latency.get('p99', 0):.2f}", f"{run['rps']:.1f}",
+               f"{run['rss_mb']:.0f}" if run['rss_mb'] is not None else '-']
+        if baseline is not None:
+            old = previous.get(_key(run))
+            if old and old['latency_ms'] and latency:
+                row += [_delta(old['latency_ms']['p50'], latency['p50']),
+                        _delta(old['latency_ms']['p99'], latency['p99']),
+                        _delta(old['rps'], run['rps'])]
+            else:
+                row += ['-', '-', '-']
+        rows.append(row)
+
+    headers = ['Escala', 'Servidor', 'Método', 'Conc.', 'p50 ms', 'p95 ms', 'p99 ms', 'req/s', 'RSS MB']
+    if baseline is not None:
+        headers += ['Δ p50', 'Δ p99', 'Δ req/s']
+    print(tabulate(rows, headers=headers))
+
+
+def _delta(old, new):
+    return f"{(new - old) / old * 100:+.1f}%" if old else '-'
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de carga dos servidores gRPC e XML-RPC")
+    parser.add_argument('csv_file', help="CSV de origem (escala 1x)")
+    parser.add_argument('--scales', type=int, nargs='+', default=[1],
+                        help="fatores de escala do dataset (ex.: 1 10 100)")
+    parser.add_argument('--synthetic', action='store_true',
+                        help="gera as escalas acima de 1x com o gerador sintético")
+    parser.add_argument('--servers', nargs='+', choices=['grpc', 'xmlrpc'], default=['grpc', 'xmlrpc'])
+    parser.add_argument('--methods', nargs='*', default=None,
+                        help="métodos a medir (padrão: todos)")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8],
+                        help="clientes simultâneos")
+    parser.add_argument('--duration', type=float, default=10.0,
+                        help="segundos de medição por método e concorrência")
+    parser.add_argument('--requests', type=int, default=None,
+                        help="número fixo de requisições (em vez de --duration)")
+    parser.add_argument('--grpc-args', default='', help="argumentos extras do grpc_server.py")
+    parser.add_argument('--xmlrpc-args', default='', help="argumentos extras do xmlrpc_server.py")
+    parser.add_argument('--workdir', default='benchmark_data',
+                        help="diretório dos datasets gerados e dos logs dos servidores")
+    parser.add_argument('--output', default='benchmark.json', help="arquivo JSON de resultados")
+    parser.add_argument('--compare', default=None, help="JSON de uma execução anterior")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)['runs']
+
+    runs = run_benchmark(args)
+    result = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args)
+        },
+        'runs': runs
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2)
+
+    print()
+    print_report(runs, baseline)
+    print(f"\n✅ Resultados gravados em {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -6,40 +6,253 @@ import csv
 import xml.etree.ElementTree as ET
 from xml.dom import minidom
 from lxml import etree
+import multiprocessing
 from datetime import datetime
+from functools import lru_cache
+import argparse
+import hashlib
+import json
+import logging
+import shutil
 import sys
 import os
+import tempfile
+
+
+# Mapeamento de campos (elemento XML -> coluna CSV)
+FIELD_MAP = {
+    'RowID': 'Row ID',
+    'OrderID': 'Order ID',
+    'OrderDate': 'Order Date',
+    'ShipDate': 'Ship Date',
+    'ShipMode': 'Ship Mode',
+    'CustomerID': 'Customer ID',
+    'CustomerName': 'Customer Name',
+    'Segment': 'Segment',
+    'Country': 'Country',
+    'City': 'City',
+    'State': 'State',
+    'PostalCode': 'Postal Code',
+    'Region': 'Region',
+    'RetailSalesPeople': 'Retail Sales People',
+    'ProductID': 'Product ID',
+    'Category': 'Category',
+    'SubCategory': 'Sub-Category',
+    'ProductName': 'Product Name',
+    'Returned': 'Returned',
+    'Sales': 'Sales',
+    'Quantity': 'Quantity',
+    'Discount': 'Discount',
+    'Profit': 'Profit'
+}
+
+
+# Formatos de data aceitos, em ordem de preferência
+DATE_FORMATS = [
+    "%Y-%m-%d",
+    "%d/%m/%Y",
+    "%m/%d/%Y",
+    "%d-%m-%Y",
+    "%m-%d-%Y"
+]
+
+
+class DateNormalizer:
+    """Normaliza datas para o formato ISO (AAAA-MM-DD).
+    
+    O formato do arquivo é detectado uma vez a partir de uma amostra
+    (`sniff`) e depois só ele é usado. Como o dataset repete poucas datas
+    distintas, os resultados ficam em um cache limitado (texto -> ISO).
+    Valores que não puderem ser convertidos são mantidos como estão e
+    contados em `failures`.
+    """
+    
+    def __init__(self, date_format=None, cache_size=4096):
+        self.date_format = date_format
+        self.failures = 0
+        self._convert = lru_cache(maxsize=cache_size)(self._convert_uncached)
+    
+    def sniff(self, samples):
+        """Escolhe o formato que converte mais valores da amostra"""
+        samples = [value for value in samples if value]
+        best, best_hits = None, 0
+        
+        for fmt in DATE_FORMATS:
+            hits = 0
+            for value in samples:
+                try:
+                    datetime.strptime(value, fmt)
+                    hits += 1
+                except ValueError:
+                    pass
+            if hits > best_hits:
+                best, best_hits = fmt, hits
+        
+        self.date_format = best
+        self._convert.cache_clear()
+        return best
+    
+    def sniff_csv(self, csv_file, sample_rows=1000):
+        """Detecta o formato usando as primeiras linhas das colunas de data"""
+        date_columns = [csv_field for xml_field, csv_field in FIELD_MAP.items()
+                        if 'Date' in xml_field]
+        samples = []
+        
+        with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.DictReader(f)
+            for i, row in enumerate(reader):
+                if i >= sample_rows:
+                    break
+                for column in date_columns:
+                    samples.append((row.get(column) or '').strip())
+        
+        return self.sniff(samples)
+    
+    def _convert_uncached(self, date_str):
+        formats = [self.date_format] if self.date_format else DATE_FORMATS
+        for fmt in formats:
+            try:
+                return datetime.strptime(date_str, fmt).strftime("%Y-%m-%d")
+            except ValueError:
+                continue
+        return None
+    
+    def normalize(self, date_str):
+        """Retorna a data em ISO, ou o texto original se não for possível"""
+        if not date_str:
+            return date_str
+        
+        iso = self._convert(date_str)
+        if iso is None:
+            self.failures += 1
+            return date_str
+        return iso
+
+
+def split_csv(csv_file, parts):
+    """Divide o CSV em até `parts` faixas de bytes alinhadas ao início das linhas.
+    
+    Retorna (cabeçalho, [(início, fim, primeira linha), ...]).
+    """
+    size = os.path.getsize(csv_file)
+    
+    with open(csv_file, 'rb') as f:
+        header = f.readline()
+        fieldnames = next(csv.reader([header.decode('utf-8-sig')]))
+        data_start = f.tell()
+        
+        step = max(1, (size - data_start) // max(1, parts))
+        bounds = [data_start]
+        for i in range(1, parts):
+            pos = data_start + i * step
+            if pos <= bounds[-1]:
+                continue
+            # Avançar até o início da próxima linha
+            f.seek(pos - 1)
+            f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+        bounds.append(size)
+        
+        # Número da primeira linha de cada faixa (linha 1 = cabeçalho)
+        chunks = []
+        line = 2
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            chunks.append((start, end, line))
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                block = f.read(min(remaining, 1 << 20))
+                if not block:
+                    break
+                line += block.count(b'\n')
+                remaining -= len(block)
+    
+    return fieldnames, chunks
+
+
+def state_path(xml_file):
+    """Arquivo de estado da conversão incremental"""
+    return f"{xml_file}.state.json"
+
+
+def _complete_lines_end(csv_file):
+    """Posição logo após a última quebra de linha do CSV (uma linha final
+    sem quebra pode estar sendo escrita e fica para a próxima execução)"""
+    size = os.path.getsize(csv_file)
+    with open(csv_file, 'rb') as f:
+        pos = size
+        while pos > 0:
+            start = max(0, pos - (1 << 16))
+            f.seek(start)
+            block = f.read(pos - start)
+            newline = block.rfind(b'\n')
+            if newline >= 0:
+                return start + newline + 1
+            pos = start
+    return 0
+
+
+def _tail_hash(csv_file, offset, size=4096):
+    """SHA-256 dos `size` bytes antes de `offset` (detecta CSV reescrito)"""
+    with open(csv_file, 'rb') as f:
+        f.seek(max(0, offset - size))
+        return hashlib.sha256(f.read(offset - max(0, offset - size))).hexdigest()
+
+
+def _read_lines(f, end):
+    """Lê linhas de um arquivo binário até a posição `end`"""
+    while f.tell() < end:
+        line = f.readline()
+        if not line:
+            break
+        yield line.decode('utf-8')
+
+
+def _convert_chunk(task):
+    """Executado em cada processo do modo paralelo"""
+    (csv_file, shard_file, xsd_file, indent, incremental_validation, max_errors,
+     date_format, start, end, fieldnames, first_line) = task
+    converter = CSVtoXMLConverter(csv_file, shard_file, xsd_file, indent=indent,
+                                  incremental_validation=incremental_validation,
+                                  max_errors=max_errors)
+    converter.dates = DateNormalizer(date_format)
+    return converter.convert_range(start, end, fieldnames, first_line)
+
+
+def _convert_indexed_chunk(item):
+    index, task = item
+    return index, _convert_chunk(task)
+
+
+@lru_cache(maxsize=None)
+def load_schema(xsd_file):
+    """Compila o schema XSD (uma única vez por processo)"""
+    with open(xsd_file, 'rb') as f:
+        return etree.XMLSchema(etree.XML(f.read()))
 
 
 class CSVtoXMLConverter:
-    def __init__(self, csv_file, xml_file, xsd_file=None):
+    def __init__(self, csv_file, xml_file, xsd_file=None, indent=2,
+                 incremental_validation=False, max_errors=10):
         self.csv_file = csv_file
         self.xml_file = xml_file
         self.xsd_file = xsd_file
+        self.indent = indent  # Espaços por nível (0 ou None = sem indentação)
+        self.incremental_validation = incremental_validation
+        self.max_errors = max_errors
+        self.validation_errors = []  # (linha do CSV, mensagem)
+        self.dates = DateNormalizer()
         self.namespace = "http://sales.example.com"
+        self.first_row_id = None  # Row ID do primeiro e do último registro escrito
+        self.last_row_id = None
         
     def parse_date(self, date_str):
         """Converte string para formato ISO de data"""
-        try:
-            # Tenta vários formatos de data
-            formats = [
-                "%Y-%m-%d",
-                "%d/%m/%Y", 
-                "%m/%d/%Y",
-                "%d-%m-%Y",
-                "%m-%d-%Y"
-            ]
-            
-            for fmt in formats:
-                try:
-                    dt = datetime.strptime(date_str, fmt)
-                    return dt.strftime("%Y-%m-%d")
-                except:
-                    continue
-            
-            return date_str  # Retorna original se não conseguir converter
-        except:
-            return date_str
+        return self.dates.normalize(date_str)
     
     def clean_value(self, value):
         """Limpa e formata valores"""
@@ -47,6 +260,322 @@ class CSVtoXMLConverter:
             return ""
         return str(value).strip()
     
+    def record_values(self, row):
+        """Retorna a lista (campo XML, valor) de uma linha do CSV, já formatada"""
+        values = []
+        for xml_field, csv_field in FIELD_MAP.items():
+            value = self.clean_value(row.get(csv_field, ''))
+            
+            # Formatar datas
+            if 'Date' in xml_field:
+                value = self.parse_date(value)
+            
+            values.append((xml_field, value))
+        return values
+    
+    def _write_record(self, xf, values):
+        """Escreve um <Record> diretamente no arquivo de saída (modo streaming)"""
+        ns = self.namespace
+        pad = " " * self.indent if self.indent else ""
+        
+        if pad:
+            xf.write("\n" + pad)
+        with xf.element(f"{{{ns}}}Record"):
+            for xml_field, value in values:
+                if pad:
+                    xf.write("\n" + pad * 2)
+                with xf.element(f"{{{ns}}}{xml_field}"):
+                    xf.write(value)
+            if pad:
+                xf.write("\n" + pad)
+    
+    def _validate_record(self, schema, values, line):
+        """Valida um único registro contra o schema; guarda erros com a linha do CSV"""
+        ns = self.namespace
+        root = etree.Element(f"{{{ns}}}SalesRecords", nsmap={None: ns})
+        record = etree.SubElement(root, f"{{{ns}}}Record")
+        for xml_field, value in values:
+            etree.SubElement(record, f"{{{ns}}}{xml_field}").text = value
+        
+        if schema.validate(root):
+            return True
+        
+        for error in schema.error_log:
+            self.validation_errors.append((line, error.message))
+        return False
+    
+    def _print_validation_errors(self):
+        print("❌ Erros de validação encontrados:")
+        for line, message in self.validation_errors[:self.max_errors]:
+            print(f"  Linha CSV {line}: {message}")
+    
+    def _incremental_schema(self):
+        """Retorna o schema compilado se a validação incremental estiver ativa"""
+        if not (self.incremental_validation and self.xsd_file):
+            return None
+        if not os.path.exists(self.xsd_file):
+            print(f"⚠️  Arquivo XSD não encontrado: {self.xsd_file}")
+            return None
+        return load_schema(self.xsd_file)
+    
+    def _write_document(self, f_out, rows, schema=None, declaration=True, progress=True,
+                        checkpoints=None):
+        """Escreve `rows` (pares linha do CSV, dict) como documento SalesRecords.
+        
+        Retorna o número de registros escritos. Para após `max_errors` erros
+        de validação quando `schema` é informado. Com `checkpoints` (lista),
+        cada registro inválido acrescenta (linha, registros escritos antes
+        dele, posição do arquivo antes dele, erros, datas não convertidas),
+        usados pelo modo paralelo para cortar a faixa onde o orçamento global
+        de erros se esgota.
+        """
+        ns = self.namespace
+        count = 0
+        
+        with etree.xmlfile(f_out, encoding='utf-8') as xf:
+            if declaration:
+                xf.write_declaration()
+            with xf.element(f"{{{ns}}}SalesRecords", nsmap={None: ns}):
+                for line, row in rows:
+                    if not row or len(row) < 5:
+                        continue
+                    
+                    values = self.record_values(row)
+                    if schema is not None:
+                        valid = self._validate_record(schema, values, line)
+                        if not valid and checkpoints is not None:
+                            xf.flush()
+                            checkpoints.append((line, count, f_out.tell(),
+                                                len(self.validation_errors), self.dates.failures))
+                        if len(self.validation_errors) >= self.max_errors:
+                            break
+                    
+                    self._write_record(xf, values)
+                    
+                    # RowID é o primeiro campo de FIELD_MAP
+                    if not count:
+                        self.first_row_id = values[0][1]
+                    self.last_row_id = values[0][1]
+                    count += 1
+                    if progress and count % 1000 == 0:
+                        print(f"  Processados {count} registros...")
+                
+                if self.indent and declaration:
+                    xf.write("\n")
+        
+        return count
+    
+    def _sniff_dates(self):
+        """Detecta o formato de data do CSV antes da conversão"""
+        date_format = self.dates.sniff_csv(self.csv_file)
+        if date_format:
+            print(f"📅 Formato de data detectado: {date_format}")
+        else:
+            print("⚠️  Formato de data não detectado; tentando todos os formatos")
+        return date_format
+    
+    def _report(self, count, schema):
+        """Mostra o resultado da conversão (e da validação, se houver)"""
+        if self.dates.failures:
+            print(f"⚠️  {self.dates.failures} datas não puderam ser convertidas")
+        
+        if schema is not None:
+            if len(self.validation_errors) >= self.max_errors:
+                print(f"❌ Conversão interrompida após {count} registros "
+                      f"({len(self.validation_errors)} erros de validação)")
+                self._print_validation_errors()
+                return
+            
+            print(f"✅ Convertidos {count} registros para {self.xml_file}")
+            if self.validation_errors:
+                self._print_validation_errors()
+            else:
+                print("✅ XML válido conforme o schema!")
+            return
+        
+        print(f"✅ Convertidos {count} registros para {self.xml_file}")
+        
+        if self.xsd_file and os.path.exists(self.xsd_file) and not self.incremental_validation:
+            self.validate()
+        elif self.xsd_file and not self.incremental_validation:
+            print(f"⚠️  Arquivo XSD não encontrado: {self.xsd_file}")
+    
+    def convert_stream(self):
+        """Converte CSV para XML em modo streaming.
+        
+        Cada linha do CSV é lida e escrita como <Record> diretamente no
+        arquivo de saída, sem manter a árvore em memória nem passar pelo
+        minidom. O uso de memória fica constante qualquer que seja o
+        tamanho da entrada.
+        
+        Com validação incremental, cada registro é validado contra o schema
+        compilado enquanto é gerado; a conversão para após `max_errors` erros.
+        """
+        print(f"🔄 Convertendo {self.csv_file} para XML (streaming)...")
+        
+        if not os.path.exists(self.csv_file):
+            print(f"❌ Arquivo CSV não encontrado: {self.csv_file}")
+            return 0
+        
+        self._sniff_dates()
+        
+        schema = self._incremental_schema()
+        if schema is not None:
+            self.validation_errors = []
+            print(f"🔍 Validação incremental contra {self.xsd_file}")
+        
+        with open(self.csv_file, 'r', encoding='utf-8', newline='') as f_in, \
+                open(self.xml_file, 'wb') as f_out:
+            reader = csv.DictReader(f_in)
+            print(f"📋 Colunas detectadas: {reader.fieldnames}")
+            
+            rows = ((reader.line_num, row) for row in reader)
+            count = self._write_document(f_out, rows, schema)
+        
+        self._report(count, schema)
+        return count
+    
+    def convert_range(self, start, end, fieldnames, first_line):
+        """Converte apenas as linhas do CSV na faixa de bytes [start, end).
+        
+        Usado pelos processos do modo paralelo: escreve um documento
+        SalesRecords parcial (sem declaração) em `self.xml_file` e retorna
+        (registros, erros de validação, datas não convertidas, pontos de
+        corte dos registros inválidos). `first_line` é o número da primeira
+        linha da faixa no CSV, para reportar erros com a linha real.
+        """
+        schema = self._incremental_schema()
+        self.validation_errors = []
+        
+        with open(self.csv_file, 'rb') as f_in, open(self.xml_file, 'wb') as f_out:
+            f_in.seek(start)
+            reader = csv.DictReader(_read_lines(f_in, end), fieldnames=fieldnames)
+            rows = ((first_line + reader.line_num - 1, row) for row in reader)
+            checkpoints = []
+            count = self._write_document(f_out, rows, schema, declaration=False,
+                                         progress=False, checkpoints=checkpoints)
+        
+        return count, self.validation_errors, self.dates.failures, checkpoints
+    
+    def convert_parallel(self, workers):
+        """Converte o CSV usando `workers` processos.
+        
+        O arquivo é dividido em faixas de bytes alinhadas ao início das
+        linhas; cada processo converte sua faixa para um arquivo parcial e
+        os fragmentos são concatenados na ordem original do CSV (ordem de
+        RowID) em um único documento SalesRecords.
+        
+        Com validação incremental, os erros das faixas são somados na ordem
+        do CSV: a faixa em que o total chega a `max_errors` é cortada no
+        registro em que a conversão serial pararia, as seguintes são
+        descartadas (e os processos ainda ativos, encerrados). O XML e a
+        lista de erros ficam iguais aos do modo serial.
+        
+        Observação: a divisão assume que nenhum campo entre aspas contém
+        quebras de linha.
+        """
+        print(f"🔄 Convertendo {self.csv_file} para XML ({workers} processos)...")
+        
+        if not os.path.exists(self.csv_file):
+            print(f"❌ Arquivo CSV não encontrado: {self.csv_file}")
+            return 0
+        
+        date_format = self._sniff_dates()
+        
+        schema = self._incremental_schema()
+        if schema is not None:
+            print(f"🔍 Validação incremental contra {self.xsd_file}")
+        
+        fieldnames, chunks = split_csv(self.csv_file, workers)
+        print(f"📋 Colunas detectadas: {fieldnames}")
+        
+        shard_dir = tempfile.mkdtemp(prefix='csv2xml-', dir=os.path.dirname(os.path.abspath(self.xml_file)))
+        tasks = []
+        for i, (start, end, first_line) in enumerate(chunks):
+            shard_file = os.path.join(shard_dir, f"shard-{i:05d}.xml")
+            tasks.append((self.csv_file, shard_file, self.xsd_file, self.indent,
+                          self.incremental_validation, self.max_errors, date_format,
+                          start, end, fieldnames, first_line))
+        
+        results = {}  # faixa -> resultado de convert_range
+        pieces = []   # (arquivo da faixa, fim em bytes ou None = inteira)
+        count = 0
+        self.validation_errors = []
+        try:
+            with multiprocessing.Pool(workers) as pool:
+                cut = None
+                for index, result in pool.imap_unordered(_convert_indexed_chunk, enumerate(tasks)):
+                    results[index] = result
+                    # Acumula as faixas concluídas a partir do início, em ordem
+                    while cut is None and len(pieces) in results:
+                        shard = len(pieces)
+                        shard_count, errors, date_failures, checkpoints = results.pop(shard)
+                        cut = self._budget_cut(checkpoints)
+                        if cut is None:
+                            pieces.append((tasks[shard][1], None))
+                            count += shard_count
+                            self.validation_errors.extend(errors)
+                            self.dates.failures += date_failures
+                        else:
+                            # Corta a faixa no registro em que a conversão serial pararia
+                            line, before, offset, _, failures = cut
+                            pieces.append((tasks[shard][1], offset))
+                            count += before
+                            self.validation_errors.extend(e for e in errors if e[0] <= line)
+                            self.dates.failures += failures
+                    if cut is not None:
+                        # Orçamento de erros esgotado: as faixas seguintes são descartadas
+                        pool.terminate()
+                        break
+            self._merge_shards(pieces)
+        finally:
+            shutil.rmtree(shard_dir, ignore_errors=True)
+        
+        self._report(count, schema)
+        return count
+    
+    def _budget_cut(self, checkpoints):
+        """Ponto de corte da faixa em que os erros acumulados (das faixas
+        anteriores e desta) chegam a `max_errors`; None se não chegam"""
+        previous = len(self.validation_errors)
+        for checkpoint in checkpoints:
+            if previous + checkpoint[3] >= self.max_errors:
+                return checkpoint
+        return None
+    
+    def _merge_shards(self, pieces):
+        """Concatena os fragmentos parciais em um único documento SalesRecords.
+        
+        `pieces` traz (arquivo, fim): com `fim`, só os bytes até essa posição
+        (registros anteriores ao corte) são copiados.
+        """
+        ns = self.namespace
+        open_tag = f'<SalesRecords xmlns="{ns}">'.encode('utf-8')
+        close_tag = b'</SalesRecords>'
+        
+        with open(self.xml_file, 'wb') as f_out:
+            f_out.write(b"<?xml version='1.0' encoding='utf-8'?>\n")
+            f_out.write(open_tag)
+            for shard_file, end in pieces:
+                size = os.path.getsize(shard_file)
+                with open(shard_file, 'rb') as f_in:
+                    head = f_in.read(len(open_tag))
+                    if head != open_tag:
+                        # Fragmento vazio (<SalesRecords .../>)
+                        continue
+                    if end is None:
+                        end = size - len(close_tag)
+                    remaining = end - len(open_tag)
+                    while remaining > 0:
+                        block = f_in.read(min(remaining, 1 << 20))
+                        if not block:
+                            break
+                        f_out.write(block)
+                        remaining -= len(block)
+            if self.indent:
+                f_out.write(b"\n")
+            f_out.write(close_tag)
+    
     def convert(self):
         """Converte CSV para XML - VERSÃO CORRIGIDA"""
         print(f"🔄 Convertendo {self.csv_file} para XML...")
@@ -56,6 +585,8 @@ class CSVtoXMLConverter:
             print(f"❌ Arquivo CSV não encontrado: {self.csv_file}")
             return 0
         
+        self._sniff_dates()
+        
         # Criar elemento raiz com namespace
         ET.register_namespace('', self.namespace)
         root = ET.Element(f"{{{self.namespace}}}SalesRecords")
@@ -75,41 +606,8 @@ class CSVtoXMLConverter:
                     
                 record = ET.SubElement(root, f"{{{self.namespace}}}Record")
                 
-                # Mapeamento de campos
-                fields = {
-                    'RowID': 'Row ID',
-                    'OrderID': 'Order ID',
-                    'OrderDate': 'Order Date',
-                    'ShipDate': 'Ship Date',
-                    'ShipMode': 'Ship Mode',
-                    'CustomerID': 'Customer ID',
-                    'CustomerName': 'Customer Name',
-                    'Segment': 'Segment',
-                    'Country': 'Country',
-                    'City': 'City',
-                    'State': 'State',
-                    'PostalCode': 'Postal Code',
-                    'Region': 'Region',
-                    'RetailSalesPeople': 'Retail Sales People',
-                    'ProductID': 'Product ID',
-                    'Category': 'Category',
-                    'SubCategory': 'Sub-Category',
-                    'ProductName': 'Product Name',
-                    'Returned': 'Returned',
-                    'Sales': 'Sales',
-                    'Quantity': 'Quantity',
-                    'Discount': 'Discount',
-                    'Profit': 'Profit'
-                }
-                
-                for xml_field, csv_field in fields.items():
+                for xml_field, value in self.record_values(row):
                     elem = ET.SubElement(record, f"{{{self.namespace}}}{xml_field}")
-                    value = self.clean_value(row.get(csv_field, ''))
-                    
-                    # Formatar datas
-                    if 'Date' in xml_field:
-                        value = self.parse_date(value)
-                    
                     elem.text = value
                 
                 count += 1
@@ -122,12 +620,14 @@ class CSVtoXMLConverter:
         # Salvar com indentação
         xml_str = ET.tostring(root, encoding='unicode')
         dom = minidom.parseString(xml_str)
-        pretty_xml = dom.toprettyxml(indent="  ")
+        pretty_xml = dom.toprettyxml(indent=" " * (self.indent or 0))
         
         with open(self.xml_file, 'w', encoding='utf-8') as f:
             f.write(pretty_xml)
         
         print(f"✅ Convertidos {count} registros para {self.xml_file}")
+        if self.dates.failures:
+            print(f"⚠️  {self.dates.failures} datas não puderam ser convertidas")
         
         # Validar se XSD foi fornecido
         if self.xsd_file and os.path.exists(self.xsd_file):
@@ -137,6 +637,191 @@ class CSVtoXMLConverter:
         
         return count
     
+    def convert_incremental(self, snapshot=False):
+        """Converte apenas as linhas acrescentadas ao CSV desde a última execução.
+        
+        O estado (`<xml>.state.json`) guarda até que byte do CSV a conversão
+        foi, o número da próxima linha, o último Row ID e o tamanho do XML
+        gerado. As linhas novas viram `<xml>.delta.xml`, que é acrescentado
+        ao fim do XML; `<xml>.delta.json` descreve o lote para que os
+        servidores o absorvam sem recarga completa.
+        
+        Sem estado válido (primeira execução, CSV reescrito ou XML alterado
+        por fora) faz a conversão completa e grava o estado.
+        """
+        from sales_data import SalesDataset, dataset_version, delta_paths
+        
+        print(f"🔄 Conversão incremental de {self.csv_file}...")
+        
+        if not os.path.exists(self.csv_file):
+            print(f"❌ Arquivo CSV não encontrado: {self.csv_file}")
+            return 0
+        
+        state = self._load_state()
+        if state is None:
+            return self._convert_full_incremental(snapshot)
+        
+        end = _complete_lines_end(self.csv_file)
+        if end <= state['csv_offset']:
+            print("✅ Nenhuma linha nova no CSV")
+            return 0
+        
+        self.dates = DateNormalizer(state['date_format'])
+        schema = self._incremental_schema()
+        self.validation_errors = []
+        delta_file, info_file = delta_paths(self.xml_file)
+        batch_file = f"{delta_file}.tmp"
+        
+        with open(self.csv_file, 'rb') as f_in, open(batch_file, 'wb') as f_out:
+            f_in.seek(state['csv_offset'])
+            reader = csv.DictReader(_read_lines(f_in, end), fieldnames=state['fieldnames'])
+            rows = ((state['csv_line'] + reader.line_num - 1, row) for row in reader)
+            count = self._write_document(f_out, rows, schema, declaration=False)
+            lines = reader.line_num
+        
+        if schema is not None and len(self.validation_errors) >= self.max_errors:
+            os.remove(batch_file)
+            self._report(count, schema)
+            print("❌ Lote descartado; o XML não foi alterado")
+            return 0
+        
+        base = SalesDataset(self.xml_file) if snapshot and count else None
+        base_version = dataset_version(self.xml_file)
+        if count:
+            os.replace(batch_file, delta_file)
+            self._append_to_xml(delta_file)
+            with open(info_file, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'base_version': base_version,
+                    'version': dataset_version(self.xml_file),
+                    'delta_file': os.path.basename(delta_file),
+                    'count': count,
+                    'first_row_id': self.first_row_id,
+                    'last_row_id': self.last_row_id
+                }, f)
+        else:
+            os.remove(batch_file)
+        
+        state['csv_offset'] = end
+        state['csv_line'] += lines
+        state['csv_tail'] = _tail_hash(self.csv_file, end)
+        state['record_count'] += count
+        if count:
+            state['last_row_id'] = self.last_row_id
+        state['xml_size'] = os.path.getsize(self.xml_file)
+        self._save_state(state)
+        
+        print(f"✅ Acrescentados {count} registros a {self.xml_file} "
+              f"(total: {state['record_count']}, último Row ID: {state['last_row_id']})")
+        if self.dates.failures:
+            print(f"⚠️  {self.dates.failures} datas não puderam ser convertidas")
+        if self.validation_errors:
+            self._print_validation_errors()
+        
+        if base is not None:
+            base.extend(delta_file).save_snapshot()
+        return count
+    
+    def _convert_full_incremental(self, snapshot):
+        """Conversão completa que também grava o estado incremental"""
+        print("📄 Sem estado incremental válido: conversão completa")
+        
+        end = _complete_lines_end(self.csv_file)
+        date_format = self._sniff_dates()
+        schema = self._incremental_schema()
+        self.validation_errors = []
+        
+        with open(self.csv_file, 'rb') as f_in, open(self.xml_file, 'wb') as f_out:
+            header = f_in.readline()
+            fieldnames = next(csv.reader([header.decode('utf-8-sig')]))
+            reader = csv.DictReader(_read_lines(f_in, end), fieldnames=fieldnames)
+            rows = ((reader.line_num + 1, row) for row in reader)
+            count = self._write_document(f_out, rows, schema)
+            lines = reader.line_num
+        
+        self._report(count, schema)
+        if schema is not None and len(self.validation_errors) >= self.max_errors:
+            return count
+        
+        from sales_data import delta_paths
+        for path in delta_paths(self.xml_file):
+            if os.path.exists(path):
+                os.remove(path)
+        
+        self._save_state({
+            'csv_file': os.path.abspath(self.csv_file),
+            'csv_offset': end,
+            'csv_line': lines + 2,
+            'csv_tail': _tail_hash(self.csv_file, end),
+            'fieldnames': fieldnames,
+            'date_format': date_format,
+            'last_row_id': self.last_row_id,
+            'record_count': count,
+            'xml_size': os.path.getsize(self.xml_file)
+        })
+        if snapshot and count:
+            self.write_snapshot()
+        return count
+    
+    def _load_state(self):
+        """Estado da última conversão, ou None se ele não valer mais"""
+        try:
+            with open(state_path(self.xml_file), encoding='utf-8') as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return None
+        
+        if state.get('csv_file') != os.path.abspath(self.csv_file):
+            print("⚠️  Estado incremental é de outro CSV")
+            return None
+        if not os.path.exists(self.xml_file) or os.path.getsize(self.xml_file) != state['xml_size']:
+            print("⚠️  XML alterado desde a última conversão")
+            return None
+        if (os.path.getsize(self.csv_file) < state['csv_offset']
+                or _tail_hash(self.csv_file, state['csv_offset']) != state['csv_tail']):
+            print("⚠️  CSV reescrito desde a última conversão")
+            return None
+        return state
+    
+    def _save_state(self, state):
+        path = state_path(self.xml_file)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False, indent=2)
+        os.replace(f"{path}.tmp", path)
+    
+    def _append_to_xml(self, delta_file):
+        """Insere os registros de `delta_file` antes de </SalesRecords> no XML"""
+        ns = self.namespace
+        open_tag = f'<SalesRecords xmlns="{ns}">'.encode()
+        close_tag = b'</SalesRecords>'
+        
+        with open(delta_file, 'rb') as f:
+            body = f.read()
+        body = body[len(open_tag):len(body) - len(close_tag)]
+        
+        with open(self.xml_file, 'r+b') as f:
+            size = f.seek(0, os.SEEK_END)
+            f.seek(max(0, size - 4096))
+            tail = f.read()
+            close = tail.rfind(close_tag)
+            if close < 0:
+                raise ValueError(f"{close_tag.decode()} não encontrado em {self.xml_file}")
+            # Acrescentar depois do último registro (antes da quebra de linha final)
+            insert = len(tail[:close].rstrip())
+            trailer = tail[insert:]
+            f.seek(size - len(tail) + insert)
+            f.write(body)
+            f.write(trailer)
+            f.truncate()
+    
+    def write_snapshot(self):
+        """Grava o snapshot binário do XML gerado (colunas .npy + dicionários),
+        que os servidores abrem na partida sem ler o XML"""
+        from sales_data import SalesDataset
+        
+        print(f"💾 Gerando snapshot de {self.xml_file}...")
+        SalesDataset(self.xml_file, snapshot=False).save_snapshot()
+    
     def validate(self):
         """Valida XML contra o schema XSD"""
         print(f"\n🔍 Validando XML contra schema {self.xsd_file}...")
@@ -147,10 +832,8 @@ class CSVtoXMLConverter:
                 print("❌ Arquivo XSD não encontrado ou vazio")
                 return
                 
-            # Carregar XSD
-            with open(self.xsd_file, 'r', encoding='utf-8') as f:
-                schema_root = etree.XML(f.read().encode('utf-8'))
-            schema = etree.XMLSchema(schema_root)
+            # Carregar XSD (compilado uma vez por processo)
+            schema = load_schema(self.xsd_file)
             
             # Carregar XML
             with open(self.xml_file, 'r', encoding='utf-8') as f:
@@ -169,16 +852,47 @@ class CSVtoXMLConverter:
 
 
 def main():
-    if len(sys.argv) < 3:
-        print("Uso: python csv_to_xml_converter.py <arquivo.csv> <saida.xml> [schema.xsd]")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(
+        description="Conversor CSV para XML com validação por Schema XSD"
+    )
+    parser.add_argument('csv_file', help="arquivo CSV de entrada")
+    parser.add_argument('xml_file', help="arquivo XML de saída")
+    parser.add_argument('xsd_file', nargs='?', default=None, help="schema XSD (opcional)")
+    parser.add_argument('--stream', action='store_true',
+                        help="escreve cada registro direto no disco (memória constante)")
+    parser.add_argument('--indent', type=int, default=2,
+                        help="espaços de indentação (0 = XML compacto)")
+    parser.add_argument('--validate-incremental', action='store_true',
+                        help="valida cada registro durante a geração (implica --stream)")
+    parser.add_argument('--max-errors', type=int, default=10,
+                        help="número de erros de validação antes de interromper")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="número de processos para conversão paralela")
+    parser.add_argument('--snapshot', action='store_true',
+                        help="grava também o snapshot binário usado na partida dos servidores")
+    parser.add_argument('--incremental', action='store_true',
+                        help="converte só as linhas novas do CSV e as acrescenta ao XML")
+    args = parser.parse_args()
+    # Mensagens do sales_data (snapshot) no mesmo formato das demais
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    
+    converter = CSVtoXMLConverter(args.csv_file, args.xml_file, args.xsd_file,
+                                  indent=args.indent,
+                                  incremental_validation=args.validate_incremental,
+                                  max_errors=args.max_errors)
+    if args.incremental:
+        converter.convert_incremental(args.snapshot)
+        return
     
-    csv_file = sys.argv[1]
-    xml_file = sys.argv[2]
-    xsd_file = sys.argv[3] if len(sys.argv) > 3 else None
+    if args.workers > 1:
+        count = converter.convert_parallel(args.workers)
+    elif args.stream or args.validate_incremental:
+        count = converter.convert_stream()
+    else:
+        count = converter.convert()
     
-    converter = CSVtoXMLConverter(csv_file, xml_file, xsd_file)
-    converter.convert()
+    if args.snapshot and count:
+        converter.write_snapshot()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Gerador de datasets sintéticos para testes de escala
+
+Um perfil é extraído do CSV original (distribuições de itens por pedido,
+quantidade, desconto por estado e subcategoria, modos e prazos de envio,
+devoluções, sazonalidade das datas, popularidade de clientes e produtos e
+a margem de lucro em função do desconto em cada subcategoria). Com esse
+perfil, qualquer número de linhas é gerado em lotes e gravado em CSV no
+mesmo formato do original; `--xml` converte o resultado com o conversor
+(e `--snapshot` grava o snapshot dos servidores).
+
+Cardinalidades: estados, cidades e o período de datas são os do
+original; o número de clientes cresce na proporção das linhas e o
+catálogo de produtos com a raiz quadrada da escala. A mesma semente
+(`--seed`) gera sempre o mesmo arquivo.
+
+    python data_generator.py --rows 1000000 --csv sales_1m.csv --xml sales_1m.xml --snapshot
+"""
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+import argparse
+import csv
+import math
+import os
+
+import numpy as np
+
+from csv_to_xml_converter import CSVtoXMLConverter
+
+
+DEFAULT_SOURCE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              '..', 'Data', 'retail_orders_full_dataset.csv')
+
+DEFAULT_SEED = 42
+
+# Pedidos gerados por lote (a memória não depende do total de linhas)
+CHUNK_ORDERS = 20000
+
+
+def _distribution(counter):
+    """Counter -> (valores, probabilidades)"""
+    values = list(counter)
+    counts = np.array([counter[value] for value in values], dtype=np.float64)
+    return values, counts / counts.sum()
+
+
+class DatasetProfile:
+    """Distribuições extraídas de um CSV no formato do dataset original"""
+
+    def __init__(self, source=DEFAULT_SOURCE):
+        with open(source, encoding='utf-8', newline='') as f:
+            reader = csv.DictReader(f)
+            self.columns = reader.fieldnames
+            rows = list(reader)
+        if not rows:
+            raise ValueError(f"CSV sem registros: {source}")
+        self.source_rows = len(rows)
+
+        orders = defaultdict(list)
+        for row in rows:
+            orders[row['Order ID']].append(row)
+        heads = [items[0] for items in orders.values()]
+
+        # Atributos do pedido (iguais em todos os itens)
+        self.items = _distribution(Counter(len(items) for items in orders.values()))
+        self.geography = _distribution(Counter(
+            (row['City'], row['State'], row['Postal Code'], row['Region']) for row in heads))
+        self.country = Counter(row['Country'] for row in heads).most_common(1)[0][0]
+        self.sales_people = {row['Region']: row['Retail Sales People'] for row in heads}
+        self.ship_modes = _distribution(Counter(row['Ship Mode'] for row in heads))
+        self.ship_delays = {}
+        for mode in self.ship_modes[0]:
+            self.ship_delays[mode] = _distribution(Counter(
+                (date.fromisoformat(row['Ship Date']) - date.fromisoformat(row['Order Date'])).days
+                for row in heads if row['Ship Mode'] == mode))
+        # Devolução: pedidos maiores são devolvidos com mais frequência
+        returned = Counter(len(items) for items in orders.values() if items[0]['Returned'] == 'Yes')
+        sizes = Counter(len(items) for items in orders.values())
+        overall = sum(returned.values()) / len(heads)
+        self.returned_rates = {size: returned[size] / count if count >= 30 else overall
+                               for size, count in sizes.items()}
+        self.order_prefixes = _distribution(Counter(row['Order ID'].split('-')[0] for row in heads))
+
+        # Sazonalidade: ano, mês e dia da semana dos pedidos
+        dates = [date.fromisoformat(row['Order Date']) for row in heads]
+        self.first_date, self.last_date = min(dates), max(dates)
+        self.year_weights = Counter(d.year for d in dates)
+        self.month_weights = Counter(d.month for d in dates)
+        self.weekday_weights = Counter(d.weekday() for d in dates)
+
+        # Clientes: (id, nome, segmento) e número de pedidos de cada um
+        customers = Counter((row['Customer ID'], row['Customer Name'], row['Segment']) for row in heads)
+        self.customers = list(customers)
+        self.customer_weights = np.array([customers[c] for c in self.customers], dtype=np.float64)
+        self.segments = _distribution(Counter(row['Segment'] for row in heads))
+        self.first_names = sorted({c[1].split()[0] for c in self.customers})
+        self.last_names = sorted({c[1].split()[-1] for c in self.customers})
+
+        # Produtos: (id, categoria, subcategoria, nome), preço unitário e popularidade
+        prices = defaultdict(list)
+        for row in rows:
+            key = (row['Product ID'], row['Category'], row['Sub-Category'], row['Product Name'])
+            net = int(row['Quantity']) * (1 - float(row['Discount']))
+            if net > 0:
+                prices[key].append(float(row['Sales']) / net)
+        popularity = Counter((row['Product ID'], row['Category'], row['Sub-Category'],
+                              row['Product Name']) for row in rows)
+        self.products = [key for key in popularity if prices[key]]
+        self.product_prices = np.array([np.median(prices[key]) for key in self.products])
+        self.product_weights = np.array([popularity[key] for key in self.products], dtype=np.float64)
+
+        self.quantities = _distribution(Counter(int(row['Quantity']) for row in rows))
+
+        # Desconto: depende do estado e da subcategoria
+        self.discounts = defaultdict(list)
+        self.state_discounts = defaultdict(list)
+        for row in rows:
+            self.discounts[(row['State'], row['Sub-Category'])].append(row['Discount'])
+            self.state_discounts[row['State']].append(row['Discount'])
+
+        # Margem (lucro / vendas) = a + b * desconto + ruído, por subcategoria
+        self.margins = {}
+        # (ajuste ponderado pelas vendas, para preservar a margem agregada)
+        by_sub = defaultdict(lambda: ([], [], []))
+        for row in rows:
+            sales = float(row['Sales'])
+            if sales > 0:
+                by_sub[row['Sub-Category']][0].append(float(row['Discount']))
+                by_sub[row['Sub-Category']][1].append(float(row['Profit']) / sales)
+                by_sub[row['Sub-Category']][2].append(sales)
+        for sub, (discount, margin, sales) in by_sub.items():
+            discount, margin, sales = np.array(discount), np.array(margin), np.array(sales)
+            if len(set(discount.tolist())) > 1:
+                b, a = np.polyfit(discount, margin, 1, w=np.sqrt(sales))
+            else:
+                b, a = 0.0, float(np.average(margin, weights=sales))
+            noise = float(np.sqrt(np.average((margin - (a + b * discount)) ** 2, weights=sales)))
+            self.margins[sub] = (float(a), float(b), noise)
+
+
+class SalesGenerator:
+    """Gera linhas (dicts com as colunas do CSV) a partir de um perfil"""
+
+    def __init__(self, profile, rows, seed=DEFAULT_SEED):
+        self.profile = profile
+        self.rows = rows
+        self.rng = np.random.default_rng(seed)
+        scale = rows / profile.source_rows
+        self._build_customers(max(len(profile.customers), round(len(profile.customers) * scale)))
+        self._build_products(max(len(profile.products), round(len(profile.products) * math.sqrt(scale))))
+        self._build_calendar()
+
+    def _build_customers(self, count):
+        """Clientes originais mais clientes novos com nomes recombinados"""
+        p = self.profile
+        rng = self.rng
+        extra = count - len(p.customers)
+        segments, segment_probs = p.segments
+
+        self.customers = list(p.customers)
+        firsts = rng.integers(len(p.first_names), size=extra)
+        lasts = rng.integers(len(p.last_names), size=extra)
+        segment_codes = rng.choice(len(segments), size=extra, p=segment_probs)
+        for k in range(extra):
+            first, last = p.first_names[firsts[k]], p.last_names[lasts[k]]
+            customer_id = f"{first[0]}{last[0]}-{30000 + k}".upper()
+            self.customers.append((customer_id, f"{first} {last}", segments[segment_codes[k]]))
+
+        weights = np.concatenate((p.customer_weights, rng.choice(p.customer_weights, size=extra)))
+        self.customer_probs = weights / weights.sum()
+
+    def _build_products(self, count):
+        """Catálogo original mais variações de produtos existentes"""
+        p = self.profile
+        rng = self.rng
+        extra = count - len(p.products)
+
+        self.products = list(p.products)
+        bases = rng.integers(len(p.products), size=extra)
+        factors = rng.lognormal(-0.25 ** 2 / 2, 0.25, size=extra)  # média 1
+        for k, base in enumerate(bases.tolist()):
+            product_id, category, sub_category, name = p.products[base]
+            new_id = f"{product_id.rsplit('-', 1)[0]}-{20000000 + k}"
+            self.products.append((new_id, category, sub_category, f"{name}, Model {k + 1}"))
+        self.product_prices = np.concatenate((p.product_prices, p.product_prices[bases] * factors))
+
+        weights = np.concatenate((p.product_weights, p.product_weights[bases]))
+        self.product_probs = weights / weights.sum()
+
+    def _build_calendar(self):
+        """Probabilidade de cada dia do período (ano x mês x dia da semana)"""
+        p = self.profile
+        days = (p.last_date - p.first_date).days + 1
+        self.days = [p.first_date + timedelta(days=i) for i in range(days)]
+        weights = np.array([p.year_weights[d.year] * p.month_weights[d.month] * p.weekday_weights[d.weekday()]
+                            for d in self.days], dtype=np.float64)
+        self.day_probs = weights / weights.sum()
+
+    def __iter__(self):
+        """Linhas em ordem de Row ID, geradas em lotes de CHUNK_ORDERS pedidos"""
+        p = self.profile
+        rng = self.rng
+        items_values, items_probs = p.items
+        geographies, geo_probs = p.geography
+        modes, mode_probs = p.ship_modes
+        prefixes, prefix_probs = p.order_prefixes
+        quantities, quantity_probs = p.quantities
+
+        row_id = 0
+        order_number = 100000
+        while row_id < self.rows:
+            n = CHUNK_ORDERS
+            items = rng.choice(items_values, size=n, p=items_probs)
+            customers = rng.choice(len(self.customers), size=n, p=self.customer_probs)
+            geos = rng.choice(len(geographies), size=n, p=geo_probs)
+            ship_modes = rng.choice(len(modes), size=n, p=mode_probs)
+            days = rng.choice(len(self.days), size=n, p=self.day_probs)
+            returned = rng.random(n) < np.array([p.returned_rates[size] for size in items.tolist()])
+            order_prefixes = rng.choice(len(prefixes), size=n, p=prefix_probs)
+
+            lines = int(items.sum())
+            products = rng.choice(len(self.products), size=lines, p=self.product_probs)
+            line_quantities = rng.choice(quantities, size=lines, p=quantity_probs)
+            uniform = rng.random(lines)
+            price_noise = rng.lognormal(-0.05 ** 2 / 2, 0.05, size=lines)
+            margin_noise = rng.standard_normal(lines)
+
+            line = 0
+            for i in range(n):
+                order_date = self.days[days[i]]
+                mode = modes[ship_modes[i]]
+                delays, delay_probs = p.ship_delays[mode]
+                ship_date = order_date + timedelta(days=int(rng.choice(delays, p=delay_probs)))
+                order_id = f"{prefixes[order_prefixes[i]]}-{order_date.year}-{order_number}"
+                order_number += 1
+                customer_id, customer_name, segment = self.customers[customers[i]]
+                city, state, postal_code, region = geographies[geos[i]]
+
+                for _ in range(items[i]):
+                    if row_id >= self.rows:
+                        return
+                    row_id += 1
+                    product = products[line]
+                    product_id, category, sub_category, product_name = self.products[product]
+                    quantity = int(line_quantities[line])
+                    choices = p.discounts.get((state, sub_category)) or p.state_discounts[state]
+                    discount = choices[int(uniform[line] * len(choices))]
+                    sales = self.product_prices[product] * quantity * (1 - float(discount)) * price_noise[line]
+                    a, b, noise = p.margins[sub_category]
+                    profit = sales * (a + b * float(discount) + noise * margin_noise[line])
+                    line += 1
+
+                    yield {
+                        'Row ID': row_id,
+                        'Order ID': order_id,
+                        'Order Date': order_date.isoformat(),
+                        'Ship Date': ship_date.isoformat(),
+                        'Ship Mode': mode,
+                        'Customer ID': customer_id,
+                        'Customer Name': customer_name,
+                        'Segment': segment,
+                        'Country': p.country,
+                        'City': city,
+                        'State': state,
+                        'Postal Code': postal_code,
+                        'Region': region,
+                        'Retail Sales People': p.sales_people[region],
+                        'Product ID': product_id,
+                        'Category': category,
+                        'Sub-Category': sub_category,
+                        'Product Name': product_name,
+                        'Returned': 'Yes' if returned[i] else 'Not',
+                        'Sales': round(float(sales), 4),
+                        'Quantity': quantity,
+                        'Discount': discount,
+                        'Profit': round(float(profit), 4)
+                    }
+
+
+def generate_csv(csv_file, rows, seed=DEFAULT_SEED, source=DEFAULT_SOURCE, progress=True):
+    """Grava `rows` linhas sintéticas em `csv_file`; retorna o número de linhas"""
+    profile = DatasetProfile(source)
+    generator = SalesGenerator(profile, rows, seed)
+    count = 0
+    with open(csv_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=profile.columns)
+        writer.writeheader()
+        for row in generator:
+            writer.writerow(row)
+            count += 1
+            if progress and count % 100000 == 0:
+                print(f"  Geradas {count} linhas...")
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gerador de dataset sintético de vendas")
+    parser.add_argument('--rows', type=int, required=True, help="número de linhas")
+    parser.add_argument('--csv', required=True, help="arquivo CSV de saída")
+    parser.add_argument('--xml', default=None, help="converte também para este XML")
+    parser.add_argument('--snapshot', action='store_true',
+                        help="grava o snapshot binário do XML (requer --xml)")
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help="semente do gerador")
+    parser.add_argument('--source', default=DEFAULT_SOURCE,
+                        help="CSV de onde as distribuições são extraídas")
+    args = parser.parse_args()
+
+    print(f"🎲 Gerando {args.rows} linhas em {args.csv} (semente {args.seed})...")
+    count = generate_csv(args.csv, args.rows, args.seed, args.source)
+    print(f"✅ Geradas {count} linhas")
+
+    if args.xml:
+        converter = CSVtoXMLConverter(args.csv, args.xml)
+        if converter.convert_stream() and args.snapshot:
+            converter.write_snapshot()
+
+
+if __name__ == '__main__':
+    main()
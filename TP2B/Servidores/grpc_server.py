@@ -3,223 +3,781 @@
 """
 Servidor gRPC para consultas de vendas em XML
 """
+import argparse
+import asyncio
+import functools
+import logging
+import threading
+import time
 import grpc
 from concurrent import futures
 from lxml import etree
 import sales_pb2
 import sales_pb2_grpc
+import metrics
+from metrics import Call, Metrics
+from sales_data import FileWatcher, SalesDataset, refresh_dataset, resolve_field
+from sales_query import (STATS_METRICS, dashboard_summary, dimension_label, resolve_dimension,
+                         run_query, sales_stats, time_series)
+import xpath_guard
+from xpath_guard import XPathGuard, XPathRejected, XPathTimeout, XPathTooLarge
+from xpath_queries import DEFAULT_RESULT_CACHE_BYTES, XPathResultCache
+
+
+log = logging.getLogger('grpc_server')
+
+# Registros por mensagem nas RPCs com streaming
+DEFAULT_BATCH_SIZE = 500
+
+# Painéis de GetDashboardSummary
+SUMMARY_PANELS = ('regions', 'top_products', 'top_states', 'bottom_states', 'loss_states')
+
+# Erros da proteção de consultas XPath -> status gRPC
+_XPATH_STATUS = {
+    XPathRejected: grpc.StatusCode.INVALID_ARGUMENT,
+    XPathTimeout: grpc.StatusCode.DEADLINE_EXCEEDED,
+    XPathTooLarge: grpc.StatusCode.RESOURCE_EXHAUSTED
+}
+
+
+def _predicate_spec(predicate):
+    """Predicate (protobuf) -> dict de sales_query"""
+    return {'field': predicate.field, 'op': predicate.op, 'values': list(predicate.values),
+            'lower': predicate.lower, 'upper': predicate.upper}
+
+
+def _projection(fields):
+    """Campos pedidos em `fields` (nomes XML), validados antes da consulta; None: todos"""
+    return [resolve_field(f) for f in fields] or None
+
+
+def _status(context):
+    """Nome do código gRPC definido pelo handler ('OK' se nenhum)"""
+    code = context.code()
+    return code.name if code is not None else 'OK'
+
+
+def _instrumented(size=None):
+    """Registra a RPC em `self.metrics`; `size(resposta)` dá os itens do resultado"""
+    def decorate(method):
+        name = method.__name__
+        
+        @functools.wraps(method)
+        def wrapper(self, request, context):
+            with self.metrics.call(name) as call:
+                response = method(self, request, context)
+                call.status = _status(context)
+                if size is not None and call.status == 'OK':
+                    call.size = size(response)
+                return response
+        return wrapper
+    return decorate
+
+
+def _instrumented_stream(method):
+    """Como _instrumented, para RPCs com streaming (tamanho: registros enviados).
+    
+    Cada lote pode ser gerado em uma thread diferente (modo asyncio), então
+    a chamada é reativada a cada passo do gerador.
+    """
+    name = method.__name__
+    
+    @functools.wraps(method)
+    def wrapper(self, request, context):
+        call = Call(name)
+        call.size = 0
+        iterator = method(self, request, context)
+        try:
+            while True:
+                with self.metrics.activate(call):
+                    message = next(iterator, None)
+                if message is None:
+                    break
+                call.size += len(message.records)
+                yield message
+            call.status = _status(context)
+        except GeneratorExit:
+            call.status = 'CANCELLED'
+            raise
+        except BaseException:
+            call.status = 'error'
+            raise
+        finally:
+            self.metrics.finish(call)
+    return wrapper
+
+
+def _timed_handler(metrics, handler, method):
+    """Troca o serializador da resposta por um que mede tempo e bytes"""
+    if handler is None or handler.response_serializer is None:
+        return handler
+    name = method.rsplit('/', 1)[-1]
+    serialize = handler.response_serializer
+    
+    def serializer(message):
+        start = time.perf_counter()
+        data = serialize(message)
+        metrics.observe_response(name, len(data), time.perf_counter() - start)
+        return data
+    return handler._replace(response_serializer=serializer)
+
+
+class _SerializationInterceptor(grpc.ServerInterceptor):
+    """Mede a serialização das respostas (fase 'serialize' e bytes)"""
+    
+    def __init__(self, metrics):
+        self.metrics = metrics
+    
+    def intercept_service(self, continuation, handler_call_details):
+        return _timed_handler(self.metrics, continuation(handler_call_details),
+                              handler_call_details.method)
+
+
+class _AsyncSerializationInterceptor(grpc.aio.ServerInterceptor):
+    """_SerializationInterceptor para o servidor grpc.aio"""
+    
+    def __init__(self, metrics):
+        self.metrics = metrics
+    
+    async def intercept_service(self, continuation, handler_call_details):
+        return _timed_handler(self.metrics, await continuation(handler_call_details),
+                              handler_call_details.method)
 
 
 class SalesService(sales_pb2_grpc.SalesServiceServicer):
-    def __init__(self, xml_file):
+    def __init__(self, xml_file, batch_size=DEFAULT_BATCH_SIZE,
+                 cache_bytes=DEFAULT_RESULT_CACHE_BYTES, cache_ttl=None,
+                 xpath_limits=None, xpath_workers=2, snapshot=True, metrics=None):
         self.xml_file = xml_file
+        self.snapshot = snapshot
+        self.batch_size = batch_size
+        self.xpath_cache = XPathResultCache(cache_bytes, cache_ttl)
+        self.xpath_guard = XPathGuard(xml_file, xpath_limits, xpath_workers)
         self.namespace = {'ns': 'http://sales.example.com'}
-        self.tree = None
+        self.data = None
+        self._reload_lock = threading.RLock()
         self.load_xml()
+        
+        self.metrics = metrics or Metrics()
+        self.metrics.register_cache('xpath', self.xpath_cache.stats)
+        self.metrics.register_gauge('sales_dataset_records', "Registros do dataset carregado",
+                                    lambda: self.data.size)
     
     def load_xml(self):
-        """Carrega o arquivo XML"""
-        print(f"📂 Carregando {self.xml_file}...")
+        """Carrega o arquivo XML e troca o snapshot ativo.
+        
+        O novo dataset (árvore, colunas, índices e agregados) é montado à
+        parte e só então substitui `self.data`. Cada requisição lê
+        `self.data` uma única vez, então as que estão em andamento terminam
+        com o snapshot anterior.
+        """
+        with self._reload_lock:
+            log.info(f"📂 Carregando {self.xml_file}...")
+            try:
+                data = SalesDataset(self.xml_file, self.snapshot)
+            except Exception as e:
+                log.error(f"❌ Erro ao carregar XML: {e}")
+                raise
+            self._activate(data)
+            return data
+    
+    def refresh(self, force=False):
+        """Atualiza o dataset se o XML mudou.
+        
+        Um lote do conversor incremental que parte da versão carregada é
+        absorvido sem reler o XML; nos demais casos o XML é relido.
+        Retorna (modo, dataset), com modo 'delta', 'full' ou None.
+        """
+        with self._reload_lock:
+            mode, data = refresh_dataset(self.data, self.snapshot, force)
+            if mode is not None:
+                self._activate(data)
+            return mode, data
+    
+    def _activate(self, data):
+        """Troca o snapshot ativo"""
+        self.data = data
+        if data.source == 'delta':
+            self.xpath_guard.extend(data)
+        else:
+            self.xpath_guard.reload(data)
+        self.xpath_cache.clear()
+        log.info(f"✅ XML carregado com sucesso! ({data.size} registros, origem: {data.source}, versão {data.version})")
+    
+    def watch(self, interval):
+        """Atualiza o dataset quando o arquivo XML mudar"""
+        return FileWatcher(self.xml_file, self.refresh, interval, self.data.version).start()
+    
+    @_instrumented()
+    def Reload(self, request, context):
+        """Recarrega o XML sem reiniciar o servidor"""
+        log.info(f"🔄 gRPC: Recarga solicitada")
+        
         try:
-            self.tree = etree.parse(self.xml_file)
-            print("✅ XML carregado com sucesso!")
+            mode, data = self.refresh(request.force)
+            return sales_pb2.DatasetInfo(version=data.version, record_count=data.size,
+                                         reloaded=mode is not None, mode=mode or '')
         except Exception as e:
-            print(f"❌ Erro ao carregar XML: {e}")
-            raise
+            context.set_details(f"Erro ao recarregar: {str(e)}")
+            context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+            return sales_pb2.DatasetInfo()
+    
+    @_instrumented()
+    def GetDatasetInfo(self, request, context):
+        """Versão e tamanho do dataset atual (chamada frequente: sem log)"""
+        data = self.data
+        return sales_pb2.DatasetInfo(version=data.version, record_count=data.size)
     
+    @_instrumented(size=lambda response: len(response.records))
     def GetRecordsByRegion(self, request, context):
         """Buscar registros por região"""
-        print(f"🔍 gRPC: Buscando região '{request.region}'")
+        log.debug(f"🔍 gRPC: Buscando região '{request.region}'")
         
         try:
-            xpath = f"//ns:Record[ns:Region='{request.region}']"
-            records = self.tree.xpath(xpath, namespaces=self.namespace)
-            
-            response_records = []
-            for rec in records:
-                response_records.append(self._xml_to_proto(rec))
+            fields = _projection(request.fields)
+            data = self.data
+            with self.metrics.span('query'):
+                rows = data.where('Region', request.region)
+            response = self._records_response(data, rows, request, fields)
             
-            print(f"✅ Encontrados {len(response_records)} registros")
-            return sales_pb2.RecordsResponse(
-                records=response_records,
-                total_count=len(response_records)
-            )
+            log.debug(f"✅ Encontrados {response.total_count} registros")
+            return response
+        except ValueError as e:
+            context.set_details(f"Erro: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return sales_pb2.RecordsResponse()
         except Exception as e:
             context.set_details(f"Erro: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
             return sales_pb2.RecordsResponse()
     
+    @_instrumented(size=lambda response: len(response.records))
     def GetRecordsByCategory(self, request, context):
         """Buscar registros por categoria"""
-        print(f"🔍 gRPC: Buscando categoria '{request.category}'")
+        log.debug(f"🔍 gRPC: Buscando categoria '{request.category}'")
         
         try:
-            xpath = f"//ns:Record[ns:Category='{request.category}']"
-            records = self.tree.xpath(xpath, namespaces=self.namespace)
+            fields = _projection(request.fields)
+            data = self.data
+            with self.metrics.span('query'):
+                rows = data.where('Category', request.category)
+            response = self._records_response(data, rows, request, fields)
             
-            response_records = []
-            for rec in records:
-                response_records.append(self._xml_to_proto(rec))
-            
-            print(f"✅ Encontrados {len(response_records)} registros")
-            return sales_pb2.RecordsResponse(
-                records=response_records,
-                total_count=len(response_records)
-            )
+            log.debug(f"✅ Encontrados {response.total_count} registros")
+            return response
+        except ValueError as e:
+            context.set_details(f"Erro: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return sales_pb2.RecordsResponse()
         except Exception as e:
             context.set_details(f"Erro: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
             return sales_pb2.RecordsResponse()
     
+    @_instrumented(size=lambda response: len(response.records))
     def GetRecordsByCustomer(self, request, context):
         """Buscar registros por cliente"""
-        print(f"🔍 gRPC: Buscando cliente '{request.customer_id}'")
+        log.debug(f"🔍 gRPC: Buscando cliente '{request.customer_id}'")
         
         try:
-            xpath = f"//ns:Record[ns:CustomerID='{request.customer_id}']"
-            records = self.tree.xpath(xpath, namespaces=self.namespace)
-            
-            response_records = []
-            for rec in records:
-                response_records.append(self._xml_to_proto(rec))
+            fields = _projection(request.fields)
+            data = self.data
+            with self.metrics.span('query'):
+                rows = data.where('CustomerID', request.customer_id)
+            response = self._records_response(data, rows, request, fields)
             
-            print(f"✅ Encontrados {len(response_records)} registros")
-            return sales_pb2.RecordsResponse(
-                records=response_records,
-                total_count=len(response_records)
-            )
+            log.debug(f"✅ Encontrados {response.total_count} registros")
+            return response
+        except ValueError as e:
+            context.set_details(f"Erro: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return sales_pb2.RecordsResponse()
         except Exception as e:
             context.set_details(f"Erro: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
             return sales_pb2.RecordsResponse()
     
+    @_instrumented(size=lambda response: len(response.groups))
     def GetSalesStats(self, request, context):
         """Obter estatísticas de vendas"""
-        print(f"🔍 gRPC: Estatísticas por '{request.field}'")
+        group_by = list(request.group_by) or [request.field]
+        log.debug(f"🔍 gRPC: Estatísticas por {' × '.join(group_by)}")
         
         try:
-            # Agrupar por campo solicitado
-            field = request.field.lower()
-            stats = {}
-            
-            records = self.tree.xpath("//ns:Record", namespaces=self.namespace)
-            
-            for rec in records:
-                key = self._get_text(rec, field.capitalize())
-                sales = float(self._get_text(rec, 'Sales') or 0)
-                profit = float(self._get_text(rec, 'Profit') or 0)
-                
-                if key not in stats:
-                    stats[key] = {'sales': 0, 'profit': 0, 'count': 0}
-                
-                stats[key]['sales'] += sales
-                stats[key]['profit'] += profit
-                stats[key]['count'] += 1
+            # Agrupar pelas dimensões solicitadas, com todas as métricas
+            with self.metrics.span('query'):
+                stats = sales_stats(self.data, group_by, [_predicate_spec(p) for p in request.where])
             
             # Construir resposta
-            response = sales_pb2.StatsResponse()
-            for key, values in stats.items():
-                response.total_sales[key] = values['sales']
-                response.total_profit[key] = values['profit']
-                response.record_count[key] = values['count']
+            with self.metrics.span('convert'):
+                response = sales_pb2.StatsResponse()
+                labels = [dimension_label(resolve_dimension(f)) for f in group_by]
+                response.group_by.extend(labels)
+                for group in stats:
+                    keys = [group[label] for label in labels]
+                    key = '|'.join(keys)
+                    response.total_sales[key] = group['sales_total']
+                    response.total_profit[key] = group['profit_total']
+                    response.record_count[key] = group['count']
+                    response.groups.add(keys=keys, **{name: group[name] for name in STATS_METRICS})
             
-            print(f"✅ Estatísticas calculadas para {len(stats)} grupos")
+            log.debug(f"✅ Estatísticas calculadas para {len(stats)} grupos")
             return response
             
+        except ValueError as e:
+            context.set_details(f"Erro: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return sales_pb2.StatsResponse()
         except Exception as e:
             context.set_details(f"Erro: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
             return sales_pb2.StatsResponse()
     
+    @_instrumented(size=lambda response: response.result_count)
     def ExecuteXPath(self, request, context):
         """Consulta XPath personalizada"""
-        print(f"🔍 gRPC: XPath '{request.xpath_query}'")
+        log.debug(f"🔍 gRPC: XPath '{request.xpath_query}'")
+        
+        try:
+            version = self.data.version
+            str_results = self.xpath_cache.get(version, request.xpath_query)
+            cached = str_results is not None
+            if not cached:
+                with self.metrics.span('query'):
+                    str_results = self.xpath_guard.run(request.xpath_query, pretty_print=True)
+                self.xpath_cache.put(version, request.xpath_query, str_results)
+            
+            log.debug(f"✅ XPath retornou {len(str_results)} resultados" + (" (cache)" if cached else ""))
+            with self.metrics.span('convert'):
+                return sales_pb2.XPathResponse(
+                    results=str_results,
+                    result_count=len(str_results)
+                )
+        except Exception as e:
+            log.warning(f"❌ Erro XPath: {e}")
+            context.set_details(f"Erro XPath: {str(e)}")
+            context.set_code(_XPATH_STATUS.get(type(e), grpc.StatusCode.INTERNAL))
+            return sales_pb2.XPathResponse()
+    
+    @_instrumented(size=lambda response: len(response.rows) + len(response.records))
+    def Query(self, request, context):
+        """Consulta estruturada (filtros, agrupamento, agregações, top-N)"""
+        spec = {
+            'where': [_predicate_spec(p) for p in request.where],
+            'group_by': list(request.group_by),
+            'aggregates': [{'func': a.func, 'field': a.field} for a in request.aggregates],
+            'order_by': request.order_by,
+            'limit': request.limit,
+            'fields': list(request.fields)
+        }
+        log.debug(f"🔍 gRPC: Query ({len(spec['where'])} filtros, agrupando por {spec['group_by'] or '-'})")
         
         try:
-            results = self.tree.xpath(request.xpath_query, namespaces=self.namespace)
+            with self.metrics.span('query'):
+                result = run_query(self.data, spec)
             
-            str_results = []
-            for res in results:
-                if isinstance(res, etree._Element):
-                    str_results.append(etree.tostring(res, encoding='unicode', pretty_print=True))
+            with self.metrics.span('convert'):
+                response = sales_pb2.QueryResponse(matched=result['matched'])
+                if 'records' in result:
+                    response.records.extend(sales_pb2.SalesRecord(**rec) for rec in result['records'])
                 else:
-                    str_results.append(str(res))
+                    groups = len(spec['group_by'])
+                    response.columns.extend(result['columns'])
+                    response.total_rows = result['total_rows']
+                    for row in result['rows']:
+                        response.rows.add(keys=row[:groups], values=row[groups:])
             
-            print(f"✅ XPath retornou {len(str_results)} resultados")
-            return sales_pb2.XPathResponse(
-                results=str_results,
-                result_count=len(str_results)
-            )
+            if 'records' in result:
+                log.debug(f"✅ Query: {result['matched']} registros, {len(result['records'])} retornados")
+                return response
+            log.debug(f"✅ Query: {result['matched']} registros, {len(result['rows'])} linhas")
+            return response
+            
+        except ValueError as e:
+            context.set_details(f"Erro: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return sales_pb2.QueryResponse()
         except Exception as e:
-            context.set_details(f"Erro XPath: {str(e)}")
+            context.set_details(f"Erro: {str(e)}")
             context.set_code(grpc.StatusCode.INTERNAL)
-            return sales_pb2.XPathResponse()
+            return sales_pb2.QueryResponse()
     
-    def _xml_to_proto(self, xml_record):
-        """Converte elemento XML para mensagem protobuf"""
-        return sales_pb2.SalesRecord(
-            row_id=int(self._get_text(xml_record, 'RowID') or 0),
-            order_id=self._get_text(xml_record, 'OrderID'),
-            order_date=self._get_text(xml_record, 'OrderDate'),
-            ship_date=self._get_text(xml_record, 'ShipDate'),
-            ship_mode=self._get_text(xml_record, 'ShipMode'),
-            customer_id=self._get_text(xml_record, 'CustomerID'),
-            customer_name=self._get_text(xml_record, 'CustomerName'),
-            segment=self._get_text(xml_record, 'Segment'),
-            country=self._get_text(xml_record, 'Country'),
-            city=self._get_text(xml_record, 'City'),
-            state=self._get_text(xml_record, 'State'),
-            postal_code=self._get_text(xml_record, 'PostalCode'),
-            region=self._get_text(xml_record, 'Region'),
-            retail_sales_people=self._get_text(xml_record, 'RetailSalesPeople'),
-            product_id=self._get_text(xml_record, 'ProductID'),
-            category=self._get_text(xml_record, 'Category'),
-            sub_category=self._get_text(xml_record, 'SubCategory'),
-            product_name=self._get_text(xml_record, 'ProductName'),
-            returned=self._get_text(xml_record, 'Returned'),
-            sales=float(self._get_text(xml_record, 'Sales') or 0),
-            quantity=int(self._get_text(xml_record, 'Quantity') or 0),
-            discount=float(self._get_text(xml_record, 'Discount') or 0),
-            profit=float(self._get_text(xml_record, 'Profit') or 0)
-        )
-    
-    def _get_text(self, element, tag):
-        """Extrai texto de um elemento XML"""
-        elem = element.find(f'.//ns:{tag}', self.namespace)
-        return elem.text if elem is not None else ""
-
-
-def serve(xml_file='output.xml', host='localhost', port=50051):
+    @_instrumented(size=lambda response: len(response.points))
+    def GetTimeSeries(self, request, context):
+        """Série temporal por OrderDate, opcionalmente dividida por uma dimensão"""
+        granularity = request.granularity or 'month'
+        log.debug(f"🔍 gRPC: Série temporal por {granularity}"
+                  + (f" dividida por '{request.split_by}'" if request.split_by else ""))
+        
+        try:
+            with self.metrics.span('query'):
+                points = time_series(self.data, granularity, request.start, request.end, request.split_by)
+            
+            with self.metrics.span('convert'):
+                response = sales_pb2.TimeSeriesResponse(granularity=granularity)
+                split_by = ''
+                if request.split_by:
+                    split_by = dimension_label(resolve_dimension(request.split_by))
+                    response.split_by = split_by
+                for point in points:
+                    response.points.add(bucket=point['bucket'], split=point.get(split_by, ''),
+                                        sales=point['sales'], profit=point['profit'],
+                                        orders=point['orders'], records=point['records'])
+            
+            log.debug(f"✅ Série temporal com {len(points)} pontos")
+            return response
+            
+        except ValueError as e:
+            context.set_details(f"Erro: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+            return sales_pb2.TimeSeriesResponse()
+        except Exception as e:
+            context.set_details(f"Erro: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            return sales_pb2.TimeSeriesResponse()
+    
+    @_instrumented(size=lambda response: sum(len(getattr(response, panel)) for panel in SUMMARY_PANELS))
+    def GetDashboardSummary(self, request, context):
+        """KPIs, regiões, top produtos e estados do dashboard em uma resposta"""
+        data = self.data
+        top_n = request.top_n or 10
+        states_n = request.states_n or 10
+        etag = f"{data.version}/{top_n}/{states_n}" + ("/loss" if request.loss_states else "")
+        if request.if_none_match:
+            self.metrics.cache_access('dashboard_etag', request.if_none_match == etag)
+        if request.if_none_match == etag:
+            return sales_pb2.DashboardSummary(etag=etag, not_modified=True)
+        
+        log.debug(f"🔍 gRPC: Resumo do dashboard (top {top_n} produtos, {states_n} estados)")
+        try:
+            with self.metrics.span('query'):
+                summary = dashboard_summary(data, top_n, states_n, request.loss_states)
+            with self.metrics.span('convert'):
+                response = sales_pb2.DashboardSummary(etag=etag, **summary['kpis'])
+                for panel in SUMMARY_PANELS:
+                    getattr(response, panel).extend(
+                        sales_pb2.GroupTotals(**group) for group in summary.get(panel, ()))
+            log.debug(f"✅ Resumo do dashboard montado")
+            return response
+        except Exception as e:
+            context.set_details(f"Erro: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            return sales_pb2.DashboardSummary()
+    
+    @_instrumented_stream
+    def StreamRecordsByRegion(self, request, context):
+        """Registros por região, enviados em lotes"""
+        log.debug(f"🔍 gRPC: Streaming da região '{request.region}'")
+        yield from self._stream_records('Region', request.region, request, context)
+    
+    @_instrumented_stream
+    def StreamRecordsByCategory(self, request, context):
+        """Registros por categoria, enviados em lotes"""
+        log.debug(f"🔍 gRPC: Streaming da categoria '{request.category}'")
+        yield from self._stream_records('Category', request.category, request, context)
+    
+    @_instrumented_stream
+    def StreamRecordsByCustomer(self, request, context):
+        """Registros por cliente, enviados em lotes"""
+        log.debug(f"🔍 gRPC: Streaming do cliente '{request.customer_id}'")
+        yield from self._stream_records('CustomerID', request.customer_id, request, context)
+    
+    def _stream_records(self, field, value, request, context):
+        """Gera mensagens RecordsResponse com no máximo `batch_size` registros
+        dos registros em que `field` == `value`.
+        
+        Só o lote atual é convertido para protobuf, então a memória do
+        servidor e o tempo até o primeiro byte não dependem do tamanho
+        do resultado.
+        """
+        batch_size = request.batch_size if request.batch_size > 0 else self.batch_size
+        sent = 0
+        
+        try:
+            fields = _projection(request.fields)
+            data = self.data
+            with self.metrics.span('query'):
+                rows = data.where(field, value)
+            total = len(rows)
+            for start in range(0, total, batch_size):
+                if not context.is_active():
+                    log.info(f"⚠️  Streaming cancelado pelo cliente após {sent} registros")
+                    return
+                with self.metrics.span('convert'):
+                    batch = self._records_to_proto(data, rows[start:start + batch_size], fields)
+                sent += len(batch)
+                yield sales_pb2.RecordsResponse(records=batch, total_count=total)
+            
+            log.debug(f"✅ Enviados {sent} registros em lotes de {batch_size}")
+        except ValueError as e:
+            context.set_details(f"Erro: {str(e)}")
+            context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+        except Exception as e:
+            context.set_details(f"Erro: {str(e)}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+    
+    def _records_response(self, data, rows, request, fields):
+        """Monta a resposta paginada e projetada de uma consulta de registros.
+        
+        `page_token` é o deslocamento do primeiro registro da página;
+        `fields` (de _projection) limita os campos preenchidos em cada SalesRecord.
+        """
+        total = len(rows)
+        offset = 0
+        if request.page_token:
+            offset = int(request.page_token) if request.page_token.isdigit() else -1
+            if offset < 0 or offset > total:
+                raise ValueError(f"page_token inválido: '{request.page_token}'")
+        
+        end = offset + request.page_size if request.page_size > 0 else total
+        next_page_token = str(end) if end < total else ''
+        
+        with self.metrics.span('convert'):
+            return sales_pb2.RecordsResponse(
+                records=self._records_to_proto(data, rows[offset:end], fields),
+                total_count=total,
+                next_page_token=next_page_token
+            )
+    
+    def _records_to_proto(self, data, rows, fields=None):
+        """Converte linhas do dataset em mensagens protobuf"""
+        return [sales_pb2.SalesRecord(**rec) for rec in data.records(rows, fields)]
+
+
+class _ContextProxy:
+    """Contexto repassado aos métodos síncronos executados fora do event loop.
+    
+    Guarda código e detalhes de erro para aplicá-los ao contexto asyncio
+    na thread do loop, que é onde ele deve ser usado.
+    """
+    
+    def __init__(self, context):
+        self._context = context
+        self._code = None
+        self.details = None
+    
+    def set_code(self, code):
+        self._code = code
+    
+    def code(self):
+        return self._code
+    
+    def set_details(self, details):
+        self.details = details
+    
+    def is_active(self):
+        return not self._context.cancelled()
+    
+    def apply(self):
+        if self._code is not None:
+            self._context.set_code(self._code)
+        if self.details is not None:
+            self._context.set_details(self.details)
+
+
+def _unary(name, executor='executor'):
+    async def handler(self, request, context):
+        return await self._call(name, request, context, getattr(self, executor))
+    handler.__name__ = name
+    return handler
+
+
+def _streaming(name):
+    async def handler(self, request, context):
+        async for message in self._stream(name, request, context):
+            yield message
+    handler.__name__ = name
+    return handler
+
+
+class AsyncSalesService(sales_pb2_grpc.SalesServiceServicer):
+    """Adaptador grpc.aio para o SalesService.
+    
+    As RPCs são recebidas no event loop e o trabalho (consultas,
+    agregações, conversão para protobuf) roda em um executor de tamanho
+    limitado, sem ocupar uma thread por requisição em espera.
+    
+    ExecuteXPath usa um executor próprio: a thread só espera a resposta
+    do processo auxiliar (até o tempo limite), e consultas lentas não
+    podem ocupar as threads das demais RPCs.
+    """
+    
+    def __init__(self, service, executor, xpath_executor=None):
+        self.service = service
+        self.executor = executor
+        self.xpath_executor = xpath_executor or executor
+    
+    async def _call(self, name, request, context, executor):
+        loop = asyncio.get_running_loop()
+        proxy = _ContextProxy(context)
+        method = getattr(self.service, name)
+        try:
+            return await loop.run_in_executor(executor, method, request, proxy)
+        finally:
+            proxy.apply()
+    
+    async def _stream(self, name, request, context):
+        loop = asyncio.get_running_loop()
+        proxy = _ContextProxy(context)
+        iterator = getattr(self.service, name)(request, proxy)
+        try:
+            while True:
+                message = await loop.run_in_executor(self.executor, next, iterator, None)
+                if message is None:
+                    break
+                yield message
+        finally:
+            proxy.apply()
+    
+    GetRecordsByRegion = _unary('GetRecordsByRegion')
+    GetRecordsByCategory = _unary('GetRecordsByCategory')
+    GetRecordsByCustomer = _unary('GetRecordsByCustomer')
+    GetSalesStats = _unary('GetSalesStats')
+    ExecuteXPath = _unary('ExecuteXPath', 'xpath_executor')
+    StreamRecordsByRegion = _streaming('StreamRecordsByRegion')
+    StreamRecordsByCategory = _streaming('StreamRecordsByCategory')
+    StreamRecordsByCustomer = _streaming('StreamRecordsByCustomer')
+    Reload = _unary('Reload')
+    GetDatasetInfo = _unary('GetDatasetInfo')
+    Query = _unary('Query')
+    GetTimeSeries = _unary('GetTimeSeries')
+    GetDashboardSummary = _unary('GetDashboardSummary')
+
+
+def _log_ready(host, port):
+    log.info(f"✅ Servidor gRPC pronto!")
+    log.info(f"   Endpoint: {host}:{port}")
+    log.info(f"   Métodos disponíveis:")
+    for method in sales_pb2.DESCRIPTOR.services_by_name['SalesService'].methods:
+        log.info(f"   - {method.name}")
+
+
+def serve(xml_file='output.xml', host='localhost', port=50051,
+          batch_size=DEFAULT_BATCH_SIZE, workers=10, max_concurrent_rpcs=None,
+          cache_bytes=DEFAULT_RESULT_CACHE_BYTES, cache_ttl=None,
+          xpath_limits=None, xpath_workers=2, watch_interval=None,
+          snapshot=True, trace=False, metrics_port=None, metrics_host='localhost'):
     """Inicia o servidor gRPC"""
-    print(f"🚀 Iniciando servidor gRPC em {host}:{port}")
+    log.info(f"🚀 Iniciando servidor gRPC em {host}:{port}")
     
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    sales_pb2_grpc.add_SalesServiceServicer_to_server(
-        SalesService(xml_file), server
-    )
+    # O processo auxiliar das consultas XPath é criado antes do servidor
+    registry = Metrics(trace)
+    service = SalesService(xml_file, batch_size, cache_bytes, cache_ttl,
+                           xpath_limits, xpath_workers, snapshot, registry)
+    service.xpath_guard.start()
+    
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=workers),
+                         interceptors=[_SerializationInterceptor(registry)],
+                         maximum_concurrent_rpcs=max_concurrent_rpcs)
+    sales_pb2_grpc.add_SalesServiceServicer_to_server(service, server)
     server.add_insecure_port(f'[::]:{port}')
     server.start()
     
-    print(f"✅ Servidor gRPC pronto!")
-    print(f"   Endpoint: {host}:{port}")
-    print(f"   Métodos disponíveis:")
-    print(f"   - GetRecordsByRegion")
-    print(f"   - GetRecordsByCategory") 
-    print(f"   - GetRecordsByCustomer")
-    print(f"   - GetSalesStats")
-    print(f"   - ExecuteXPath")
+    _log_ready(host, port)
+    if metrics_port:
+        metrics.start_http_server(registry, metrics_host, metrics_port)
+    if watch_interval:
+        service.watch(watch_interval)
+        log.info(f"   Recarga automática: verificando {xml_file} a cada {watch_interval:g}s")
     
     try:
         server.wait_for_termination()
     except KeyboardInterrupt:
-        print("\n🛑 Encerrando servidor gRPC...")
+        log.info("🛑 Encerrando servidor gRPC...")
         server.stop(0)
 
 
-if __name__ == '__main__':
-    import sys
-    xml_file = sys.argv[1] if len(sys.argv) > 1 else 'output.xml'
-    host = sys.argv[2] if len(sys.argv) > 2 else 'localhost'
-    port = int(sys.argv[3]) if len(sys.argv) > 3 else 50051
+async def serve_async(xml_file='output.xml', host='localhost', port=50051,
+                      batch_size=DEFAULT_BATCH_SIZE, workers=4, max_concurrent_rpcs=None,
+                      cache_bytes=DEFAULT_RESULT_CACHE_BYTES, cache_ttl=None,
+                      xpath_limits=None, xpath_workers=2, watch_interval=None,
+                      snapshot=True, trace=False, metrics_port=None, metrics_host='localhost'):
+    """Inicia o servidor gRPC em modo asyncio (grpc.aio).
+    
+    Um único event loop atende milhares de chamadas simultâneas; apenas
+    o trabalho de CPU ocupa uma das `workers` threads do executor.
+    """
+    log.info(f"🚀 Iniciando servidor gRPC (asyncio) em {host}:{port}")
+    
+    registry = Metrics(trace)
+    service = SalesService(xml_file, batch_size, cache_bytes, cache_ttl,
+                           xpath_limits, xpath_workers, snapshot, registry)
+    service.xpath_guard.start()
+    executor = futures.ThreadPoolExecutor(max_workers=workers)
+    # Threads que aguardam o processo auxiliar de XPath; as consultas além
+    # de `xpath_workers` esperam na fila dele, que também aplica o prazo
+    xpath_executor = futures.ThreadPoolExecutor(max_workers=max(2, 2 * xpath_workers),
+                                                thread_name_prefix='xpath')
+    server = grpc.aio.server(interceptors=[_AsyncSerializationInterceptor(registry)],
+                             maximum_concurrent_rpcs=max_concurrent_rpcs)
+    sales_pb2_grpc.add_SalesServiceServicer_to_server(
+        AsyncSalesService(service, executor, xpath_executor), server
+    )
+    server.add_insecure_port(f'[::]:{port}')
+    await server.start()
     
-    serve(xml_file, host, port)
\ No newline at end of file
+    _log_ready(host, port)
+    log.info(f"   Modo asyncio: {workers} workers, "
+             f"máx. {max_concurrent_rpcs or 'ilimitadas'} RPCs simultâneas")
+    if metrics_port:
+        metrics.start_http_server(registry, metrics_host, metrics_port)
+    if watch_interval:
+        service.watch(watch_interval)
+        log.info(f"   Recarga automática: verificando {xml_file} a cada {watch_interval:g}s")
+    
+    try:
+        await server.wait_for_termination()
+    finally:
+        await server.stop(0)
+        executor.shutdown(wait=False)
+        xpath_executor.shutdown(wait=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor gRPC para consultas de vendas em XML")
+    parser.add_argument('xml_file', nargs='?', default='output.xml')
+    parser.add_argument('host', nargs='?', default='localhost')
+    parser.add_argument('port', nargs='?', type=int, default=50051)
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help="usa o servidor asyncio (grpc.aio)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="threads de trabalho (padrão: 10; 4 no modo asyncio)")
+    parser.add_argument('--max-concurrent-rpcs', type=int, default=None,
+                        help="limite de RPCs simultâneas (excedentes recebem RESOURCE_EXHAUSTED)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help="registros por mensagem nas RPCs com streaming")
+    parser.add_argument('--xpath-cache-mb', type=float, default=DEFAULT_RESULT_CACHE_BYTES / 2**20,
+                        help="memória máxima do cache de resultados XPath, em MB (0 desativa)")
+    parser.add_argument('--xpath-cache-ttl', type=float, default=None,
+                        help="validade das entradas do cache XPath, em segundos")
+    parser.add_argument('--no-snapshot', dest='snapshot', action='store_false',
+                        help="ignora o snapshot binário e sempre lê o XML")
+    parser.add_argument('--watch', type=float, default=None, metavar='S',
+                        help="recarrega o XML quando o arquivo mudar (verificação a cada S segundos)")
+    xpath_guard.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure_logging(args.log_level)
+    cache_bytes = int(args.xpath_cache_mb * 2**20)
+    
+    if args.use_async:
+        try:
+            asyncio.run(serve_async(args.xml_file, args.host, args.port, args.batch_size,
+                                    args.workers or 4, args.max_concurrent_rpcs,
+                                    cache_bytes, args.xpath_cache_ttl,
+                                    xpath_guard.limits_from_args(args), args.xpath_workers,
+                                    args.watch, args.snapshot,
+                                    args.trace, args.metrics_port, args.metrics_host))
+        except KeyboardInterrupt:
+            log.info("🛑 Encerrando servidor gRPC...")
+    else:
+        serve(args.xml_file, args.host, args.port, args.batch_size,
+              args.workers or 10, args.max_concurrent_rpcs,
+              cache_bytes, args.xpath_cache_ttl,
+              xpath_guard.limits_from_args(args), args.xpath_workers,
+              args.watch, args.snapshot,
+              args.trace, args.metrics_port, args.metrics_host)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+#!/usr/bin/env python3
+"""
+Métricas e rastreamento das chamadas dos servidores
+
+- Por método: contador de requisições (por status), histograma de
+  latência, de tamanho do resultado (itens) e de bytes da resposta.
+- Caches: acertos, falhas e taxa de acerto (cache de resultados XPath,
+  etag do resumo do dashboard).
+- Com `--trace`, cada chamada mede também as suas fases (consulta,
+  conversão para protobuf/dict, serialização), em um histograma por fase.
+- `--metrics-port` expõe tudo em texto no formato do Prometheus, em
+  http://localhost:PORTA/metrics.
+
+Só a biblioteca padrão é usada; registrar uma chamada custa um lock e
+algumas buscas binárias.
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+import time
+
+
+log = logging.getLogger(__name__)
+
+# Limites dos histogramas (Prometheus: `le`, valor menor ou igual)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (0, 1, 10, 100, 1000, 10_000, 100_000, 1_000_000)
+BYTES_BUCKETS = tuple(256 * 4 ** k for k in range(10))  # 256 B .. 64 MB
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_NO_SPAN = nullcontext()
+
+
+def add_arguments(parser):
+    """Opções de log e métricas (comuns aos servidores)"""
+    parser.add_argument('--log-level', default='INFO',
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'],
+                        help="nível de log (DEBUG registra cada chamada)")
+    parser.add_argument('--metrics-port', type=int, default=None,
+                        help="porta HTTP do endpoint /metrics (padrão: desativado)")
+    parser.add_argument('--metrics-host', default='localhost',
+                        help="endereço do endpoint /metrics")
+    parser.add_argument('--trace', action='store_true',
+                        help="mede as fases de cada chamada (consulta, conversão, serialização)")
+
+
+def configure_logging(level='INFO'):
+    logging.basicConfig(level=getattr(logging, level), format=LOG_FORMAT)
+
+
+class Histogram:
+    """Contagens por faixa, soma e total das observações"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # a última faixa é +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Call:
+    """Uma chamada em andamento: status, tamanho do resultado e fases"""
+
+    __slots__ = ('method', 'start', 'status', 'size', 'phases', 'duration')
+
+    def __init__(self, method):
+        self.method = method
+        self.start = time.perf_counter()
+        self.status = 'OK'
+        self.size = None
+        self.phases = {}
+        self.duration = None
+
+
+class _Span:
+    def __init__(self, call, phase):
+        self.call = call
+        self.phase = phase
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        phases = self.call.phases
+        phases[self.phase] = phases.get(self.phase, 0.0) + time.perf_counter() - self.start
+
+
+class Metrics:
+    """Registro das métricas de um processo servidor"""
+
+    def __init__(self, tracing=False):
+        self.tracing = tracing
+        self.requests = defaultdict(int)    # (método, status) -> chamadas
+        self.latency = {}                   # método -> Histogram
+        self.result_size = {}               # método -> Histogram
+        self.response_bytes = {}            # método -> Histogram
+        self.phases = {}                    # (método, fase) -> Histogram
+        self.cache_counts = defaultdict(lambda: [0, 0])  # cache -> [acertos, falhas]
+        self._caches = {}                   # cache -> função stats()
+        self._gauges = {}                   # nome -> (descrição, função)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # --- Registro das chamadas ---
+
+    @contextmanager
+    def call(self, method):
+        """Mede uma chamada; exceções contam com status 'error'"""
+        call = Call(method)
+        try:
+            with self.activate(call):
+                yield call
+        except BaseException:
+            if call.status == 'OK':
+                call.status = 'error'
+            raise
+        finally:
+            self.finish(call)
+
+    @contextmanager
+    def activate(self, call):
+        """Torna `call` a chamada atual desta thread (destino dos spans).
+
+        Usado diretamente pelas RPCs com streaming, em que cada lote pode
+        ser produzido em uma thread diferente.
+        """
+        previous = getattr(self._local, 'call', None)
+        self._local.call = call
+        try:
+            yield call
+        finally:
+            self._local.call = previous
+
+    def span(self, phase):
+        """Mede uma fase da chamada atual (só com rastreamento ativo)"""
+        if not self.tracing:
+            return _NO_SPAN
+        call = getattr(self._local, 'call', None)
+        if call is None:
+            return _NO_SPAN
+        return _Span(call, phase)
+
+    def finish(self, call):
+        call.duration = time.perf_counter() - call.start
+        with self._lock:
+            self.requests[(call.method, call.status)] += 1
+            self._histogram(self.latency, call.method, LATENCY_BUCKETS).observe(call.duration)
+            if call.size is not None:
+                self._histogram(self.result_size, call.method, SIZE_BUCKETS).observe(call.size)
+            for phase, seconds in call.phases.items():
+                self._histogram(self.phases, (call.method, phase), LATENCY_BUCKETS).observe(seconds)
+        self._local.last = call
+        log.debug("%s %s em %.1f ms", call.method, call.status, call.duration * 1000)
+
+    def last_call(self):
+        """Última chamada concluída nesta thread"""
+        return getattr(self._local, 'last', None)
+
+    def observe_response(self, method, nbytes, seconds=None):
+        """Bytes da resposta serializada e, com rastreamento, o tempo gasto"""
+        with self._lock:
+            self._histogram(self.response_bytes, method, BYTES_BUCKETS).observe(nbytes)
+            if seconds is not None and self.tracing:
+                self._histogram(self.phases, (method, 'serialize'), LATENCY_BUCKETS).observe(seconds)
+
+    def cache_access(self, name, hit):
+        """Acerto ou falha de um cache que não mantém as próprias contagens"""
+        with self._lock:
+            self.cache_counts[name][0 if hit else 1] += 1
+
+    def register_cache(self, name, stats):
+        """Cache com `stats()` próprio (hits, misses e, se houver, entries, bytes, evictions)"""
+        self._caches[name] = stats
+
+    def register_gauge(self, name, description, value):
+        self._gauges[name] = (description, value)
+
+    @staticmethod
+    def _histogram(table, key, buckets):
+        histogram = table.get(key)
+        if histogram is None:
+            histogram = table[key] = Histogram(buckets)
+        return histogram
+
+    # --- Exposição ---
+
+    def render(self):
+        """Todas as métricas no formato de texto do Prometheus"""
+        lines = []
+        with self._lock:
+            _family(lines, 'sales_requests_total', 'counter', "Chamadas por método e status")
+            for (method, status), count in sorted(self.requests.items()):
+                lines.append(f"sales_requests_total{_labels(method=method, status=status)} {count}")
+            _histograms(lines, 'sales_request_duration_seconds', "Latência das chamadas",
+                        {(m,): h for m, h in self.latency.items()}, ('method',))
+            _histograms(lines, 'sales_result_size', "Itens no resultado (registros, grupos, pontos)",
+                        {(m,): h for m, h in self.result_size.items()}, ('method',))
+            _histograms(lines, 'sales_response_bytes', "Tamanho da resposta serializada",
+                        {(m,): h for m, h in self.response_bytes.items()}, ('method',))
+            if self.tracing:
+                _histograms(lines, 'sales_phase_duration_seconds', "Tempo de cada fase das chamadas",
+                            self.phases, ('method', 'phase'))
+            caches = {name: {'hits': hits, 'misses': misses}
+                      for name, (hits, misses) in self.cache_counts.items()}
+
+        for name, stats in self._caches.items():
+            caches[name] = stats()
+        self._render_caches(lines, caches)
+
+        for name, (description, value) in sorted(self._gauges.items()):
+            _family(lines, name, 'gauge', description)
+            lines.append(f"{name} {value()}")
+        return '\n'.join(lines) + '\n'
+
+    @staticmethod
+    def _render_caches(lines, caches):
+        if not caches:
+            return
+        families = (('hits', 'sales_cache_hits_total', 'counter', "Acertos do cache"),
+                    ('misses', 'sales_cache_misses_total', 'counter', "Falhas do cache"),
+                    ('evictions', 'sales_cache_evictions_total', 'counter', "Entradas descartadas por espaço"),
+                    ('entries', 'sales_cache_entries', 'gauge', "Entradas no cache"),
+                    ('bytes', 'sales_cache_bytes', 'gauge', "Memória ocupada pelo cache"))
+        for key, name, kind, description in families:
+            present = [(cache, stats[key]) for cache, stats in sorted(caches.items()) if key in stats]
+            if present:
+                _family(lines, name, kind, description)
+                lines.extend(f"{name}{_labels(cache=cache)} {value}" for cache, value in present)
+
+        _family(lines, 'sales_cache_hit_ratio', 'gauge', "Acertos / consultas ao cache")
+        for cache, stats in sorted(caches.items()):
+            total = stats['hits'] + stats['misses']
+            ratio = stats['hits'] / total if total else 0.0
+            lines.append(f"sales_cache_hit_ratio{_labels(cache=cache)} {ratio:.6g}")
+
+
+def _escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _labels(**labels):
+    return '{' + ','.join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + '}'
+
+
+def _family(lines, name, kind, description):
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} {kind}")
+
+
+def _histograms(lines, name, description, histograms, label_names):
+    if not histograms:
+        return
+    _family(lines, name, 'histogram', description)
+    for key, histogram in sorted(histograms.items()):
+        labels = dict(zip(label_names, key))
+        cumulative = 0
+        for bound, count in zip(histogram.buckets + ('+Inf',), histogram.counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_labels(**labels, le=bound)} {cumulative}")
+        lines.append(f"{name}_sum{_labels(**labels)} {histogram.sum!r}")
+        lines.append(f"{name}_count{_labels(**labels)} {histogram.count}")
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    metrics = None
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("metrics: " + format, *args)
+
+
+def start_http_server(metrics, host='localhost', port=9100):
+    """Serve /metrics em uma thread em segundo plano; retorna o servidor HTTP"""
+    handler = type('MetricsHandler', (_MetricsHandler,), {'metrics': metrics})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    log.info("📈 Métricas em http://%s:%d/metrics", host, port)
+    return server
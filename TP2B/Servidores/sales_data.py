@@ -0,0 +1,718 @@
+#!/usr/bin/env python3
+"""
+Armazenamento colunar em memória dos registros de vendas
+
+O XML é lido uma única vez e cada campo vira uma coluna tipada: um array
+NumPy por campo numérico e campos de texto codificados por dicionário
+(códigos inteiros + lista de valores distintos). Os servidores gRPC e
+XML-RPC respondem às consultas a partir dessas colunas.
+
+As colunas também podem ser gravadas em um snapshot binário ao lado do
+XML (`<xml>.snapshot/`: um .npy por array e meta.json com os dicionários).
+Na partida, um snapshot válido é aberto com mmap em milissegundos e a
+árvore XML só é lida se alguma consulta XPath precisar dela.
+
+Quando o conversor acrescenta registros ao XML (modo incremental), ele
+também grava o lote novo em `<xml>.delta.xml`; `SalesDataset.extend()`
+absorve esse lote sem reler o documento inteiro.
+"""
+import copy
+import datetime
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+from lxml import etree
+
+
+log = logging.getLogger(__name__)
+
+NAMESPACE = 'http://sales.example.com'
+
+# Campos do registro, na ordem do schema (elemento XML -> nome snake_case)
+FIELDS = {
+    'RowID': 'row_id',
+    'OrderID': 'order_id',
+    'OrderDate': 'order_date',
+    'ShipDate': 'ship_date',
+    'ShipMode': 'ship_mode',
+    'CustomerID': 'customer_id',
+    'CustomerName': 'customer_name',
+    'Segment': 'segment',
+    'Country': 'country',
+    'City': 'city',
+    'State': 'state',
+    'PostalCode': 'postal_code',
+    'Region': 'region',
+    'RetailSalesPeople': 'retail_sales_people',
+    'ProductID': 'product_id',
+    'Category': 'category',
+    'SubCategory': 'sub_category',
+    'ProductName': 'product_name',
+    'Returned': 'returned',
+    'Sales': 'sales',
+    'Quantity': 'quantity',
+    'Discount': 'discount',
+    'Profit': 'profit'
+}
+
+# Campos numéricos e seus tipos
+NUMERIC_FIELDS = {
+    'RowID': np.int64,
+    'Sales': np.float64,
+    'Quantity': np.int64,
+    'Discount': np.float64,
+    'Profit': np.float64
+}
+
+# Demais campos são texto, codificados por dicionário
+CATEGORICAL_FIELDS = [f for f in FIELDS if f not in NUMERIC_FIELDS]
+
+# Campos com índice invertido (filtros expostos pelos servidores)
+INDEXED_FIELDS = ['Region', 'Category', 'CustomerID']
+
+# Dimensões com agregados (vendas, lucro, contagem) pré-calculados na carga
+GROUPABLE_FIELDS = ['Region', 'Category', 'Segment', 'State',
+                    'SubCategory', 'ProductName', 'ShipMode']
+
+
+def _week_start(date):
+    """Segunda-feira da semana de uma data ISO"""
+    day = datetime.date.fromisoformat(date)
+    return (day - datetime.timedelta(days=day.weekday())).isoformat()
+
+
+# Granularidades das séries temporais -> rótulo do bucket de uma data ISO
+TIME_BUCKETS = {
+    'day': lambda date: date,
+    'week': _week_start,
+    'month': lambda date: date[:7],
+    'quarter': lambda date: f"{date[:4]}-Q{(int(date[5:7]) - 1) // 3 + 1}"
+}
+
+# Métricas das séries temporais, na ordem das colunas dos totais diários
+TIME_METRICS = ('sales', 'profit', 'orders', 'records')
+
+# Maior cubo (dias x valores x métricas) de totais diários por dimensão;
+# acima disso a divisão é calculada a partir das linhas do período
+SPLIT_CUBE_MAX_CELLS = 2_000_000
+
+# Versão do formato do snapshot binário
+SNAPSHOT_FORMAT = 1
+
+# Nome aceito nas consultas (minúsculo ou snake_case) -> elemento XML
+_FIELD_ALIASES = {}
+for _tag, _name in FIELDS.items():
+    _FIELD_ALIASES[_tag.lower()] = _tag
+    _FIELD_ALIASES[_name] = _tag
+
+
+def resolve_field(name):
+    """Converte o nome de um campo ('region', 'sub_category', 'SubCategory')
+    para o nome do elemento XML"""
+    tag = _FIELD_ALIASES.get(name.strip().lower())
+    if tag is None:
+        raise ValueError(f"Campo desconhecido: '{name}'")
+    return tag
+
+
+def dataset_version(xml_file):
+    """Identificador do conteúdo do arquivo: mtime (ns) e tamanho"""
+    stat = os.stat(xml_file)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def file_hash(path):
+    """SHA-256 do arquivo, lido em blocos"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def snapshot_path(xml_file):
+    """Diretório do snapshot binário de um XML"""
+    return f"{xml_file}.snapshot"
+
+
+def delta_paths(xml_file):
+    """Arquivos do último lote incremental: (registros, descrição JSON)"""
+    return f"{xml_file}.delta.xml", f"{xml_file}.delta.json"
+
+
+def load_delta_info(xml_file):
+    """Descrição do último lote acrescentado ao XML, ou None.
+
+    Campos: base_version (versão do XML antes do lote), version (depois),
+    delta_file, count, first_row_id e last_row_id.
+    """
+    try:
+        with open(delta_paths(xml_file)[1], encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _read_records(root, lookups):
+    """Lê os <Record> de `root` em listas por campo.
+
+    Retorna (valores numéricos, códigos categóricos); `lookups` (valor ->
+    código, por campo) é atualizado com os valores novos.
+    """
+    prefix = f'{{{NAMESPACE}}}'
+    numeric = {field: [] for field in NUMERIC_FIELDS}
+    codes = {field: [] for field in CATEGORICAL_FIELDS}
+
+    for record in root.iterchildren(f'{prefix}Record'):
+        values = {}
+        for child in record:
+            if isinstance(child.tag, str):
+                values[child.tag[len(prefix):]] = child.text or ''
+
+        for field in NUMERIC_FIELDS:
+            numeric[field].append(values.get(field) or 0)
+        for field in CATEGORICAL_FIELDS:
+            lookup = lookups[field]
+            value = values.get(field, '')
+            code = lookup.get(value)
+            if code is None:
+                code = lookup[value] = len(lookup)
+            codes[field].append(code)
+
+    numeric = {field: np.array(numeric[field], dtype=np.float64).astype(dtype)
+               for field, dtype in NUMERIC_FIELDS.items()}
+    codes = {field: np.array(codes[field], dtype=np.int32) for field in CATEGORICAL_FIELDS}
+    return numeric, codes
+
+
+class CategoricalColumn:
+    """Coluna de texto codificada por dicionário"""
+
+    def __init__(self, codes, values):
+        self.codes = codes      # np.int32, um código por registro
+        self.values = values    # valores distintos, na ordem de aparição
+        self.lookup = {value: code for code, value in enumerate(values)}
+
+    def code(self, value):
+        """Código de um valor (-1 se não existir no dicionário)"""
+        return self.lookup.get(value, -1)
+
+    def take(self, rows):
+        """Valores (str) das linhas informadas"""
+        values = self.values
+        return [values[code] for code in self.codes[rows].tolist()]
+
+
+class InvertedIndex:
+    """Índice invertido de uma coluna categórica: valor -> linhas.
+
+    As linhas ficam agrupadas por código em um único array (ordenação
+    estável, então cada grupo mantém a ordem original dos registros) e
+    `offsets[c]:offsets[c + 1]` delimita o grupo do código `c`. Uma busca
+    custa O(resultados), não O(registros).
+    """
+
+    def __init__(self, column, rows=None, offsets=None):
+        self.column = column
+        if rows is None:
+            rows = np.argsort(column.codes, kind='stable')
+            counts = np.bincount(column.codes, minlength=len(column.values))
+            offsets = np.concatenate(([0], np.cumsum(counts)))
+        self.rows = rows
+        self.offsets = offsets
+
+    def lookup(self, value):
+        code = self.column.code(value)
+        if code < 0:
+            return self.rows[:0]
+        return self.rows[self.offsets[code]:self.offsets[code + 1]]
+
+    def extended(self, column, start):
+        """Índice de `column`, cujas linhas a partir de `start` são novas.
+
+        Os grupos existentes são deslocados e as linhas novas entram no
+        fim de cada grupo (a ordem dos registros é mantida) sem reordenar
+        o índice inteiro: O(registros + novos * log(novos)).
+        """
+        groups = len(column.values)
+        new_codes = column.codes[start:]
+        old_counts = np.zeros(groups, dtype=np.int64)
+        old_counts[:len(self.offsets) - 1] = np.diff(self.offsets)
+        new_counts = np.bincount(new_codes, minlength=groups)
+        offsets = np.concatenate(([0], np.cumsum(old_counts + new_counts)))
+
+        rows = np.empty(len(column.codes), dtype=np.int64)
+        # Grupos antigos: deslocados pelas linhas novas dos grupos anteriores
+        new_before = np.concatenate(([0], np.cumsum(new_counts)))[:groups]
+        old_group = np.repeat(np.arange(groups), old_counts)
+        rows[np.arange(start) + new_before[old_group]] = self.rows
+        # Linhas novas: depois das antigas do mesmo grupo
+        order = np.argsort(new_codes, kind='stable')
+        group = new_codes[order]
+        rank = np.arange(len(order)) - new_before[group]
+        rows[offsets[group] + old_counts[group] + rank] = start + order
+        return InvertedIndex(column, rows, offsets)
+
+
+class DateIndex:
+    """Índice ordenado por OrderDate com totais por dia.
+
+    As datas distintas ficam ordenadas em `days`; `daily[i]` guarda os
+    totais (TIME_METRICS) de `days[i]`. Um período vira duas buscas
+    binárias e os totais de cada bucket saem de `np.add.reduceat` sobre
+    os dias do período: O(log n + dias), sem percorrer os registros. Somar
+    cada bucket diretamente evita o erro de arredondamento da diferença
+    de somas acumuladas (40.409999999974389 em vez de 40.41). O início de
+    cada bucket (semana, mês...) é pré-calculado na montagem.
+    """
+
+    def __init__(self, dates, orders, sales, profit):
+        order = sorted(range(len(dates.values)), key=dates.values.__getitem__)
+        self.days = np.array([dates.values[code] for code in order], dtype=str)
+        position = np.empty(len(order), dtype=np.int64)
+        position[order] = np.arange(len(order))
+        self.day = position[dates.codes]    # posição em `days` de cada registro
+        self.orders = orders.codes
+        self.sales = sales
+        self.profit = profit
+
+        # Registros agrupados por dia, para divisões sem cubo acumulado
+        self.rows = np.argsort(self.day, kind='stable')
+        self.row_offsets = np.concatenate(([0], np.cumsum(np.bincount(self.day, minlength=len(order)))))
+
+        self.daily = self._totals(self.day, len(self.days))
+
+        self.labels = {}
+        self.bucket_starts = {}
+        for granularity, bucket in TIME_BUCKETS.items():
+            labels = np.array([bucket(day) for day in self.days.tolist()], dtype=str)
+            self.labels[granularity] = labels
+            self.bucket_starts[granularity] = np.flatnonzero(
+                np.concatenate(([True], labels[1:] != labels[:-1]))) if len(labels) else labels
+
+        self._split_daily = {}
+        self._lock = threading.Lock()
+
+    def _totals(self, keys, groups, rows=None):
+        """Totais por chave: vendas, lucro, pedidos distintos e registros"""
+        sales = self.sales if rows is None else self.sales[rows]
+        profit = self.profit if rows is None else self.profit[rows]
+        orders = self.orders if rows is None else self.orders[rows]
+        # Um pedido tem uma única data: contar pares (chave, pedido) distintos
+        width = int(orders.max(initial=0)) + 1
+        order_keys = np.unique(keys.astype(np.int64) * width + orders) // width
+        return np.column_stack((
+            np.bincount(keys, weights=sales, minlength=groups),
+            np.bincount(keys, weights=profit, minlength=groups),
+            np.bincount(order_keys, minlength=groups),
+            np.bincount(keys, minlength=groups)
+        )).astype(np.float64)
+
+    def buckets(self, granularity, start=None, end=None):
+        """Rótulos e limites (posições em `days`) dos buckets de [start, end]"""
+        if granularity not in TIME_BUCKETS:
+            raise ValueError(f"Granularidade desconhecida: '{granularity}' (use {', '.join(TIME_BUCKETS)})")
+        first = np.searchsorted(self.days, start, 'left') if start else 0
+        last = np.searchsorted(self.days, end, 'right') if end else len(self.days)
+        if last <= first:
+            return [], np.zeros(1, dtype=np.int64)
+
+        starts = self.bucket_starts[granularity]
+        inner = starts[np.searchsorted(starts, first, 'right'):np.searchsorted(starts, last, 'left')]
+        bounds = np.concatenate(([first], inner, [last])).astype(np.int64)
+        return self.labels[granularity][bounds[:-1]].tolist(), bounds
+
+    def series(self, granularity, start=None, end=None):
+        """(rótulos, totais[bucket, métrica])"""
+        labels, bounds = self.buckets(granularity, start, end)
+        return labels, np.add.reduceat(self.daily, bounds[:-1], axis=0)
+
+    def split_series(self, granularity, field, column, start=None, end=None):
+        """(rótulos, totais[bucket, valor, métrica]) divididos pelos valores de `column`"""
+        labels, bounds = self.buckets(granularity, start, end)
+        groups = len(column.values)
+
+        if len(self.days) * groups * len(TIME_METRICS) <= SPLIT_CUBE_MAX_CELLS:
+            with self._lock:
+                daily = self._split_daily.get(field)
+                if daily is None:
+                    daily = self._totals(self.day * groups + column.codes, len(self.days) * groups)
+                    daily = daily.reshape(len(self.days), groups, len(TIME_METRICS))
+                    self._split_daily[field] = daily
+            return labels, np.add.reduceat(daily, bounds[:-1], axis=0)
+
+        # Dimensão com muitos valores: só as linhas do período são lidas
+        rows = self.rows[self.row_offsets[bounds[0]]:self.row_offsets[bounds[-1]]]
+        bucket = np.searchsorted(bounds, self.day[rows], 'right') - 1
+        totals = self._totals(bucket * groups + column.codes[rows], len(labels) * groups, rows)
+        return labels, totals.reshape(len(labels), groups, len(TIME_METRICS))
+
+
+class SalesDataset:
+    """Registros de vendas em colunas, carregados uma vez a partir do XML.
+
+    Com `snapshot=True` as colunas vêm do snapshot binário quando ele
+    corresponde ao XML atual; caso contrário o XML é lido e o snapshot é
+    regravado (se o diretório permitir).
+    """
+
+    def __init__(self, xml_file, snapshot=True):
+        self.xml_file = xml_file
+        self.snapshot = snapshot
+        self.version = None     # identifica o conteúdo carregado (mtime + tamanho)
+        self.source = None      # 'xml', 'snapshot' ou 'delta'
+        self.delta_file = None  # lote absorvido por extend()
+        self.size = 0
+        self.numeric = {}       # campo -> np.ndarray
+        self.categorical = {}   # campo -> CategoricalColumn
+        self.indexes = {}       # campo -> InvertedIndex
+        self.cubes = {}         # campo -> {valor: {'sales', 'profit', 'count'}}
+        self._rankings = {}     # campo -> [(valor, totais)] por vendas decrescentes
+        self.date_index = None  # DateIndex (séries temporais por OrderDate)
+        self._tree = None
+        self._tree_lock = threading.Lock()
+        self.load()
+
+    @property
+    def tree(self):
+        """Árvore lxml do XML (lida no primeiro uso se as colunas vieram do snapshot)"""
+        if self._tree is None:
+            with self._tree_lock:
+                if self._tree is None:
+                    self._tree = etree.parse(self.xml_file)
+        return self._tree
+
+    def load(self):
+        """Carrega as colunas do snapshot ou, se não houver um válido, do XML"""
+        self.version = dataset_version(self.xml_file)
+        if self.snapshot and self.load_snapshot():
+            return
+
+        self.parse_xml()
+        if self.snapshot:
+            try:
+                self.save_snapshot()
+            except OSError as e:
+                log.warning(f"⚠️  Snapshot não gravado: {e}")
+
+    def parse_xml(self):
+        """Lê o XML e monta as colunas"""
+        self.source = 'xml'
+        self._tree = etree.parse(self.xml_file)
+
+        lookups = {field: {} for field in CATEGORICAL_FIELDS}
+        self.numeric, codes = _read_records(self._tree.getroot(), lookups)
+        self.categorical = {
+            field: CategoricalColumn(codes[field], list(lookups[field]))
+            for field in CATEGORICAL_FIELDS
+        }
+        self.size = len(self.numeric['RowID'])
+        self._build_indexes()
+        self._build_cubes()
+
+    def extend(self, delta_file, version=None):
+        """Novo dataset com os registros de `delta_file` acrescentados.
+
+        Só o lote é lido; colunas, índices e agregados são estendidos a
+        partir dos atuais. O dataset atual não é alterado (as requisições
+        em andamento continuam com ele) e a árvore XML do novo é lida sob
+        demanda.
+        """
+        lookups = {field: dict(column.lookup) for field, column in self.categorical.items()}
+        numeric, codes = _read_records(etree.parse(delta_file).getroot(), lookups)
+
+        data = copy.copy(self)
+        data.version = version or dataset_version(self.xml_file)
+        data.source = 'delta'
+        data.delta_file = delta_file
+        data._tree = None
+        data._tree_lock = threading.Lock()
+        data.numeric = {field: np.concatenate((array, numeric[field]))
+                        for field, array in self.numeric.items()}
+        data.categorical = {
+            field: CategoricalColumn(np.concatenate((column.codes, codes[field])),
+                                     list(lookups[field]))
+            for field, column in self.categorical.items()
+        }
+        data.size = self.size + len(numeric['RowID'])
+        data.indexes = {field: index.extended(data.categorical[field], self.size)
+                        for field, index in self.indexes.items()}
+
+        data.cubes = {}
+        for field, cube in self.cubes.items():
+            cube = dict(cube)
+            for value, totals in data._aggregate(field, self.size).items():
+                if not totals['count']:
+                    continue
+                current = cube.get(value)
+                if current is not None:
+                    totals = {key: current[key] + totals[key] for key in totals}
+                cube[value] = totals
+            data.cubes[field] = cube
+        data._build_rankings()
+        data._build_date_index()
+        return data
+
+    def _build_indexes(self):
+        """Monta os índices invertidos dos campos de filtro"""
+        self.indexes = {field: InvertedIndex(self.categorical[field])
+                        for field in INDEXED_FIELDS}
+
+    def save_snapshot(self, path=None, xml_hash=None):
+        """Grava as colunas e índices em `path` (padrão: `<xml>.snapshot`).
+
+        O diretório é montado com outro nome e trocado no fim, então um
+        leitor nunca vê um snapshot pela metade.
+        """
+        path = path or snapshot_path(self.xml_file)
+        tmp = f"{path}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        os.makedirs(tmp)
+
+        for field, array in self.numeric.items():
+            np.save(os.path.join(tmp, f"{field}.npy"), array)
+        for field, column in self.categorical.items():
+            np.save(os.path.join(tmp, f"{field}.codes.npy"), column.codes)
+        for field, index in self.indexes.items():
+            np.save(os.path.join(tmp, f"{field}.rows.npy"), index.rows)
+            np.save(os.path.join(tmp, f"{field}.offsets.npy"), index.offsets)
+
+        meta = {
+            'format': SNAPSHOT_FORMAT,
+            'version': self.version,
+            'sha256': xml_hash or file_hash(self.xml_file),
+            'size': self.size,
+            'values': {field: column.values for field, column in self.categorical.items()},
+            'indexes': list(self.indexes)
+        }
+        with open(os.path.join(tmp, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False)
+
+        old = f"{path}.old-{os.getpid()}"
+        if os.path.exists(path):
+            os.rename(path, old)
+        os.rename(tmp, path)
+        shutil.rmtree(old, ignore_errors=True)
+        log.info(f"💾 Snapshot gravado em {path}")
+
+    def load_snapshot(self, path=None):
+        """Abre o snapshot com mmap se ele corresponder ao XML atual.
+
+        A correspondência é pelo mtime + tamanho; se só o mtime mudou
+        (arquivo copiado ou tocado), o SHA-256 do XML decide e a versão
+        gravada no snapshot é atualizada, para que as próximas partidas não
+        releiam o XML inteiro. Retorna False se o snapshot não existir, for
+        de outro formato ou estiver desatualizado.
+        """
+        path = path or snapshot_path(self.xml_file)
+        if not os.path.exists(os.path.join(path, 'meta.json')):
+            return False
+        try:
+            with open(os.path.join(path, 'meta.json'), encoding='utf-8') as f:
+                meta = json.load(f)
+            if meta.get('format') != SNAPSHOT_FORMAT:
+                return False
+            if meta['version'] != self.version and meta['sha256'] != file_hash(self.xml_file):
+                return False
+
+            def array(name):
+                return np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r')
+
+            numeric = {field: array(field) for field in NUMERIC_FIELDS}
+            categorical = {
+                field: CategoricalColumn(array(f"{field}.codes"), meta['values'][field])
+                for field in CATEGORICAL_FIELDS
+            }
+            indexes = {
+                field: InvertedIndex(categorical[field], array(f"{field}.rows"),
+                                     array(f"{field}.offsets"))
+                for field in meta['indexes']
+            }
+        except (OSError, ValueError, KeyError) as e:
+            log.warning(f"⚠️  Snapshot ignorado: {e}")
+            return False
+
+        if meta['version'] != self.version:
+            meta['version'] = self.version
+            self._write_meta(path, meta)
+
+        self.source = 'snapshot'
+        self.numeric = numeric
+        self.categorical = categorical
+        self.indexes = indexes
+        self.size = meta['size']
+        self._build_cubes()
+        return True
+
+    @staticmethod
+    def _write_meta(path, meta):
+        """Regrava meta.json (troca atômica); uma falha só é registrada"""
+        tmp = os.path.join(path, f"meta.json.tmp-{os.getpid()}")
+        try:
+            with open(tmp, 'w', encoding='utf-8') as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp, os.path.join(path, 'meta.json'))
+        except OSError as e:
+            log.warning(f"⚠️  Versão do snapshot não atualizada: {e}")
+
+    def _build_cubes(self):
+        """Pré-calcula os agregados de cada dimensão agrupável.
+
+        Os dados não mudam depois da carga, então as consultas de
+        estatísticas passam a custar O(grupos).
+        """
+        self.cubes = {field: self._aggregate(field) for field in GROUPABLE_FIELDS}
+        self._build_rankings()
+        self._build_date_index()
+
+    def _build_date_index(self):
+        self.date_index = DateIndex(self.categorical['OrderDate'], self.categorical['OrderID'],
+                                    self.numeric['Sales'], self.numeric['Profit'])
+
+    def _build_rankings(self):
+        self._rankings = {
+            field: sorted(cube.items(), key=lambda item: item[1]['sales'], reverse=True)
+            for field, cube in self.cubes.items()
+        }
+
+    def where(self, field, value):
+        """Índices dos registros em que `field` == `value`"""
+        field = resolve_field(field)
+        if field in self.indexes:
+            return self.indexes[field].lookup(value)
+
+        column = self.categorical[field]
+        code = column.code(value)
+        if code < 0:
+            return np.empty(0, dtype=np.int64)
+        return np.flatnonzero(column.codes == code)
+
+    def records(self, rows, fields=None):
+        """Monta os registros das linhas `rows` como dicts (chaves snake_case).
+
+        A conversão é feita coluna a coluna; `fields` limita os campos
+        retornados (nomes snake_case ou XML).
+        """
+        tags = [resolve_field(f) for f in fields] if fields else list(FIELDS)
+        rows = np.asarray(rows, dtype=np.int64)
+
+        columns = []
+        for tag in tags:
+            if tag in self.numeric:
+                columns.append(self.numeric[tag][rows].tolist())
+            else:
+                columns.append(self.categorical[tag].take(rows))
+
+        names = [FIELDS[tag] for tag in tags]
+        return [dict(zip(names, values)) for values in zip(*columns)]
+
+    def group_totals(self, field):
+        """Soma de vendas, lucro e contagem agrupados por `field`.
+
+        Retorna {valor: {'sales': ..., 'profit': ..., 'count': ...}}. Para as
+        dimensões de GROUPABLE_FIELDS o resultado vem do cubo pré-calculado
+        e não deve ser modificado.
+        """
+        field = resolve_field(field)
+        if field in self.cubes:
+            return self.cubes[field]
+        return self._aggregate(field)
+
+    def top_groups(self, field, limit=10):
+        """Os `limit` grupos de `field` com maior venda: [(valor, totais)]"""
+        field = resolve_field(field)
+        if field not in self._rankings:
+            totals = self._aggregate(field)
+            return sorted(totals.items(), key=lambda item: item[1]['sales'], reverse=True)[:limit]
+        return self._rankings[field][:limit]
+
+    def _aggregate(self, field, start=0):
+        """Totais por valor de `field` das linhas a partir de `start`"""
+        column = self.categorical[field]
+        groups = len(column.values)
+        codes = column.codes[start:]
+
+        sales = np.bincount(codes, weights=self.numeric['Sales'][start:], minlength=groups)
+        profit = np.bincount(codes, weights=self.numeric['Profit'][start:], minlength=groups)
+        count = np.bincount(codes, minlength=groups)
+
+        return {
+            value: {'sales': s, 'profit': p, 'count': c}
+            for value, s, p, c in zip(column.values, sales.tolist(),
+                                      profit.tolist(), count.tolist())
+        }
+
+
+def refresh_dataset(data, snapshot=True, force=False):
+    """Próximo snapshot de `data` depois de uma mudança no XML.
+
+    Retorna (modo, dataset):
+    - (None, data): o arquivo não mudou;
+    - ('delta', novo): o último lote incremental parte exatamente da versão
+      de `data` e é absorvido sem reler o XML;
+    - ('full', novo): qualquer outro caso (ou `force`), com leitura completa.
+    """
+    current = dataset_version(data.xml_file)
+    if current == data.version and not force:
+        return None, data
+
+    info = load_delta_info(data.xml_file)
+    if (not force and info and info['base_version'] == data.version
+            and info['version'] == current):
+        delta_file = os.path.join(os.path.dirname(data.xml_file), info['delta_file'])
+        try:
+            extended = data.extend(delta_file, current)
+        except (OSError, etree.XMLSyntaxError) as e:
+            log.warning(f"⚠️  Lote incremental ignorado: {e}")
+        else:
+            # O lote pode ter sido trocado por uma execução mais nova do conversor
+            if extended.size - data.size == info['count']:
+                return 'delta', extended
+
+    return 'full', SalesDataset(data.xml_file, snapshot)
+
+
+class FileWatcher:
+    """Verifica periodicamente se o XML mudou e chama `on_change()`.
+
+    A troca só é disparada quando a versão (mtime + tamanho) é a mesma em
+    duas verificações seguidas, para não ler um arquivo ainda sendo escrito.
+    """
+
+    def __init__(self, xml_file, on_change, interval=5.0, version=None):
+        self.xml_file = xml_file
+        self.on_change = on_change
+        self.interval = interval
+        self.version = version
+        self._stop = threading.Event()
+
+    def start(self):
+        threading.Thread(target=self._run, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        candidate = None
+        while not self._stop.wait(self.interval):
+            try:
+                current = dataset_version(self.xml_file)
+            except OSError:
+                continue  # arquivo sendo substituído
+            if current == self.version:
+                candidate = None
+            elif current != candidate:
+                candidate = current
+            else:
+                try:
+                    self.on_change()
+                except Exception as e:
+                    log.warning(f"❌ Falha ao recarregar {self.xml_file}: {e}")
+                self.version = current
+                candidate = None
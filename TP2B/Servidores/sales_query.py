@@ -0,0 +1,500 @@
+#!/usr/bin/env python3
+"""
+Consultas estruturadas sobre o armazenamento colunar (RPC Query / query)
+
+Uma consulta é um dict:
+
+    {
+        'where': [                                   # conjunção de predicados
+            {'field': 'region', 'op': 'in', 'values': ['West', 'East']},
+            {'field': 'sales', 'op': 'range', 'lower': '100'},
+            {'field': 'order_date', 'op': 'range', 'lower': '2014-01-01', 'upper': '2014-12-31'}
+        ],
+        'group_by': ['category'],
+        'aggregates': [{'func': 'sum', 'field': 'sales'}, {'func': 'count'}],
+        'order_by': '-sum_sales',                    # '-' = decrescente
+        'limit': 10,                                 # top-N
+        'fields': [...]                              # sem agregação: campos dos registros
+    }
+
+Os predicados de igualdade sobre campos com índice invertido escolhem as
+linhas candidatas; os demais são avaliados só sobre elas. Campos de texto
+são comparados pelos códigos do dicionário (uma tabela booleana por
+valor distinto), sem comparar strings registro a registro. Faixas são
+inclusivas nos dois lados; em datas (ISO) a comparação é de texto.
+
+Além dos campos do registro, filtros e agrupamentos aceitam as dimensões
+derivadas de OrderDate `year`, `quarter` e `month` ('2016', '2016-Q3',
+'2016-08').
+"""
+import numpy as np
+
+from sales_data import (FIELDS, NUMERIC_FIELDS, TIME_BUCKETS, TIME_METRICS,
+                        CategoricalColumn, resolve_field)
+
+
+OPERATORS = ('eq', 'in', 'range')
+AGGREGATE_FUNCS = ('sum', 'mean', 'min', 'max', 'count')
+
+# Dimensões derivadas da data do pedido (ISO: AAAA-MM-DD)
+DATE_PARTS = {
+    'year': lambda date: date[:4],
+    'quarter': TIME_BUCKETS['quarter'],
+    'month': TIME_BUCKETS['month']
+}
+
+# Métricas de sales_stats, na ordem da resposta
+STATS_METRICS = ('count',
+                 'sales_total', 'sales_mean', 'sales_min', 'sales_max',
+                 'profit_total', 'profit_mean', 'profit_min', 'profit_max',
+                 'quantity_total', 'discount_mean', 'discount_weighted',
+                 'margin', 'return_rate')
+
+
+def resolve_dimension(name):
+    """Nome do elemento XML ou de uma dimensão derivada (year, quarter, month)"""
+    part = name.strip().lower()
+    return part if part in DATE_PARTS else resolve_field(name)
+
+
+def dimension_label(field):
+    """Nome da dimensão na resposta (snake_case)"""
+    return FIELDS.get(field, field)
+
+
+def dimension_column(data, field):
+    """Coluna codificada de um campo de texto ou de uma dimensão derivada.
+
+    Uma dimensão derivada é calculada sobre o dicionário de OrderDate
+    (um valor por data distinta) e os códigos são remapeados por tabela.
+    """
+    if field not in DATE_PARTS:
+        return data.categorical[field]
+
+    dates = data.categorical['OrderDate']
+    part = DATE_PARTS[field]
+    values, lookup = [], {}
+    table = np.empty(len(dates.values), dtype=np.int32)
+    for code, date in enumerate(dates.values):
+        label = part(date)
+        if label not in lookup:
+            lookup[label] = len(values)
+            values.append(label)
+        table[code] = lookup[label]
+    return CategoricalColumn(table[dates.codes], values)
+
+
+def _parse_predicate(spec):
+    field = resolve_dimension(spec.get('field', ''))
+    op = (spec.get('op') or 'eq').lower()
+    if op not in OPERATORS:
+        raise ValueError(f"Operador desconhecido: '{op}' (use {', '.join(OPERATORS)})")
+
+    predicate = {'field': field, 'op': op}
+    if op == 'range':
+        lower, upper = spec.get('lower'), spec.get('upper')
+        lower = None if lower in (None, '') else lower
+        upper = None if upper in (None, '') else upper
+        if lower is None and upper is None:
+            raise ValueError(f"Faixa sem limites para '{spec.get('field')}'")
+        if field in NUMERIC_FIELDS:
+            lower = None if lower is None else float(lower)
+            upper = None if upper is None else float(upper)
+        predicate['lower'], predicate['upper'] = lower, upper
+    else:
+        values = spec.get('values')
+        if values is None:
+            values = [spec['value']] if 'value' in spec else []
+        if isinstance(values, str):
+            values = [values]
+        if not values:
+            raise ValueError(f"Predicado '{op}' sem valores para '{spec.get('field')}'")
+        convert = float if field in NUMERIC_FIELDS else str
+        predicate['values'] = [convert(v) for v in values]
+    return predicate
+
+
+def _parse_aggregate(spec):
+    if isinstance(spec, str):
+        # Forma curta: 'sum:sales', 'count'
+        func, _, field = spec.partition(':')
+        spec = {'func': func, 'field': field}
+    func = (spec.get('func') or '').lower()
+    if func not in AGGREGATE_FUNCS:
+        raise ValueError(f"Função desconhecida: '{func}' (use {', '.join(AGGREGATE_FUNCS)})")
+    if func == 'count':
+        return {'func': func, 'field': None, 'name': 'count'}
+
+    field = resolve_field(spec.get('field') or '')
+    if field not in NUMERIC_FIELDS:
+        raise ValueError(f"'{func}' exige um campo numérico: {', '.join(FIELDS[f] for f in NUMERIC_FIELDS)}")
+    return {'func': func, 'field': field, 'name': f"{func}_{FIELDS[field]}"}
+
+
+def parse_query(spec):
+    """Valida a consulta e converte nomes de campos; levanta ValueError"""
+    query = {
+        'where': [_parse_predicate(p) for p in spec.get('where') or []],
+        'group_by': [resolve_dimension(f) for f in spec.get('group_by') or []],
+        'aggregates': [_parse_aggregate(a) for a in spec.get('aggregates') or []],
+        'fields': list(spec.get('fields') or []) or None,
+        'order_by': spec.get('order_by') or '',
+        'limit': max(0, int(spec.get('limit') or 0)),
+    }
+    for field in query['group_by']:
+        if field in NUMERIC_FIELDS:
+            raise ValueError(f"Agrupamento só por campos de texto: '{FIELDS[field]}'")
+    if query['group_by'] and not query['aggregates']:
+        query['aggregates'] = [_parse_aggregate('count')]
+    return query
+
+
+def _value_table(column, predicate):
+    """Tabela booleana por código: True para os valores aceitos"""
+    table = np.zeros(len(column.values), dtype=bool)
+    if predicate['op'] == 'range':
+        lower, upper = predicate['lower'], predicate['upper']
+        for code, value in enumerate(column.values):
+            table[code] = ((lower is None or value >= lower)
+                           and (upper is None or value <= upper))
+    else:
+        for value in predicate['values']:
+            code = column.code(value)
+            if code >= 0:
+                table[code] = True
+    return table
+
+
+def _mask(data, predicate, rows):
+    field = predicate['field']
+    if field in NUMERIC_FIELDS:
+        values = data.numeric[field][rows]
+        if predicate['op'] == 'range':
+            mask = np.ones(len(rows), dtype=bool)
+            if predicate['lower'] is not None:
+                mask &= values >= predicate['lower']
+            if predicate['upper'] is not None:
+                mask &= values <= predicate['upper']
+            return mask
+        return np.isin(values, predicate['values'])
+
+    column = dimension_column(data, field)
+    return _value_table(column, predicate)[column.codes[rows]]
+
+
+def _index_rows(data, predicate):
+    """Linhas (ordenadas) de um predicado eq/in via índice invertido"""
+    index = data.indexes[predicate['field']]
+    parts = [index.lookup(value) for value in predicate['values']]
+    rows = np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+    return np.sort(rows) if len(parts) > 1 else rows
+
+
+def filter_rows(data, predicates):
+    """Linhas que satisfazem todos os predicados, em ordem de RowID"""
+    indexed = [p for p in predicates
+               if p['op'] != 'range' and p['field'] in data.indexes]
+    if indexed:
+        # Começar pelo predicado indexado mais seletivo
+        def estimate(predicate):
+            index = data.indexes[predicate['field']]
+            return sum(len(index.lookup(v)) for v in predicate['values'])
+        first = min(indexed, key=estimate)
+        rows = _index_rows(data, first)
+        remaining = [p for p in predicates if p is not first]
+    else:
+        rows = np.arange(data.size)
+        remaining = predicates
+
+    for predicate in remaining:
+        if not len(rows):
+            break
+        rows = rows[_mask(data, predicate, rows)]
+    return rows
+
+
+def group_rows(data, fields, rows):
+    """Agrupa `rows` pelos campos `fields`.
+
+    Retorna (chaves, inverso): chaves[i] é a tupla de valores do grupo i e
+    inverso[j] o grupo da linha rows[j]. Os códigos dos campos são
+    combinados em um único inteiro, então há um único np.unique.
+    """
+    if not fields:
+        return [()], np.zeros(len(rows), dtype=np.int64)
+
+    columns = [dimension_column(data, field) for field in fields]
+    combined = np.zeros(len(rows), dtype=np.int64)
+    for column in columns:
+        combined = combined * len(column.values) + column.codes[rows]
+    groups, inverse = np.unique(combined, return_inverse=True)
+
+    # Decompor o inteiro combinado de volta nos códigos de cada campo
+    codes = []
+    rest = groups
+    for column in reversed(columns):
+        codes.append(rest % len(column.values))
+        rest = rest // len(column.values)
+    codes.reverse()
+
+    keys = list(zip(*[[column.values[c] for c in field_codes.tolist()]
+                      for column, field_codes in zip(columns, codes)]))
+    return keys, inverse
+
+
+def _segments(rows, inverse, groups):
+    """Ordena as linhas por grupo: (linhas ordenadas, contagens, inícios)"""
+    order = np.argsort(inverse, kind='stable')
+    counts = np.bincount(inverse, minlength=groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return rows[order], counts, starts
+
+
+def aggregate(data, aggregates, rows, inverse, groups):
+    """Calcula todas as agregações em uma passada.
+
+    As linhas são ordenadas uma vez por grupo; somas, mínimos e máximos
+    saem de `reduceat` sobre os segmentos de cada grupo.
+    """
+    sorted_rows, counts, starts = _segments(rows, inverse, groups)
+
+    results = {}
+    for spec in aggregates:
+        if spec['func'] == 'count':
+            # Inteiro: no XML-RPC, <int> e não <double>
+            results[spec['name']] = counts
+            continue
+        values = data.numeric[spec['field']][sorted_rows].astype(np.float64)
+        if not len(values):
+            results[spec['name']] = np.zeros(groups)
+        elif spec['func'] == 'sum':
+            results[spec['name']] = np.add.reduceat(values, starts)
+        elif spec['func'] == 'mean':
+            results[spec['name']] = np.add.reduceat(values, starts) / np.maximum(counts, 1)
+        elif spec['func'] == 'min':
+            results[spec['name']] = np.minimum.reduceat(values, starts)
+        else:
+            results[spec['name']] = np.maximum.reduceat(values, starts)
+    return results
+
+
+def _order(query, columns, keys, results):
+    """Índices dos grupos na ordem pedida (`order_by`, com '-' = decrescente)"""
+    order_by = query['order_by']
+    if not order_by:
+        if not query['limit'] or not query['aggregates']:
+            return np.arange(len(keys))
+        # Top-N sem ordem explícita: pela primeira agregação, decrescente
+        order_by = '-' + query['aggregates'][0]['name']
+
+    descending = order_by.startswith('-')
+    name = order_by.lstrip('-+')
+    if name in results:
+        values = results[name]
+        order = np.argsort(-values if descending else values, kind='stable')
+    elif name in columns:
+        position = columns.index(name)
+        order = sorted(range(len(keys)), key=lambda i: keys[i][position], reverse=descending)
+        order = np.array(order, dtype=np.int64)
+    else:
+        raise ValueError(f"order_by desconhecido: '{name}' (colunas: {', '.join(columns)})")
+    return order
+
+
+def _records(data, query, rows):
+    """Consulta sem agregação: registros filtrados, ordenados e limitados"""
+    order_by, limit = query['order_by'], query['limit']
+    if order_by:
+        descending = order_by.startswith('-')
+        field = resolve_field(order_by.lstrip('-+'))
+        if field in NUMERIC_FIELDS:
+            keys = data.numeric[field][rows]
+            keys = -keys if descending else keys
+            if limit and limit < len(rows):
+                # Top-N: seleciona os N primeiros antes de ordenar
+                top = np.argpartition(keys, limit - 1)[:limit]
+                rows = rows[top[np.argsort(keys[top], kind='stable')]]
+            else:
+                rows = rows[np.argsort(keys, kind='stable')]
+        else:
+            values = data.categorical[field].take(rows)
+            order = sorted(range(len(rows)), key=values.__getitem__, reverse=descending)
+            rows = rows[np.array(order, dtype=np.int64)]
+    if limit:
+        rows = rows[:limit]
+    return data.records(rows, query['fields'])
+
+
+def run_query(data, spec):
+    """Executa a consulta `spec` sobre o dataset.
+
+    Retorna {'matched': registros filtrados, 'columns': [...], 'rows':
+    [[...]], 'total_rows': linhas antes do limit} para consultas agregadas
+    ou {'matched', 'records': [dict]} sem agregação.
+    """
+    query = parse_query(spec)
+    rows = filter_rows(data, query['where'])
+
+    if not query['aggregates']:
+        return {'matched': len(rows), 'records': _records(data, query, rows)}
+
+    keys, inverse = group_rows(data, query['group_by'], rows)
+    if not len(rows) and query['group_by']:
+        keys = []
+    results = aggregate(data, query['aggregates'], rows, inverse, len(keys))
+
+    columns = [dimension_label(field) for field in query['group_by']]
+    names = [spec['name'] for spec in query['aggregates']]
+    order = _order(query, columns, keys, results)
+    total_rows = len(order)
+    if query['limit']:
+        order = order[:query['limit']]
+
+    values = [results[name][order].tolist() for name in names]
+    rows_out = [list(keys[i]) + [column[j] for column in values]
+                for j, i in enumerate(order.tolist())]
+    return {
+        'matched': len(rows),
+        'columns': columns + names,
+        'rows': rows_out,
+        'total_rows': total_rows
+    }
+
+
+def sales_stats(data, group_by, where=()):
+    """Estatísticas de vendas agrupadas por qualquer combinação de dimensões.
+
+    Retorna uma lista de dicts, um por grupo: as dimensões (snake_case) e
+    as métricas de STATS_METRICS. As colunas usadas são empilhadas em uma
+    matriz, ordenada uma vez por grupo; somas, mínimos e máximos de todas
+    as métricas saem de três `reduceat` sobre essa matriz.
+    """
+    fields = [resolve_dimension(f) for f in group_by]
+    for field in fields:
+        if field in NUMERIC_FIELDS:
+            raise ValueError(f"Agrupamento só por campos de texto: '{FIELDS[field]}'")
+
+    rows = filter_rows(data, [_parse_predicate(p) for p in where])
+    if not len(rows):
+        return []
+    keys, inverse = group_rows(data, fields, rows)
+    sorted_rows, counts, starts = _segments(rows, inverse, len(keys))
+
+    sales = data.numeric['Sales'][sorted_rows]
+    discount = data.numeric['Discount'][sorted_rows]
+    returned = data.categorical['Returned']
+    matrix = np.column_stack((
+        sales,
+        data.numeric['Profit'][sorted_rows],
+        data.numeric['Quantity'][sorted_rows],
+        discount,
+        sales * discount,
+        returned.codes[sorted_rows] == returned.code('Yes')
+    )).astype(np.float64)
+
+    totals = np.add.reduceat(matrix, starts, axis=0)
+    minimum = np.minimum.reduceat(matrix[:, :2], starts, axis=0)
+    maximum = np.maximum.reduceat(matrix[:, :2], starts, axis=0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sales_total = totals[:, 0]
+        metrics = {
+            'count': counts,
+            'sales_total': sales_total,
+            'sales_mean': sales_total / counts,
+            'sales_min': minimum[:, 0],
+            'sales_max': maximum[:, 0],
+            'profit_total': totals[:, 1],
+            'profit_mean': totals[:, 1] / counts,
+            'profit_min': minimum[:, 1],
+            'profit_max': maximum[:, 1],
+            'quantity_total': totals[:, 2].astype(np.int64),
+            'discount_mean': totals[:, 3] / counts,
+            # Desconto médio ponderado pelas vendas
+            'discount_weighted': np.where(sales_total != 0, totals[:, 4] / sales_total, 0.0),
+            'margin': np.where(sales_total != 0, totals[:, 1] / sales_total, 0.0),
+            'return_rate': totals[:, 5] / counts
+        }
+
+    labels = [dimension_label(field) for field in fields]
+    columns = [metrics[name].tolist() for name in STATS_METRICS]
+    return [dict(zip(labels, key), **dict(zip(STATS_METRICS, values)))
+            for key, *values in zip(keys, *columns)]
+
+
+def time_series(data, granularity='month', start=None, end=None, split_by=None):
+    """Vendas, lucro, pedidos e registros por bucket de OrderDate.
+
+    `granularity` é day, week (início na segunda-feira), month ou quarter;
+    `start`/`end` (ISO, inclusivos) limitam o período. Com `split_by`,
+    cada bucket é dividido pelos valores da dimensão (só combinações com
+    registros). Retorna uma lista de dicts com 'bucket', a dimensão (se
+    houver) e as métricas de TIME_METRICS.
+    """
+    index = data.date_index
+    granularity = (granularity or 'month').lower()
+    if not split_by:
+        labels, totals = index.series(granularity, start or None, end or None)
+        return [{'bucket': label, **dict(zip(TIME_METRICS, values))}
+                for label, values in zip(labels, _time_values(totals))]
+
+    field = resolve_dimension(split_by)
+    if field in NUMERIC_FIELDS:
+        raise ValueError(f"Divisão só por campos de texto: '{FIELDS[field]}'")
+    column = dimension_column(data, field)
+    labels, totals = index.split_series(granularity, field, column, start or None, end or None)
+
+    name = dimension_label(field)
+    points = []
+    for label, groups in zip(labels, totals):
+        for code in np.flatnonzero(groups[:, TIME_METRICS.index('records')]).tolist():
+            values = _time_values(groups[code:code + 1])[0]
+            points.append({'bucket': label, name: column.values[code],
+                           **dict(zip(TIME_METRICS, values))})
+    return points
+
+
+def _time_values(totals):
+    """Linhas de totais -> listas Python (pedidos e registros inteiros)"""
+    return [[value if metric in ('sales', 'profit') else int(value)
+             for metric, value in zip(TIME_METRICS, row)]
+            for row in totals.tolist()]
+
+
+def dashboard_summary(data, top_n=10, states_n=10, loss_states=False):
+    """Todos os painéis do dashboard a partir dos agregados pré-calculados.
+
+    KPIs, totais por região, os `top_n` produtos com maior venda e os
+    `states_n` estados com maior lucro e com maior prejuízo. Com
+    `loss_states`, também 'loss_states': todos os estados com prejuízo,
+    sem limite. Custa O(grupos): nenhum registro é percorrido.
+    """
+    regions = data.group_totals('Region')
+    states = data.group_totals('State')
+
+    total_sales = sum(totals['sales'] for totals in regions.values())
+    total_profit = sum(totals['profit'] for totals in regions.values())
+    total_records = sum(totals['count'] for totals in regions.values())
+
+    def groups(items):
+        return [{'name': name, **totals} for name, totals in items]
+
+    by_profit = sorted(states.items(), key=lambda item: item[1]['profit'])
+    losses = [item for item in by_profit if item[1]['profit'] < 0]
+    summary = {
+        'version': data.version,
+        'kpis': {
+            'total_sales': total_sales,
+            'total_profit': total_profit,
+            'total_records': total_records,
+            'total_orders': int(data.date_index.daily[:, TIME_METRICS.index('orders')].sum()),
+            'average_sale': total_sales / total_records if total_records else 0.0
+        },
+        'regions': groups(regions.items()),
+        'top_products': groups(data.top_groups('ProductName', top_n)),
+        'top_states': groups([item for item in reversed(by_profit) if item[1]['profit'] > 0][:states_n]),
+        'bottom_states': groups(losses[:states_n])
+    }
+    if loss_states:
+        summary['loss_states'] = groups(losses)
+    return summary
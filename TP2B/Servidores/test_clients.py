@@ -63,6 +63,23 @@ class GRPCClient:
             if response.total_count > 5:
                 print(f"... e mais {response.total_count - 5} registros")
     
+    def test_stream_by_region(self, region='West', batch_size=500):
+        print(f"\n{'='*60}")
+        print(f"🧪 Teste gRPC: Streaming da região '{region}' (lotes de {batch_size})")
+        print(f"{'='*60}")
+        
+        request = sales_pb2.RegionRequest(region=region, batch_size=batch_size)
+        batches = 0
+        received = 0
+        total = 0
+        for batch in self.stub.StreamRecordsByRegion(request):
+            batches += 1
+            received += len(batch.records)
+            total = batch.total_count
+        
+        print(f"Lotes recebidos: {batches}")
+        print(f"Registros recebidos: {received} de {total}")
+    
     def test_get_stats(self, field='region'):
         print(f"\n{'='*60}")
         print(f"🧪 Teste gRPC: Estatísticas por '{field}'")
@@ -162,6 +179,22 @@ class XMLRPCClient:
         
         print(tabulate(data, headers=['Estado', 'Vendas', 'Lucro', 'Pedidos']))
         print(f"\nMostrando top 10 de {len(states)} estados")
+    
+    def test_internal_methods_hidden(self):
+        print(f"\n{'='*60}")
+        print(f"🧪 Teste XML-RPC: Métodos internos não são expostos")
+        print(f"{'='*60}")
+        
+        listed = self.proxy.system.listMethods()
+        for name, params in [('watch', (100,)), ('refresh', ()), ('load_xml', ()),
+                             ('_watch', (100,)), ('_refresh', ())]:
+            assert name not in listed, f"{name} aparece em system.listMethods"
+            try:
+                getattr(self.proxy, name)(*params)
+            except xmlrpc.client.Fault as e:
+                print(f"✅ {name}: recusado ({e.faultString})")
+            else:
+                raise AssertionError(f"{name} pôde ser chamado remotamente")
 
 
 def main():
@@ -177,6 +210,7 @@ def main():
         grpc_client = GRPCClient()
         grpc_client.test_get_by_region('South')
         grpc_client.test_get_by_category('Furniture')
+        grpc_client.test_stream_by_region('West')
         grpc_client.test_get_stats('region')
         grpc_client.test_xpath("//ns:Record[ns:Sales > 1000]/ns:ProductName/text()")
     except Exception as e:
@@ -191,6 +225,7 @@ def main():
         xmlrpc_client.test_get_by_region('West')
         xmlrpc_client.test_top_products(10)
         xmlrpc_client.test_sales_by_state()
+        xmlrpc_client.test_internal_methods_hidden()
     except Exception as e:
         print(f"❌ Erro ao testar XML-RPC: {e}")
     
@@ -4,200 +4,668 @@ Servidor XML-RPC para consultas de vendas em XML
 """
 from xmlrpc.server import SimpleXMLRPCServer
 from xmlrpc.server import SimpleXMLRPCRequestHandler
+from xmlrpc.server import list_public_methods, resolve_dotted_attribute
+from xmlrpc.client import Fault
+from concurrent.futures import ThreadPoolExecutor
 from lxml import etree
+import argparse
 import logging
+import os
+import pydoc
+import selectors
+import signal
+import socket
+import threading
+import time
+import metrics
+from metrics import Metrics
+from sales_data import FileWatcher, SalesDataset, refresh_dataset
+from sales_query import dashboard_summary, run_query, sales_stats, time_series
+import xpath_guard
+from xpath_guard import XPathGuard, XPathRejected, XPathTimeout, XPathTooLarge
+from xpath_queries import DEFAULT_RESULT_CACHE_BYTES, XPathResultCache
+
+
+log = logging.getLogger('xmlrpc_server')
+
+# Códigos de Fault do execute_xpath (FAULT_INVALID_QUERY também nos métodos de consulta)
+FAULT_INVALID_QUERY = 1
+FAULT_TIMEOUT = 2
+FAULT_TOO_LARGE = 3
 
 
 class RequestHandler(SimpleXMLRPCRequestHandler):
     rpc_paths = ('/RPC2',)
+    
+    def log_message(self, format, *args):
+        # Linha de acesso de cada requisição: só no nível DEBUG
+        log.debug("%s - " + format, self.address_string(), *args)
+
+
+class KeepAliveRequestHandler(RequestHandler):
+    """Handler com HTTP/1.1: a conexão é reaproveitada entre chamadas.
+    
+    Atende uma requisição por vez; entre uma e outra o PooledXMLRPCServer
+    guarda a conexão aberta em um selector, sem ocupar thread do pool.
+    """
+    protocol_version = 'HTTP/1.1'
+    timeout = 30  # Leitura de uma requisição já iniciada
+    
+    def handle(self):
+        self.close_connection = True
+        self.handle_one_request()
+    
+    def finish(self):
+        # Conexão mantida: o servidor fecha os arquivos ao encerrá-la
+        if self.close_connection:
+            super().finish()
+
+
+class MetricsDispatchMixin:
+    """Mede a resposta serializada de cada chamada (bytes e fase 'serialize').
+    
+    A fase 'serialize' é o tempo de _marshaled_dispatch fora do método
+    chamado: leitura da requisição e serialização da resposta em XML.
+    """
+    metrics = None
+    
+    def _marshaled_dispatch(self, data, dispatch_method=None, path=None):
+        start = time.perf_counter()
+        response = super()._marshaled_dispatch(data, dispatch_method, path)
+        call = self.metrics.last_call() if self.metrics else None
+        if call is not None and call.start >= start:
+            elapsed = time.perf_counter() - start
+            self.metrics.observe_response(call.method, len(response), elapsed - call.duration)
+        return response
+
+
+class InstrumentedXMLRPCServer(MetricsDispatchMixin, SimpleXMLRPCServer):
+    """SimpleXMLRPCServer com as métricas de resposta"""
+
+
+class PooledXMLRPCServer(MetricsDispatchMixin, SimpleXMLRPCServer):
+    """SimpleXMLRPCServer que atende as requisições em um pool de threads.
+    
+    Uma chamada lenta (get_sales_by_state, execute_xpath pesado) deixa de
+    bloquear os demais clientes; o número de threads é limitado. Com o
+    KeepAliveRequestHandler o pool recebe requisições, não conexões: uma
+    conexão keep-alive ociosa espera em um selector (uma thread para
+    todas) e só volta ao pool quando chega a próxima requisição. Conexões
+    ociosas por mais de `idle_timeout` segundos são fechadas.
+    """
+    idle_timeout = 30
+    
+    def __init__(self, addr, workers=8, backlog=128, **kwargs):
+        self.request_queue_size = backlog
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self._idle_lock = threading.Lock()
+        self._parked = []       # handlers devolvidos pelo pool, a registrar
+        self._idle = None       # selector das conexões ociosas (por processo)
+        self._closing = False
+        super().__init__(addr, **kwargs)
+    
+    def serve_forever(self, poll_interval=0.5):
+        # Criados aqui, e não no __init__: no prefork cada filho tem os seus
+        self._idle = selectors.DefaultSelector()
+        self._wakeup, self._wakeup_send = socket.socketpair()
+        self._idle.register(self._wakeup, selectors.EVENT_READ)
+        threading.Thread(target=self._watch_idle, name='xmlrpc-idle', daemon=True).start()
+        super().serve_forever(poll_interval)
+    
+    def process_request(self, request, client_address):
+        self.executor.submit(self._process_request, request, client_address)
+    
+    def _process_request(self, request, client_address):
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+        except Exception:
+            self.handle_error(request, client_address)
+            self.shutdown_request(request)
+            return
+        self._after_request(handler)
+    
+    def _continue(self, handler):
+        """Próxima requisição de uma conexão keep-alive"""
+        try:
+            handler.handle_one_request()
+        except Exception:
+            handler.close_connection = True
+            self.handle_error(handler.request, handler.client_address)
+        self._after_request(handler)
+    
+    def _after_request(self, handler):
+        if getattr(handler, 'close_connection', True) or self._idle is None or self._closing:
+            self._close(handler)
+            return
+        with self._idle_lock:
+            self._parked.append(handler)
+        try:
+            self._wakeup_send.send(b'\0')
+        except OSError:
+            pass
+    
+    def _close(self, handler):
+        handler.close_connection = True
+        try:
+            handler.finish()
+        except Exception:
+            pass
+        self.shutdown_request(handler.request)
+    
+    def _watch_idle(self):
+        """Laço do selector: conexão com dados volta ao pool; ociosa demais é fechada"""
+        while not self._closing:
+            try:
+                events = self._idle.select(1.0)
+            except (OSError, ValueError):
+                break
+            for key, _ in events:
+                if key.fileobj is self._wakeup:
+                    self._wakeup.recv(4096)
+                    with self._idle_lock:
+                        parked, self._parked = self._parked, []
+                    deadline = time.monotonic() + self.idle_timeout
+                    for handler in parked:
+                        try:
+                            self._idle.register(handler.connection, selectors.EVENT_READ,
+                                                (handler, deadline))
+                        except (OSError, ValueError):
+                            self._close(handler)
+                else:
+                    # Nova requisição (ou fim da conexão, que o handler detecta)
+                    self._idle.unregister(key.fileobj)
+                    self.executor.submit(self._continue, key.data[0])
+            now = time.monotonic()
+            for key in list(self._idle.get_map().values()):
+                if key.data is not None and key.data[1] <= now:
+                    self._idle.unregister(key.fileobj)
+                    self._close(key.data[0])
+    
+    def server_close(self):
+        self._closing = True
+        super().server_close()
+        self.executor.shutdown(wait=False)
+
+
+def _result_size(result):
+    """Itens do resultado: tamanho da lista ou das listas do dict (registros, linhas, painéis)"""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, dict):
+        lists = [value for value in result.values() if isinstance(value, list)]
+        if lists or result.get('not_modified'):
+            return sum(len(value) for value in lists)
+    return None
 
 
 class SalesXMLRPCService:
-    def __init__(self, xml_file):
+    """Métodos expostos pelo XML-RPC.
+    
+    Todo método público da instância pode ser chamado remotamente; os
+    auxiliares (carga, atualização, observação do arquivo) começam com
+    '_' para ficar fora do `_dispatch` e do system.listMethods.
+    """
+    
+    def __init__(self, xml_file, cache_bytes=DEFAULT_RESULT_CACHE_BYTES, cache_ttl=None,
+                 xpath_limits=None, xpath_workers=2, snapshot=True, metrics=None):
         self.xml_file = xml_file
+        self.snapshot = snapshot
+        self.xpath_cache = XPathResultCache(cache_bytes, cache_ttl)
+        self.xpath_guard = XPathGuard(xml_file, xpath_limits, xpath_workers)
         self.namespace = {'ns': 'http://sales.example.com'}
-        self.tree = None
-        self.load_xml()
+        self.data = None
+        self._reload_lock = threading.RLock()
+        self._load_xml()
+        
+        self.metrics = metrics or Metrics()
+        self.metrics.register_cache('xpath', self.xpath_cache.stats)
+        self.metrics.register_gauge('sales_dataset_records', "Registros do dataset carregado",
+                                    lambda: self.data.size)
     
-    def load_xml(self):
-        """Carrega o arquivo XML"""
-        print(f"📂 Carregando {self.xml_file}...")
-        try:
-            self.tree = etree.parse(self.xml_file)
-            print("✅ XML carregado com sucesso!")
-        except Exception as e:
-            print(f"❌ Erro ao carregar XML: {e}")
-            raise
-    
-    def get_records_by_region(self, region):
-        """Retorna registros filtrados por região"""
-        print(f"🔍 XML-RPC: Buscando região '{region}'")
-        
-        xpath = f"//ns:Record[ns:Region='{region}']"
-        records = self.tree.xpath(xpath, namespaces=self.namespace)
-        
-        result = []
-        for rec in records:
-            result.append({
-                'order_id': self._get_text(rec, 'OrderID'),
-                'customer_name': self._get_text(rec, 'CustomerName'),
-                'city': self._get_text(rec, 'City'),
-                'sales': float(self._get_text(rec, 'Sales') or 0),
-                'profit': float(self._get_text(rec, 'Profit') or 0)
-            })
-        
-        print(f"✅ Encontrados {len(result)} registros")
+    def _dispatch(self, method, params):
+        """Chamado pelo servidor para cada método: registra a chamada nas métricas"""
+        func = resolve_dotted_attribute(self, method, False)
+        with self.metrics.call(method) as call:
+            try:
+                result = func(*params)
+            except Fault as e:
+                call.status = f"fault_{e.faultCode}"
+                raise
+            call.size = _result_size(result)
+            return result
+    
+    def _listMethods(self):
+        return list_public_methods(self)
+    
+    def _methodHelp(self, method):
+        return pydoc.getdoc(resolve_dotted_attribute(self, method, False))
+    
+    def _load_xml(self):
+        """Carrega o arquivo XML e troca o snapshot ativo.
+        
+        O novo dataset é montado à parte e só então substitui `self.data`;
+        as chamadas em andamento terminam com o snapshot anterior.
+        """
+        with self._reload_lock:
+            log.info(f"📂 Carregando {self.xml_file}...")
+            try:
+                data = SalesDataset(self.xml_file, self.snapshot)
+            except Exception as e:
+                log.error(f"❌ Erro ao carregar XML: {e}")
+                raise
+            self._activate(data)
+            return data
+    
+    def _refresh(self, force=False):
+        """Atualiza o dataset se o XML mudou.
+        
+        Um lote do conversor incremental que parte da versão carregada é
+        absorvido sem reler o XML; nos demais casos o XML é relido.
+        Retorna (modo, dataset), com modo 'delta', 'full' ou None.
+        """
+        with self._reload_lock:
+            mode, data = refresh_dataset(self.data, self.snapshot, force)
+            if mode is not None:
+                self._activate(data)
+            return mode, data
+    
+    def _activate(self, data):
+        """Troca o snapshot ativo"""
+        self.data = data
+        if data.source == 'delta':
+            self.xpath_guard.extend(data)
+        else:
+            self.xpath_guard.reload(data)
+        self.xpath_cache.clear()
+        log.info(f"✅ XML carregado com sucesso! ({data.size} registros, origem: {data.source}, versão {data.version})")
+    
+    def _watch(self, interval):
+        """Atualiza o dataset quando o arquivo XML mudar"""
+        return FileWatcher(self.xml_file, self._refresh, interval, self.data.version).start()
+    
+    def reload_dataset(self, force=False):
+        """Recarrega o XML sem reiniciar o servidor
+        
+        Sem `force`, só recarrega se o arquivo mudou. No modo prefork
+        apenas o processo que atendeu a chamada é recarregado; use --watch.
+        """
+        log.info(f"🔄 XML-RPC: Recarga solicitada")
+        
+        mode, data = self._refresh(bool(force))
+        return {'version': data.version, 'record_count': data.size,
+                'reloaded': mode is not None, 'mode': mode or ''}
+    
+    def dataset_info(self):
+        """Versão e tamanho do dataset atual (chamada frequente: sem log)"""
+        data = self.data
+        return {'version': data.version, 'record_count': data.size}
+    
+    def get_records_by_region(self, region, offset=0, limit=None, fields=None):
+        """Retorna registros filtrados por região
+        
+        `offset`/`limit` paginam o resultado e `fields` escolhe os campos
+        de cada registro (nomes snake_case de SalesRecord).
+        """
+        log.debug(f"🔍 XML-RPC: Buscando região '{region}'")
+        
+        data = self.data
+        with self.metrics.span('query'):
+            rows = self._page(data.where('Region', region), offset, limit)
+        with self.metrics.span('convert'):
+            result = data.records(rows, fields or ['order_id', 'customer_name', 'city', 'sales', 'profit'])
+        
+        log.debug(f"✅ Encontrados {len(result)} registros")
         return result
     
-    def get_records_by_category(self, category):
-        """Retorna registros filtrados por categoria"""
-        print(f"🔍 XML-RPC: Buscando categoria '{category}'")
+    def get_records_by_category(self, category, offset=0, limit=None, fields=None):
+        """Retorna registros filtrados por categoria
         
-        xpath = f"//ns:Record[ns:Category='{category}']"
-        records = self.tree.xpath(xpath, namespaces=self.namespace)
+        `offset`/`limit` paginam o resultado e `fields` escolhe os campos
+        de cada registro (nomes snake_case de SalesRecord).
+        """
+        log.debug(f"🔍 XML-RPC: Buscando categoria '{category}'")
         
-        result = []
-        for rec in records:
-            result.append({
-                'product_name': self._get_text(rec, 'ProductName'),
-                'sub_category': self._get_text(rec, 'SubCategory'),
-                'quantity': int(self._get_text(rec, 'Quantity') or 0),
-                'sales': float(self._get_text(rec, 'Sales') or 0)
-            })
+        data = self.data
+        with self.metrics.span('query'):
+            rows = self._page(data.where('Category', category), offset, limit)
+        with self.metrics.span('convert'):
+            result = data.records(rows, fields or ['product_name', 'sub_category', 'quantity', 'sales'])
         
-        print(f"✅ Encontrados {len(result)} registros")
+        log.debug(f"✅ Encontrados {len(result)} registros")
         return result
     
-    def get_customer_orders(self, customer_id):
-        """Retorna pedidos de um cliente específico"""
-        print(f"🔍 XML-RPC: Buscando cliente '{customer_id}'")
+    def get_customer_orders(self, customer_id, offset=0, limit=None, fields=None):
+        """Retorna pedidos de um cliente específico
         
-        xpath = f"//ns:Record[ns:CustomerID='{customer_id}']"
-        records = self.tree.xpath(xpath, namespaces=self.namespace)
+        `offset`/`limit` paginam o resultado e `fields` escolhe os campos
+        de cada registro (nomes snake_case de SalesRecord).
+        """
+        log.debug(f"🔍 XML-RPC: Buscando cliente '{customer_id}'")
         
-        result = []
-        for rec in records:
-            result.append({
-                'order_id': self._get_text(rec, 'OrderID'),
-                'order_date': self._get_text(rec, 'OrderDate'),
-                'product_name': self._get_text(rec, 'ProductName'),
-                'sales': float(self._get_text(rec, 'Sales') or 0),
-                'profit': float(self._get_text(rec, 'Profit') or 0)
-            })
+        data = self.data
+        with self.metrics.span('query'):
+            rows = self._page(data.where('CustomerID', customer_id), offset, limit)
+        with self.metrics.span('convert'):
+            result = data.records(rows, fields or ['order_id', 'order_date', 'product_name', 'sales', 'profit'])
         
-        print(f"✅ Encontrados {len(result)} pedidos")
+        log.debug(f"✅ Encontrados {len(result)} pedidos")
         return result
     
+    def _page(self, rows, offset, limit):
+        """Recorta a página [offset, offset + limit) das linhas encontradas"""
+        offset = max(0, int(offset or 0))
+        if limit is None:
+            return rows[offset:]
+        return rows[offset:offset + max(0, int(limit))]
+    
     def get_top_products(self, limit=10):
         """Retorna os produtos com maior venda"""
-        print(f"🔍 XML-RPC: Buscando top {limit} produtos")
-        
-        # Agregar vendas por produto
-        products = {}
-        records = self.tree.xpath("//ns:Record", namespaces=self.namespace)
+        log.debug(f"🔍 XML-RPC: Buscando top {limit} produtos")
         
-        for rec in records:
-            product_name = self._get_text(rec, 'ProductName')
-            sales = float(self._get_text(rec, 'Sales') or 0)
-            
-            if product_name in products:
-                products[product_name] += sales
-            else:
-                products[product_name] = sales
+        # Ranking pré-calculado das vendas por produto
+        with self.metrics.span('query'):
+            top = self.data.top_groups('ProductName', limit)
+        with self.metrics.span('convert'):
+            result = [{'product': product, 'total_sales': totals['sales']} for product, totals in top]
         
-        # Ordenar e retornar top N
-        sorted_products = sorted(products.items(), key=lambda x: x[1], reverse=True)
-        result = [{'product': p[0], 'total_sales': p[1]} for p in sorted_products[:limit]]
-        
-        print(f"✅ Retornados {len(result)} produtos")
+        log.debug(f"✅ Retornados {len(result)} produtos")
         return result
     
     def get_sales_by_state(self):
         """Retorna vendas agregadas por estado"""
-        print(f"🔍 XML-RPC: Calculando vendas por estado")
+        log.debug(f"🔍 XML-RPC: Calculando vendas por estado")
         
-        states = {}
-        records = self.tree.xpath("//ns:Record", namespaces=self.namespace)
+        with self.metrics.span('query'):
+            states = self.data.group_totals('State')
         
-        for rec in records:
-            state = self._get_text(rec, 'State')
-            sales = float(self._get_text(rec, 'Sales') or 0)
-            profit = float(self._get_text(rec, 'Profit') or 0)
-            
-            if state not in states:
-                states[state] = {'sales': 0, 'profit': 0, 'count': 0}
-            
-            states[state]['sales'] += sales
-            states[state]['profit'] += profit
-            states[state]['count'] += 1
+        with self.metrics.span('convert'):
+            result = [{'state': k, **v} for k, v in states.items()]
+        
+        log.debug(f"✅ Calculados dados para {len(result)} estados")
+        return result
+    
+    def query(self, spec):
+        """Consulta estruturada: filtros, agrupamento, agregações e top-N
         
-        result = [{'state': k, **v} for k, v in states.items()]
+        `spec` segue o formato de sales_query (where, group_by, aggregates,
+        order_by, limit, fields). Com agregações, `rows` traz um dict por
+        grupo; sem elas, `records` traz os registros filtrados.
+        """
+        log.debug(f"🔍 XML-RPC: Query ({len(spec.get('where') or [])} filtros, "
+                  f"agrupando por {spec.get('group_by') or '-'})")
         
-        print(f"✅ Calculados dados para {len(result)} estados")
+        try:
+            with self.metrics.span('query'):
+                result = run_query(self.data, spec)
+        except (ValueError, TypeError) as e:
+            log.info(f"❌ Query inválida: {e}")
+            raise Fault(FAULT_INVALID_QUERY, str(e))
+        
+        if 'rows' in result:
+            with self.metrics.span('convert'):
+                columns = result.pop('columns')
+                result['rows'] = [dict(zip(columns, row)) for row in result['rows']]
+            log.debug(f"✅ Query: {result['matched']} registros, {len(result['rows'])} linhas")
+        else:
+            log.debug(f"✅ Query: {result['matched']} registros, {len(result['records'])} retornados")
         return result
     
+    def get_sales_stats(self, group_by, where=None):
+        """Estatísticas agrupadas por uma ou mais dimensões
+        
+        `group_by` é um campo ou uma lista (ex.: ['region', 'category',
+        'year']); `where` aceita os predicados de query(). Cada grupo traz
+        contagem, totais, médias, mínimos e máximos de vendas e lucro,
+        quantidade, desconto (médio e ponderado), margem e taxa de devolução.
+        """
+        group_by = [group_by] if isinstance(group_by, str) else list(group_by)
+        log.debug(f"🔍 XML-RPC: Estatísticas por {' × '.join(group_by)}")
+        
+        try:
+            with self.metrics.span('query'):
+                result = sales_stats(self.data, group_by, where or [])
+        except (ValueError, TypeError) as e:
+            log.info(f"❌ Estatísticas inválidas: {e}")
+            raise Fault(FAULT_INVALID_QUERY, str(e))
+        
+        log.debug(f"✅ Estatísticas calculadas para {len(result)} grupos")
+        return result
+    
+    def get_time_series(self, granularity='month', start=None, end=None, split_by=None):
+        """Vendas, lucro, pedidos e registros por dia, semana, mês ou trimestre
+        
+        `start`/`end` são datas ISO inclusivas; com `split_by` cada ponto
+        traz também o valor da dimensão.
+        """
+        log.debug(f"🔍 XML-RPC: Série temporal por {granularity}"
+                  + (f" dividida por '{split_by}'" if split_by else ""))
+        
+        try:
+            with self.metrics.span('query'):
+                result = time_series(self.data, granularity, start, end, split_by)
+        except (ValueError, TypeError) as e:
+            log.info(f"❌ Série temporal inválida: {e}")
+            raise Fault(FAULT_INVALID_QUERY, str(e))
+        
+        log.debug(f"✅ Série temporal com {len(result)} pontos")
+        return result
+    
+    def get_dashboard_summary(self, top_n=10, states_n=10, if_none_match=None, loss_states=False):
+        """Todos os painéis do dashboard em uma chamada
+        
+        Com `if_none_match` igual ao `etag` da resposta anterior e o dataset
+        inalterado, retorna só {'etag', 'not_modified': True}. Com
+        `loss_states`, inclui também todos os estados com prejuízo.
+        """
+        data = self.data
+        etag = f"{data.version}/{top_n}/{states_n}" + ("/loss" if loss_states else "")
+        if if_none_match:
+            self.metrics.cache_access('dashboard_etag', if_none_match == etag)
+        if if_none_match == etag:
+            return {'etag': etag, 'not_modified': True}
+        
+        log.debug(f"🔍 XML-RPC: Resumo do dashboard (top {top_n} produtos, {states_n} estados)")
+        with self.metrics.span('query'):
+            summary = dashboard_summary(data, int(top_n), int(states_n), bool(loss_states))
+        summary.update(etag=etag, not_modified=False)
+        log.debug(f"✅ Resumo do dashboard montado")
+        return summary
+    
     def execute_xpath(self, xpath_query):
         """Executa uma consulta XPath personalizada"""
-        print(f"🔍 XML-RPC: Executando XPath '{xpath_query}'")
+        log.debug(f"🔍 XML-RPC: Executando XPath '{xpath_query}'")
         
         try:
-            results = self.tree.xpath(xpath_query, namespaces=self.namespace)
+            version = self.data.version
+            str_results = self.xpath_cache.get(version, xpath_query)
+            cached = str_results is not None
+            if not cached:
+                with self.metrics.span('query'):
+                    str_results = self.xpath_guard.run(xpath_query)
+                self.xpath_cache.put(version, xpath_query, str_results)
             
-            str_results = []
-            for res in results:
-                if isinstance(res, etree._Element):
-                    str_results.append(etree.tostring(res, encoding='unicode'))
-                else:
-                    str_results.append(str(res))
-            
-            print(f"✅ XPath retornou {len(str_results)} resultados")
+            log.debug(f"✅ XPath retornou {len(str_results)} resultados" + (" (cache)" if cached else ""))
             return str_results
+        except XPathRejected as e:
+            log.info(f"❌ XPath recusado: {e}")
+            raise Fault(FAULT_INVALID_QUERY, str(e))
+        except XPathTimeout as e:
+            log.warning(f"❌ XPath excedeu o tempo limite: {e}")
+            raise Fault(FAULT_TIMEOUT, str(e))
+        except XPathTooLarge as e:
+            log.warning(f"❌ Resultado XPath grande demais: {e}")
+            raise Fault(FAULT_TOO_LARGE, str(e))
         except Exception as e:
-            print(f"❌ Erro ao executar XPath: {e}")
+            log.warning(f"❌ Erro ao executar XPath: {e}")
             return {'error': str(e)}
+
+
+def _serve_prefork(server, processes, after_fork=None):
+    """Cria `processes` processos filhos que atendem o mesmo socket.
+    
+    O dataset é carregado antes do fork, então as colunas NumPy são
+    compartilhadas entre os processos (copy-on-write) e a vazão escala
+    com o número de núcleos.
+    """
+    children = []
+    for index in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            try:
+                if after_fork:
+                    after_fork(index)
+                server.serve_forever()
+            finally:
+                os._exit(0)
+        children.append(pid)
+    
+    def _stop(signum, frame):
+        raise KeyboardInterrupt
     
-    def _get_text(self, element, tag):
-        """Extrai texto de um elemento XML"""
-        elem = element.find(f'.//ns:{tag}', self.namespace)
-        return elem.text if elem is not None else ""
+    # `docker stop` envia SIGTERM: encerrar também os filhos
+    signal.signal(signal.SIGTERM, _stop)
+    
+    log.info(f"   Processos: {children}")
+    try:
+        for pid in children:
+            os.waitpid(pid, 0)
+    except KeyboardInterrupt:
+        log.info("🛑 Encerrando servidor XML-RPC...")
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    finally:
+        server.server_close()
 
 
-def serve(xml_file='sales_data.xml', host='localhost', port=8000):
-    """Inicia o servidor XML-RPC"""
-    print(f"🚀 Iniciando servidor XML-RPC em {host}:{port}")
+def serve(xml_file='sales_data.xml', host='localhost', port=8000,
+          mode='threaded', workers=8, threads=4, backlog=128,
+          cache_bytes=DEFAULT_RESULT_CACHE_BYTES, cache_ttl=None,
+          xpath_limits=None, xpath_workers=2, watch_interval=None,
+          snapshot=True, trace=False, metrics_port=None, metrics_host='localhost'):
+    """Inicia o servidor XML-RPC.
     
-    server = SimpleXMLRPCServer(
-        (host, port),
-        requestHandler=RequestHandler,
-        allow_none=True
-    )
+    Modos:
+      - simple: uma requisição por vez (SimpleXMLRPCServer)
+      - threaded: pool de `workers` threads, com HTTP keep-alive
+      - prefork: `workers` processos com `threads` threads cada, com keep-alive
     
+    No prefork cada processo tem as suas métricas, em `metrics_port + i`.
+    """
+    log.info(f"🚀 Iniciando servidor XML-RPC em {host}:{port} (modo {mode})")
+    
+    # Carregar os dados antes de abrir o socket (e antes do fork)
+    registry = Metrics(trace)
+    service = SalesXMLRPCService(xml_file, cache_bytes, cache_ttl,
+                                 xpath_limits, xpath_workers, snapshot, registry)
+    if mode != 'prefork':
+        # No prefork cada filho cria o seu logo após o fork
+        service.xpath_guard.start()
+    
+    if mode == 'simple':
+        server = InstrumentedXMLRPCServer(
+            (host, port),
+            requestHandler=RequestHandler,
+            allow_none=True
+        )
+    else:
+        server = PooledXMLRPCServer(
+            (host, port),
+            workers=workers if mode == 'threaded' else threads,
+            backlog=backlog,
+            requestHandler=KeepAliveRequestHandler,
+            allow_none=True
+        )
+    
+    server.metrics = registry
     server.register_introspection_functions()
     
     # Registrar serviço
-    service = SalesXMLRPCService(xml_file)
     server.register_instance(service)
     
-    print(f"✅ Servidor XML-RPC pronto!")
-    print(f"   Endpoint: http://{host}:{port}/RPC2")
-    print(f"   Métodos disponíveis:")
-    print(f"   - get_records_by_region(region)")
-    print(f"   - get_records_by_category(category)")
-    print(f"   - get_customer_orders(customer_id)")
-    print(f"   - get_top_products(limit)")
-    print(f"   - get_sales_by_state()")
-    print(f"   - execute_xpath(xpath_query)")
+    log.info(f"✅ Servidor XML-RPC pronto!")
+    log.info(f"   Endpoint: http://{host}:{port}/RPC2")
+    log.info(f"   Métodos disponíveis:")
+    log.info(f"   - get_records_by_region(region, offset, limit, fields)")
+    log.info(f"   - get_records_by_category(category, offset, limit, fields)")
+    log.info(f"   - get_customer_orders(customer_id, offset, limit, fields)")
+    log.info(f"   - get_top_products(limit)")
+    log.info(f"   - get_sales_by_state()")
+    log.info(f"   - execute_xpath(xpath_query)")
+    log.info(f"   - query(spec)")
+    log.info(f"   - get_sales_stats(group_by, where)")
+    log.info(f"   - get_time_series(granularity, start, end, split_by)")
+    log.info(f"   - get_dashboard_summary(top_n, states_n, if_none_match, loss_states)")
+    log.info(f"   - reload_dataset(force)")
+    log.info(f"   - dataset_info()")
+    
+    if watch_interval:
+        log.info(f"   Recarga automática: verificando {xml_file} a cada {watch_interval:g}s")
+    
+    # Threads não sobrevivem ao fork: no prefork cada filho cria o processo
+    # auxiliar de XPath (antes de qualquer thread), observa o arquivo e serve
+    # as próprias métricas
+    def start_threads(index=0):
+        if mode == 'prefork':
+            service.xpath_guard.start()
+        if metrics_port:
+            metrics.start_http_server(registry, metrics_host, metrics_port + index)
+        if watch_interval:
+            service._watch(watch_interval)
+    
+    if mode == 'prefork':
+        _serve_prefork(server, workers, start_threads)
+        return
+    
+    start_threads()
     
     try:
         server.serve_forever()
     except KeyboardInterrupt:
-        print("\n🛑 Encerrando servidor XML-RPC...")
+        log.info("🛑 Encerrando servidor XML-RPC...")
+    finally:
+        server.server_close()
 
 
-if __name__ == '__main__':
-    import sys
-    xml_file = sys.argv[1] if len(sys.argv) > 1 else 'sales_data.xml'
-    host = sys.argv[2] if len(sys.argv) > 2 else 'localhost'
-    port = int(sys.argv[3]) if len(sys.argv) > 3 else 8000
+def main():
+    parser = argparse.ArgumentParser(description="Servidor XML-RPC para consultas de vendas em XML")
+    parser.add_argument('xml_file', nargs='?', default='sales_data.xml')
+    parser.add_argument('host', nargs='?', default='localhost')
+    parser.add_argument('port', nargs='?', type=int, default=8000)
+    parser.add_argument('--mode', choices=['simple', 'threaded', 'prefork'], default='threaded',
+                        help="modelo de atendimento (padrão: threaded)")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="threads (threaded) ou processos (prefork); padrão: 8 / núcleos")
+    parser.add_argument('--threads', type=int, default=4,
+                        help="threads por processo no modo prefork")
+    parser.add_argument('--backlog', type=int, default=128,
+                        help="tamanho da fila de conexões pendentes")
+    parser.add_argument('--xpath-cache-mb', type=float, default=DEFAULT_RESULT_CACHE_BYTES / 2**20,
+                        help="memória máxima do cache de resultados XPath, em MB (0 desativa)")
+    parser.add_argument('--xpath-cache-ttl', type=float, default=None,
+                        help="validade das entradas do cache XPath, em segundos")
+    parser.add_argument('--no-snapshot', dest='snapshot', action='store_false',
+                        help="ignora o snapshot binário e sempre lê o XML")
+    parser.add_argument('--watch', type=float, default=None, metavar='S',
+                        help="recarrega o XML quando o arquivo mudar (verificação a cada S segundos)")
+    xpath_guard.add_arguments(parser)
+    metrics.add_arguments(parser)
+    args = parser.parse_args()
+    metrics.configure_logging(args.log_level)
+    
+    workers = args.workers
+    if workers is None:
+        workers = (os.cpu_count() or 1) if args.mode == 'prefork' else 8
     
-    serve(xml_file, host, port)
\ No newline at end of file
+    serve(args.xml_file, args.host, args.port, args.mode, workers,
+          args.threads, args.backlog,
+          int(args.xpath_cache_mb * 2**20), args.xpath_cache_ttl,
+          xpath_guard.limits_from_args(args), args.xpath_workers, args.watch,
+          args.snapshot, args.trace, args.metrics_port, args.metrics_host)
+
+
+if __name__ == '__main__':
+    main()
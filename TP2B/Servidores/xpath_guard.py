@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Proteção das consultas XPath ad hoc (ExecuteXPath / execute_xpath)
+
+- Formatos sabidamente patológicos são recusados antes da execução:
+  caminhos absolutos dentro de predicados (`//*[count(//*) > 0]` percorre
+  o documento inteiro para cada nó), eixos following/preceding e
+  predicados aninhados demais.
+- A avaliação roda fora do servidor: um processo auxiliar (criado antes
+  do servidor abrir threads, com a árvore já carregada) cria um filho com
+  fork para cada consulta. Se a consulta passar do tempo limite, o filho
+  é encerrado; a thread do servidor fica livre.
+- O número de resultados e o total de bytes serializados são limitados
+  dentro do próprio processo filho.
+"""
+from dataclasses import dataclass
+import itertools
+import multiprocessing
+import os
+import pickle
+import re
+import selectors
+import signal
+import threading
+import time
+
+from lxml import etree
+
+from xpath_queries import compile_xpath, serialize_result
+
+
+class XPathRejected(ValueError):
+    """Consulta inválida ou com formato recusado"""
+
+
+class XPathTimeout(TimeoutError):
+    """Consulta excedeu o tempo limite"""
+
+
+class XPathTooLarge(Exception):
+    """Resultado excedeu os limites de itens ou de bytes"""
+
+
+@dataclass
+class XPathLimits:
+    timeout: float = 5.0                # segundos por consulta
+    max_results: int = 10000            # itens no resultado
+    # Bytes serializados (UTF-8). Abaixo do limite padrão de 4 MB das
+    # mensagens gRPC, com folga para o envelope protobuf: o cliente recebe
+    # RESOURCE_EXHAUSTED da proteção, e não do transporte
+    max_bytes: int = 3 * 1024 * 1024
+    max_length: int = 2000              # caracteres da expressão
+    max_predicate_depth: int = 3        # predicados aninhados
+
+
+def add_arguments(parser):
+    """Opções de linha de comando da proteção XPath (comuns aos servidores)"""
+    defaults = XPathLimits()
+    parser.add_argument('--xpath-timeout', type=float, default=defaults.timeout,
+                        help="tempo limite de cada consulta XPath, em segundos")
+    parser.add_argument('--xpath-max-results', type=int, default=defaults.max_results,
+                        help="máximo de itens no resultado de uma consulta XPath")
+    parser.add_argument('--xpath-max-mb', type=float, default=defaults.max_bytes / 2**20,
+                        help="tamanho máximo do resultado serializado, em MB")
+    parser.add_argument('--xpath-workers', type=int, default=2,
+                        help="processos que executam as consultas XPath (0: na própria thread, sem tempo limite)")
+
+
+def limits_from_args(args):
+    return XPathLimits(timeout=args.xpath_timeout,
+                       max_results=args.xpath_max_results,
+                       max_bytes=int(args.xpath_max_mb * 2**20))
+
+
+_LITERAL = re.compile(r"""'[^']*'|"[^"]*\"""")
+# Caminho absoluto: '/' no início de uma expressão (não depois de um passo)
+_ABSOLUTE_PATH = re.compile(r'(?:^|[\[(,=<>!|+\s])/')
+_COSTLY_AXES = re.compile(r'\b(?:following|preceding)(?:-sibling)?\s*::')
+
+
+def check_query(query, limits):
+    """Recusa consultas vazias, longas demais ou com formato patológico"""
+    if not query.strip():
+        raise XPathRejected("Consulta vazia")
+    if len(query) > limits.max_length:
+        raise XPathRejected(f"Consulta excede {limits.max_length} caracteres")
+
+    # Literais não contam na análise
+    text = _LITERAL.sub("''", query)
+    if _COSTLY_AXES.search(text):
+        raise XPathRejected("Eixos following/preceding não são permitidos")
+
+    depth = 0
+    predicate = []  # texto de cada predicado aberto
+    for char in text:
+        if char == '[':
+            depth += 1
+            if depth > limits.max_predicate_depth:
+                raise XPathRejected(
+                    f"Mais de {limits.max_predicate_depth} predicados aninhados")
+            predicate.append('')
+        elif char == ']':
+            if not predicate:
+                raise XPathRejected("Colchetes desbalanceados")
+            body = predicate.pop()
+            if _ABSOLUTE_PATH.search(body):
+                raise XPathRejected("Caminhos absolutos (/ ou //) dentro de predicados "
+                                    "não são permitidos; use caminhos relativos")
+            depth -= 1
+            if predicate:
+                predicate[-1] += '[]'
+        elif predicate:
+            predicate[-1] += char
+    if predicate:
+        raise XPathRejected("Colchetes desbalanceados")
+
+
+def _compile_query(query):
+    """Expressão compilada (do cache LRU) ou XPathRejected"""
+    try:
+        return compile_xpath(query)
+    except etree.XPathError as e:
+        raise XPathRejected(f"XPath inválido: {e}")
+
+
+def _evaluate(tree, xpath, pretty_print, limits):
+    """Executa a expressão compilada aplicando os limites de itens e bytes"""
+    try:
+        results = xpath(tree)
+    except etree.XPathError as e:
+        raise XPathRejected(f"XPath inválido: {e}")
+    if not isinstance(results, list):
+        results = [results]
+    if len(results) > limits.max_results:
+        raise XPathTooLarge(f"Consulta retornou {len(results)} itens "
+                            f"(limite: {limits.max_results})")
+
+    str_results = []
+    total = 0
+    for res in results:
+        text = serialize_result(res, pretty_print)
+        total += len(text.encode('utf-8'))
+        if total > limits.max_bytes:
+            raise XPathTooLarge(f"Resultado excede {limits.max_bytes} bytes")
+        str_results.append(text)
+    return str_results
+
+
+def _run_child(tree, xpath, pretty_print, limits, fd):
+    """Processo filho: avalia uma consulta e escreve a resposta no pipe"""
+    try:
+        reply = ('ok', _evaluate(tree, xpath, pretty_print, limits))
+    except XPathRejected as e:
+        reply = ('rejected', str(e))
+    except XPathTooLarge as e:
+        reply = ('too_large', str(e))
+    except Exception as e:
+        reply = ('error', str(e))
+    data = memoryview(pickle.dumps(reply, pickle.HIGHEST_PROTOCOL))
+    while data:
+        data = data[os.write(fd, data):]
+
+
+class _Zygote:
+    """Laço do processo auxiliar.
+
+    Recebe (id, consulta, pretty_print, limites) do servidor, cria um filho
+    por consulta (no máximo `workers` ao mesmo tempo; as demais esperam) e
+    devolve (id, status, resultado). Filhos que passam do prazo são mortos.
+    Processo de uma thread só, então o fork é seguro. A expressão é
+    compilada aqui, antes do fork, para que o cache de compilação
+    sobreviva entre as consultas.
+    """
+
+    def __init__(self, xml_file, data, conn, workers):
+        self.xml_file = xml_file
+        # Lida aqui, fora do servidor, se o dataset veio do snapshot
+        self.tree = data.tree if data is not None else etree.parse(xml_file)
+        self.conn = conn
+        self.workers = workers
+        self.pending = []   # [(id, consulta, pretty_print, limites, prazo)]
+        self.running = {}   # fd -> [id, pid, prazo, bytes lidos]
+        self.selector = selectors.DefaultSelector()
+
+    def serve(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        self.selector.register(self.conn, selectors.EVENT_READ)
+        while True:
+            for key, _ in self.selector.select(self._next_timeout()):
+                if key.fileobj is self.conn:
+                    if not self._receive():
+                        return
+                else:
+                    self._read_child(key.fd)
+            self._expire()
+            self._start_pending()
+
+    def _receive(self):
+        try:
+            message = self.conn.recv()
+        except (EOFError, OSError):
+            return False
+        if message[0] == 'reload':
+            self.tree = etree.parse(self.xml_file)
+        elif message[0] == 'extend':
+            # Lote incremental: acrescenta os registros à árvore atual
+            self.tree.getroot().extend(etree.parse(message[1]).getroot())
+        else:
+            request_id, query, pretty_print, limits = message[1:]
+            self.pending.append((request_id, query, pretty_print, limits,
+                                 time.monotonic() + limits.timeout))
+        return True
+
+    def _start_pending(self):
+        while self.pending and len(self.running) < self.workers:
+            request_id, query, pretty_print, limits, deadline = self.pending.pop(0)
+            try:
+                xpath = _compile_query(query)
+            except XPathRejected as e:
+                self.conn.send((request_id, 'rejected', str(e)))
+                continue
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                os.close(read_fd)
+                try:
+                    _run_child(self.tree, xpath, pretty_print, limits, write_fd)
+                finally:
+                    os._exit(0)
+            os.close(write_fd)
+            os.set_blocking(read_fd, False)
+            self.running[read_fd] = [request_id, pid, deadline, []]
+            self.selector.register(read_fd, selectors.EVENT_READ)
+
+    def _read_child(self, fd):
+        request_id, pid, deadline, chunks = self.running[fd]
+        try:
+            chunk = os.read(fd, 1 << 20)
+        except BlockingIOError:
+            return
+        if chunk:
+            chunks.append(chunk)
+            return
+        self._finish(fd)
+        try:
+            status, payload = pickle.loads(b''.join(chunks))
+        except Exception:
+            status, payload = 'error', "Processo da consulta XPath terminou sem resposta"
+        self.conn.send((request_id, status, payload))
+
+    def _finish(self, fd, kill=False):
+        request_id, pid, deadline, chunks = self.running.pop(fd)
+        self.selector.unregister(fd)
+        os.close(fd)
+        if kill:
+            os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+    def _expire(self):
+        now = time.monotonic()
+        for fd, (request_id, pid, deadline, chunks) in list(self.running.items()):
+            if deadline <= now:
+                self._finish(fd, kill=True)
+                self.conn.send((request_id, 'timeout', "Consulta excedeu o tempo limite"))
+        waiting = []
+        for item in self.pending:
+            if item[4] <= now:
+                self.conn.send((item[0], 'timeout', "Nenhum processo livre para a consulta XPath"))
+            else:
+                waiting.append(item)
+        self.pending = waiting
+
+    def _next_timeout(self):
+        deadlines = [entry[2] for entry in self.running.values()]
+        deadlines += [item[4] for item in self.pending]
+        if not deadlines:
+            return None
+        return max(0, min(deadlines) - time.monotonic())
+
+
+def _zygote_main(xml_file, data, conn, parent_conn, workers):
+    # Sem a ponta do servidor aberta aqui, o fim do servidor vira EOF
+    parent_conn.close()
+    _Zygote(xml_file, data, conn, workers).serve()
+
+
+class XPathGuard:
+    """Executa consultas ad hoc em processos que podem ser encerrados ao
+    estourar o tempo limite.
+
+    `start()` cria o processo auxiliar e deve ser chamado antes de o
+    servidor abrir threads (o fork de um processo com gRPC ativo não é
+    seguro); no modo prefork, em cada filho, logo após o fork. Se o
+    processo auxiliar não existir (não iniciado neste processo, ou
+    encerrado), as consultas falham: recriá-lo exigiria um fork a partir
+    do servidor, que já tem threads. Com `workers=0`, ou sem os.fork, a
+    consulta roda na própria thread: os limites de resultado continuam
+    valendo, mas o tempo limite não.
+    """
+
+    def __init__(self, xml_file, limits=None, workers=2):
+        self.xml_file = xml_file
+        self.data = None
+        self.limits = limits or XPathLimits()
+        self.workers = workers if hasattr(os, 'fork') else 0
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        self._pid = None
+        self._process = None
+
+    def start(self):
+        with self._lock:
+            self._start()
+
+    def _start(self):
+        context = multiprocessing.get_context('fork')
+        self._conn, child_conn = context.Pipe()
+        self._process = context.Process(
+            target=_zygote_main,
+            args=(self.xml_file, self.data, child_conn, self._conn, self.workers),
+            daemon=True)
+        self._process.start()
+        child_conn.close()
+        self._pid = os.getpid()
+        self._waiting = {}  # id -> [evento, resposta]
+        threading.Thread(target=self._read_replies, args=(self._conn, self._waiting),
+                         daemon=True).start()
+
+    def _read_replies(self, conn, waiting):
+        while True:
+            try:
+                request_id, status, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                slot = waiting.pop(request_id, None)
+            if slot:
+                slot[1] = (status, payload)
+                slot[0].set()
+        # Processo auxiliar encerrado: libera quem estava esperando
+        with self._lock:
+            slots = list(waiting.values())
+            waiting.clear()
+            if self._conn is conn:
+                self._process = None
+        for slot in slots:
+            slot[1] = ('error', "Processo auxiliar de XPath encerrado")
+            slot[0].set()
+
+    def run(self, query, pretty_print=False):
+        """Valida e executa a consulta; retorna a lista de resultados
+        serializados ou levanta XPathRejected / XPathTimeout / XPathTooLarge"""
+        check_query(query, self.limits)
+        if not self.workers:
+            return _evaluate(self.data.tree, _compile_query(query), pretty_print, self.limits)
+
+        request_id = next(self._ids)
+        slot = [threading.Event(), None]
+        with self._lock:
+            if self._process is None or self._pid != os.getpid():
+                raise RuntimeError("Processo auxiliar de XPath não está em execução")
+            self._waiting[request_id] = slot
+            self._conn.send(('query', request_id, query, pretty_print, self.limits))
+
+        # O processo auxiliar responde 'timeout' no prazo; a folga cobre
+        # apenas a troca de mensagens
+        if not slot[0].wait(self.limits.timeout + 5):
+            with self._lock:
+                self._waiting.pop(request_id, None)
+            raise XPathTimeout(f"Consulta excedeu {self.limits.timeout:g}s")
+
+        status, payload = slot[1]
+        if status == 'ok':
+            return payload
+        if status == 'rejected':
+            raise XPathRejected(payload)
+        if status == 'too_large':
+            raise XPathTooLarge(payload)
+        if status == 'timeout':
+            raise XPathTimeout(f"{payload} ({self.limits.timeout:g}s)")
+        raise RuntimeError(payload)
+
+    def reload(self, data):
+        """Troca o dataset consultado. O processo auxiliar, se já existir,
+        relê o XML (criar outro com fork a partir do servidor não seria
+        seguro)"""
+        with self._lock:
+            self.data = data
+            if self._process is not None and self._pid == os.getpid():
+                self._conn.send(('reload',))
+
+    def extend(self, data):
+        """Troca o dataset por `data`, que absorveu um lote incremental
+        (`data.delta_file`); o processo auxiliar só lê o lote"""
+        with self._lock:
+            self.data = data
+            if self._process is not None and self._pid == os.getpid():
+                self._conn.send(('extend', data.delta_file))
+
+    def close(self):
+        with self._lock:
+            if self._process is not None and self._pid == os.getpid():
+                self._conn.close()
+                self._process.join(1)
+            self._process = None
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Camada de consultas XPath compartilhada
+
+- Expressões pré-compiladas (etree.XPath) com parâmetros $variável: o
+  valor é passado na chamada, sem montar strings, então nomes com aspas
+  não precisam de escape e a expressão não é recompilada a cada uso.
+- Cache LRU de expressões compiladas para as consultas ad hoc dos
+  endpoints ExecuteXPath / execute_xpath.
+- Cache de resultados dessas consultas, por versão do dataset.
+"""
+from collections import OrderedDict
+from functools import lru_cache
+from lxml import etree
+import re
+import threading
+import time
+
+
+NAMESPACES = {'ns': 'http://sales.example.com'}
+
+# Tamanho do cache de expressões ad hoc
+XPATH_CACHE_SIZE = 256
+
+# Orçamento padrão do cache de resultados
+DEFAULT_RESULT_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def _compile(expression):
+    return etree.XPath(expression, namespaces=NAMESPACES)
+
+
+# Consultas parametrizadas ($value / $prefix)
+RECORDS_BY_DATE_PREFIX = _compile("//ns:Record[starts-with(ns:OrderDate, $prefix)]")
+
+SUM_SALES_BY_REGION = _compile("sum(//ns:Record[ns:Region = $value]/ns:Sales)")
+SUM_SALES_BY_CUSTOMER = _compile("sum(//ns:Record[ns:CustomerID = $value]/ns:Sales)")
+SUM_SALES_BY_DATE_PREFIX = _compile("sum(//ns:Record[starts-with(ns:OrderDate, $prefix)]/ns:Sales)")
+SUM_QUANTITY_BY_PRODUCT = _compile("sum(//ns:Record[ns:ProductName = $value]/ns:Quantity)")
+COUNT_BY_CATEGORY = _compile("count(//ns:Record[ns:Category = $value])")
+CUSTOMER_NAME = _compile("//ns:Record[ns:CustomerID = $value][1]/ns:CustomerName/text()")
+
+
+@lru_cache(maxsize=XPATH_CACHE_SIZE)
+def compile_xpath(query):
+    """Compila uma expressão ad hoc, reaproveitando compilações anteriores"""
+    return _compile(query)
+
+
+def serialize_result(res, pretty_print=False):
+    """Converte um item do resultado XPath em string"""
+    if isinstance(res, etree._Element):
+        return etree.tostring(res, encoding='unicode', pretty_print=pretty_print)
+    return str(res)
+
+
+# Palavras separadas por espaços; um literal de string (mesmo com espaços
+# dentro) faz parte da palavra, e aspas sem par ficam como caractere comum
+_WORD = re.compile(r"""(?:'[^']*'|"[^"]*"|[^\s'"]|['"])+""")
+# Delimitadores que dispensam os espaços em volta ('-', '.' e ':' ficam de
+# fora: podem fazer parte de um nome ou número)
+_DELIMITERS = frozenset('[]()/@,=<>!|+*')
+# Pares que, sem o espaço entre eles, viram outro token
+_MERGING = frozenset(('//', '!=', '<=', '>='))
+
+
+def normalize_query(query):
+    """Remove espaços redundantes fora dos literais de string, para que
+    variações de formatação da mesma consulta usem a mesma entrada.
+
+    Um espaço só é removido ao lado de um delimitador e se os caracteres
+    vizinhos não formarem outro token (`a/ /b` não vira `a//b`): consultas
+    com a mesma forma normalizada têm sempre os mesmos tokens.
+    """
+    words = _WORD.findall(query)
+    if not words:
+        return ''
+    parts = [words[0]]
+    for word in words[1:]:
+        left, right = parts[-1][-1], word[0]
+        if (left in _DELIMITERS or right in _DELIMITERS) and left + right not in _MERGING:
+            parts.append(word)
+        else:
+            parts.append(' ' + word)
+    return ''.join(parts)
+
+
+class XPathResultCache:
+    """Cache LRU dos resultados serializados das consultas ad hoc.
+
+    A chave é (versão do dataset, consulta normalizada), então um novo
+    dataset nunca reaproveita resultados antigos; `clear()` libera a
+    memória na recarga. O total de bytes guardados fica limitado a
+    `max_bytes` (as entradas menos usadas saem primeiro) e, se `ttl`
+    for informado, as entradas expiram após `ttl` segundos.
+    """
+
+    # Custo aproximado de cada string guardada, além do texto
+    ITEM_OVERHEAD = 64
+
+    def __init__(self, max_bytes=DEFAULT_RESULT_CACHE_BYTES, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()  # chave -> (resultados, bytes, expira em)
+        self._lock = threading.Lock()
+
+    def get(self, version, query):
+        key = (version, normalize_query(query))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, version, query, results):
+        size = sum(len(r) for r in results) + self.ITEM_OVERHEAD * (len(results) + 1)
+        if size > self.max_bytes:
+            return
+        key = (version, normalize_query(query))
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (results, size, expires)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / total if total else 0.0
+            }
+
+    def _remove(self, key):
+        results, size, expires = self._entries.pop(key)
+        self.bytes -= size
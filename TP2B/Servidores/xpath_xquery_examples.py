@@ -3,6 +3,7 @@
 Exemplos práticos de XPath e XQuery para análise de dados de vendas
 """
 from lxml import etree
+import xpath_queries as queries
 
 
 class XMLQueryExamples:
@@ -54,8 +55,7 @@ class XMLQueryExamples:
         regions = ['South', 'West', 'East', 'Central']
         
         for region in regions:
-            xpath = f"sum(//ns:Record[ns:Region='{region}']/ns:Sales)"
-            total = self.tree.xpath(xpath, namespaces=self.ns)
+            total = queries.SUM_SALES_BY_REGION(self.tree, value=region)
             print(f"  {region:10s}: ${total:,.2f}")
     
     def example_4_count(self):
@@ -67,8 +67,7 @@ class XMLQueryExamples:
         categories = ['Furniture', 'Office Supplies', 'Technology']
         
         for category in categories:
-            xpath = f"count(//ns:Record[ns:Category='{category}'])"
-            count = int(self.tree.xpath(xpath, namespaces=self.ns))
+            count = int(queries.COUNT_BY_CATEGORY(self.tree, value=category))
             print(f"  {category:20s}: {count:5d} pedidos")
     
     def example_5_complex_filter(self):
@@ -110,8 +109,7 @@ class XMLQueryExamples:
         # Analisar top 5 clientes
         customer_totals = {}
         for customer in unique_customers:
-            xpath = f"sum(//ns:Record[ns:CustomerID='{customer}']/ns:Sales)"
-            total = self.tree.xpath(xpath, namespaces=self.ns)
+            total = queries.SUM_SALES_BY_CUSTOMER(self.tree, value=customer)
             customer_totals[customer] = total
         
         # Ordenar e mostrar top 5
@@ -122,8 +120,7 @@ class XMLQueryExamples:
         print("\nTop 5 clientes:")
         for i, (customer, total) in enumerate(top_customers, 1):
             # Obter nome do cliente
-            xpath = f"//ns:Record[ns:CustomerID='{customer}']/ns:CustomerName/text()"
-            name = self.tree.xpath(xpath, namespaces=self.ns)[0]
+            name = queries.CUSTOMER_NAME(self.tree, value=customer)[0]
             print(f"  {i}. {name} ({customer}): ${total:,.2f}")
     
     def example_7_date_range(self):
@@ -132,18 +129,12 @@ class XMLQueryExamples:
         print("📌 Exemplo 7: Pedidos em novembro de 2016")
         print("="*70)
         
-        xpath = """//ns:Record[
-            starts-with(ns:OrderDate, '2016-11')
-        ]"""
-        results = self.tree.xpath(xpath, namespaces=self.ns)
+        results = queries.RECORDS_BY_DATE_PREFIX(self.tree, prefix='2016-11')
         
         print(f"Pedidos em 2016-11: {len(results)}")
         
         # Calcular total
-        xpath_sum = """sum(//ns:Record[
-            starts-with(ns:OrderDate, '2016-11')
-        ]/ns:Sales)"""
-        total = self.tree.xpath(xpath_sum, namespaces=self.ns)
+        total = queries.SUM_SALES_BY_DATE_PREFIX(self.tree, prefix='2016-11')
         
         print(f"Total de vendas: ${total:,.2f}")
     
@@ -160,14 +151,8 @@ class XMLQueryExamples:
         
         product_quantities = {}
         for product in unique_products:
-            # Escapar aspas no nome do produto
-            safe_product = product.replace("'", "&apos;")
-            xpath = f"sum(//ns:Record[ns:ProductName='{safe_product}']/ns:Quantity)"
-            try:
-                total_qty = self.tree.xpath(xpath, namespaces=self.ns)
-                product_quantities[product] = total_qty
-            except:
-                continue
+            # O nome vai como variável XPath: aspas não precisam de escape
+            product_quantities[product] = queries.SUM_QUANTITY_BY_PRODUCT(self.tree, value=product)
         
         # Top 10
         top_products = sorted(product_quantities.items(), 